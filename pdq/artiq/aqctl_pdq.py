@@ -4,8 +4,6 @@ import argparse
 import sys
 import time
 
-from pdq.host.usb import PDQ
-from artiq.protocols.pc_rpc import simple_server_loop
 from artiq.tools import (verbosity_args, simple_network_args, init_logger,
     bind_address_from_args)
 
@@ -24,6 +22,15 @@ def get_argparser():
                         action="store_true", help="reset device [%(default)s]")
     parser.add_argument("-b", "--boards", default=3, type=int,
                         help="number of boards [%(default)s]")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory to cache serialized programs in "
+                        "across restarts [%(default)s]")
+    parser.add_argument("--cache-size", default=64, type=float,
+                        help="size of the in-memory program cache in MB, "
+                        "0 to disable [%(default)s]")
+    parser.add_argument("--cache-disk-size", default=1024, type=float,
+                        help="size of the on-disk program cache in MB "
+                        "[%(default)s]")
     verbosity_args(parser)
     return parser
 
@@ -38,9 +45,18 @@ def main():
               "argument. Use --help for more information.")
         sys.exit(1)
 
+    # only after the arguments are valid
+    from pdq.host.usb import PDQ
+    from pdq.host.cache import ProgramCache
+    from artiq.protocols.pc_rpc import simple_server_loop
+
     if args.simulation:
         port = open(args.dump, "wb")
     dev = PDQ(url=args.device, dev=port, num_boards=args.boards)
+    if args.cache_size or args.cache_dir is not None:
+        dev.program_cache = ProgramCache(
+            int(args.cache_size*1e6), args.cache_dir,
+            int(args.cache_disk_size*1e6))
     try:
         if args.reset:
             dev.write(b"")  # flush etx
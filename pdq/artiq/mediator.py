@@ -1,5 +1,7 @@
 from artiq.language import us, ns, delay_mu, at_mu, kernel, portable, s
 
+from ..host.profile import span
+
 
 frame_setup = 1.5*us
 sample_period = 10*ns
@@ -153,6 +155,8 @@ class _Frame:
 
 
 class CompoundPDQ:
+    profile = None  # see pdq.host.profile.Profile
+
     def __init__(self, dmgr, pdq_devices, trigger_device,
             aux_miso=0, aux_dac=0b111, clk2x=0):
         self.core = dmgr.get("core")
@@ -187,27 +191,33 @@ class CompoundPDQ:
         for frame in self.frames:
             frame._arm()
 
+        profile = self.profile
         full_program = self.get_program()
         n = 0
         for pdq in self.pdqs:
             dn = pdq.get_num_channels()
-            program = []
-            for full_frame_program in full_program:
-                frame_program = []
-                for full_line in full_frame_program:
-                    line = {
-                        "dac_divider": full_line["dac_divider"],
-                        "duration": full_line["duration"],
-                        "channel_data": full_line["channel_data"][n:n + dn],
-                        "trigger": full_line["trigger"],
-                    }
-                    frame_program.append(line)
-                program.append(frame_program)
-            pdq.program(program)
+            with span(profile, "arm.split"):
+                program = []
+                for full_frame_program in full_program:
+                    frame_program = []
+                    for full_line in full_frame_program:
+                        line = {
+                            "dac_divider": full_line["dac_divider"],
+                            "duration": full_line["duration"],
+                            "channel_data":
+                                full_line["channel_data"][n:n + dn],
+                            "trigger": full_line["trigger"],
+                        }
+                        frame_program.append(line)
+                    program.append(frame_program)
+            with span(profile, "arm.program"):
+                pdq.program(program)
             n += dn
-        for pdq in self.pdqs:
-            pdq.set_config(reset=0, clk2x=self.clk2x, enable=1, trigger=0,
-                    aux_miso=self.aux_miso, aux_dac=self.aux_dac, board=0xf)
+        with span(profile, "arm.config"):
+            for pdq in self.pdqs:
+                pdq.set_config(reset=0, clk2x=self.clk2x, enable=1, trigger=0,
+                        aux_miso=self.aux_miso, aux_dac=self.aux_dac,
+                        board=0xf)
         self.armed = True
 
     def create_frame(self):
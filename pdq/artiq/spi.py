@@ -3,6 +3,11 @@ from artiq.coredevice import spi
 from artiq.language.types import TList, TBytes
 
 from ..host.protocol import PDQBase, PDQ_CMD
+from ..host.profile import span
+from ..host import portable
+
+
+portable.embed()
 
 
 _PDQ_SPI_CONFIG = (
@@ -143,7 +148,8 @@ class PDQ(PDQBase):
         for i in range(max(0, n - 1 - buffer), n):
             data[i] = self.bus.input_async() & 0xff
 
-    def program_host(self, program, channels=None):
+    def program_host(self, program, channels=None, executor=None,
+                     workers=None):
         """Serialize a wavesynth program. The result is stored in member
         variables and returned for manual handling. Use :meth:`program_kernel`
         to write it to memory.
@@ -158,32 +164,34 @@ class PDQ(PDQBase):
         can be reliably parked in the frame address table.
         The first line of each frame is mandatorily triggered.
 
-        :param program: (list) Wavesynth program.
+        :param program: (list) Wavesynth program or
+                :class:`pdq.host.columnar.ColumnarProgram`.
         :param channels: (list[int]) Channel indices to use. If unspecified, all
                 channels are used.
+        :param executor: (concurrent.futures.Executor) Executor to serialize
+                the channels concurrently (see :meth:`encode_program`).
+        :param workers: (int) Number of worker processes to serialize the
+                channels concurrently (see :meth:`encode_program`).
 
         :return (list[int]), (list[bytes]): List of channels and list of channel
         data to be written to the hardware using :meth:`program_kernel`
         """
         if channels is None:
             channels = range(self.num_channels)
-        chs = [self.channels[i] for i in channels]
-        for channel in chs:
-            channel.clear()
-        for frame in program:
-            segments = [c.new_segment() for c in chs]
-            self.program_segments(segments, frame)
-            # append an empty line to stall the memory reader before jumping
-            # through the frame table (`wait` does not prevent reading
-            # the next line)
-            for segment in segments:
-                segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
-                             jump=True)
+        profile = self.profile
+        if profile is not None:
+            profile.count("program_host.lines", sum(len(f) for f in program))
+        with span(profile, "program_host.encode"):
+            chs = self.encode_program(program, channels, executor, workers)
         self.channel_list = []
         self.channel_data_list = []
         for channel, ch in zip(channels, chs):
             self.channel_list.append(channel)
-            self.channel_data_list.append(ch.serialize())
+            with span(profile, "program_host.serialize"):
+                data = bytes(ch.serialize())
+            if profile is not None:
+                profile.count("program_host.bytes", len(data))
+            self.channel_data_list.append(data)
         return self.channel_list, self.channel_data_list
 
     def program_rpc(self, program, channels=None) -> TList(TBytes):
@@ -0,0 +1,61 @@
+"""Benchmark the communication emulator.
+
+Reports the throughput of :class:`pdq.host.emulate.Comm` replaying the
+USB stream of memory writes. It is a few hundred MB/s, limited by
+locating the escape sequences and copying the payload into the channel
+memories. The checksum (:data:`pdq.host.protocol.crc8`) is computed
+vectorized and is not the bottleneck.
+
+Run with ``python -m pdq.bench.comm``.
+"""
+
+import argparse
+import io
+import time
+
+from ..host.emulate import Comm
+from ..host.protocol import Segment
+from ..host.usb import PDQ
+
+
+def dump(num_lines, escapes):
+    """USB stream writing lines to a channel of all boards."""
+    segment = Segment()
+    for i in range(num_lines):
+        segment.bias([.1*(i % 7), 1e-4, -1e-8, 1e-12], duration=1000)
+    mem = bytes(segment.data)
+    if not escapes:
+        mem = mem.replace(b"\xa5", b"\xa4")
+    dev = PDQ(dev=io.BytesIO(), num_boards=1, num_dacs=1)
+    dev.write_mem(0, 0, mem)
+    return dev.dev.getvalue()
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Communication
+            emulation speed benchmark.""")
+    parser.add_argument("-l", "--lines", default=1 << 14, type=int,
+                        help="number of lines [%(default)s]")
+    parser.add_argument("-b", "--boards", default=3, type=int,
+                        help="number of boards [%(default)s]")
+    parser.add_argument("-c", "--chunk", default=1 << 16, type=int,
+                        help="write size [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    print("escapes  bytes  time (s)  MB/s")
+    for escapes in False, True:
+        data = dump(args.lines, escapes)
+        comm = Comm(num_boards=args.boards, num_dacs=1,
+                    mem_depths=[len(data)//2])
+        t0 = time.perf_counter()
+        comm.readfrom(io.BytesIO(data), args.chunk)
+        dt = time.perf_counter() - t0
+        print("{:7d} {:6.1e} {:9.3f} {:5.1f}".format(
+            escapes, len(data), dt, len(data)/dt*1e-6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark the DAC channel emulator.
+
+Run with ``python -m pdq.bench.emulate``.
+"""
+
+import argparse
+import time
+
+from ..host.emulate import emulate
+from ..host.protocol import Channel
+
+
+def channel_image(typ, num_lines, duration, shift):
+    ch = Channel(1 << 13, 1)
+    segment = ch.new_segment()
+    for i in range(num_lines):
+        if typ == "bias":
+            segment.bias([.1*(i % 7), 1e-4, -1e-8, 1e-12],
+                         duration=duration, shift=shift)
+        elif typ == "dds":
+            segment.dds([.1*(i % 7), 1e-4, -1e-8, 0], [.1, 1e-2, 1e-6],
+                        duration=duration, shift=shift)
+        else:
+            # constant amplitude
+            segment.dds([.1 + .1*(i % 7), 0, 0, 0], [.1, 1e-2, 1e-6],
+                        duration=duration, shift=shift)
+    segment.terminate()
+    return bytes(ch.serialize())
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Emulation speed
+            benchmark.""")
+    parser.add_argument("-n", "--cycles", default=1 << 24, type=int,
+                        help="clock cycles to emulate [%(default)s]")
+    parser.add_argument("-l", "--lines", default=100, type=int,
+                        help="number of lines [%(default)s]")
+    parser.add_argument("-d", "--duration", default=60000, type=int,
+                        help="line duration [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    print("type  shift  cycles  time (s)  samples/s")
+    for typ, shift in ("bias", 0), ("bias", 3), ("dds", 0), ("tone", 0):
+        mem = channel_image(typ, args.lines, args.duration, shift)
+        emulate(mem, 1000)
+        t0 = time.perf_counter()
+        emulate(mem, args.cycles)
+        dt = time.perf_counter() - t0
+        print("{:5s} {:6d} {:7.1e} {:9.3f} {:10.3g}".format(
+            typ, shift, args.cycles, dt, args.cycles/dt))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Benchmark the tolerance fitter on long waveforms.
+
+Run with ``python -m pdq.bench.fit``.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from ..host.fit import fit
+
+
+def waveform(n, step):
+    t = np.arange(n)*step
+    x = t/t[-1]
+    v = 5*np.sin(2*np.pi*3*x) + .5*np.cos(2*np.pi*17*x**2)
+    return t, v
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Fit time and memory
+            benchmark of the tolerance fitter.""")
+    parser.add_argument("-n", "--samples", default=[100000, 1000000],
+                        type=int, nargs="+",
+                        help="numbers of samples [%(default)s]")
+    parser.add_argument("-s", "--step", default=1, type=int,
+                        help="sample interval in clock cycles "
+                             "[%(default)s]")
+    parser.add_argument("-l", "--tolerance", default=1e-3, type=float,
+                        help="tolerance (V) [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    print(" samples    lines   fit (s)  peak (MB)  input (MB)")
+    for n in args.samples:
+        t, v = waveform(n, args.step)
+        t0 = time.perf_counter()
+        lines = fit(t, v, args.tolerance)
+        dt = time.perf_counter() - t0
+        tracemalloc.start()
+        fit(t, v, args.tolerance)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:8d} {:8d} {:9.3f} {:10.2f} {:11.2f}".format(
+            n, len(lines), dt, peak/1e6, (t.nbytes + v.nbytes)/1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark serial and parallel serialization of wavesynth programs.
+
+Run with ``python -m pdq.bench.parallel``.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+from ..host.protocol import PDQBase
+
+
+class NullPDQ(PDQBase):
+    """PDQ stack that discards memory writes."""
+    def write_mem(self, mem, adr, data, board=0xf):
+        pass
+
+
+def make_program(num_frames, num_lines, num_channels):
+    return [
+        [
+            {
+                "duration": 10 + j,
+                "channel_data": [
+                    {"bias": {"amplitude": [
+                        .1*i + .01*k, 1e-3*j, 1e-5*k, -1e-7]}}
+                    if k % 3 != 2 else
+                    {"dds": {"amplitude": [.5, 1e-3*j, 0, 1e-8],
+                             "phase": [.1*(i % 4), .01, 1e-5*j]}}
+                    for k in range(num_channels)
+                ],
+            }
+            for j in range(num_lines)
+        ]
+        for i in range(num_frames)
+    ]
+
+
+def best_of(repeat, f, *args, **kwargs):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        f(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Serial versus parallel
+            wavesynth program serialization benchmark.""")
+    parser.add_argument("-f", "--frames", default=16, type=int,
+                        help="frames per program [%(default)s]")
+    parser.add_argument("-l", "--lines", default=30, type=int,
+                        help="lines per frame [%(default)s]")
+    parser.add_argument("-w", "--workers", default=None, type=int,
+                        help="worker processes [number of cpus]")
+    parser.add_argument("-r", "--repeat", default=5, type=int,
+                        help="repetitions, best is reported [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    with ProcessPoolExecutor(args.workers) as executor:
+        print("channels   serial (s) parallel (s)  speedup")
+        for num_channels in 3, 6, 9:
+            dev = NullPDQ(num_boards=3, num_frames=args.frames,
+                          cache_size=0)
+            program = make_program(args.frames, args.lines, num_channels)
+            channels = range(num_channels)
+            dev.program(program, channels, executor=executor)  # warm up
+            serial = best_of(args.repeat, dev.program, program, channels)
+            parallel = best_of(args.repeat, dev.program, program, channels,
+                               executor=executor)
+            print("{:8d} {:12.4f} {:12.4f} {:8.2f}".format(
+                num_channels, serial, parallel, serial/parallel))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark programming through a local ``aqctl_pdq`` controller.
+
+Compares sending the wavesynth program as nested dictionaries
+(``program``), as base64 encoded memory images serialized by the client
+(``program_image``) and as a base64 encoded columnar program
+(``program_columnar``). The controller is started in simulation mode
+writing to the null device. For each method the total duration of the
+remote call, the duration of the same call on a local device (upload)
+and their difference (RPC) are reported.
+
+Requires ARTIQ. Run with ``python -m pdq.bench.rpc``.
+"""
+
+import argparse
+import base64
+import os
+import subprocess
+import sys
+import time
+
+from artiq.protocols import pyon
+from artiq.protocols.pc_rpc import Client
+
+from ..host.columnar import ColumnarProgram
+from ..host.usb import PDQ
+from .suite import make_program, best_of
+from .usb import NullDev
+
+
+def connect(port, timeout=10.):
+    t0 = time.monotonic()
+    while True:
+        try:
+            return Client("127.0.0.1", port, "pdq")
+        except OSError:
+            if time.monotonic() - t0 > timeout:
+                raise
+            time.sleep(.1)
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Controller RPC
+            benchmark.""")
+    parser.add_argument("-f", "--frames", default=8, type=int,
+                        help="frames per program [%(default)s]")
+    parser.add_argument("-l", "--lines", default=32, type=int,
+                        help="lines per frame [%(default)s]")
+    parser.add_argument("-d", "--dds", default=1/3, type=float,
+                        help="fraction of DDS channels [%(default)s]")
+    parser.add_argument("-r", "--repeat", default=5, type=int,
+                        help="repetitions, best is reported [%(default)s]")
+    parser.add_argument("-p", "--port", default=3299, type=int,
+                        help="controller port [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    num_boards = 3
+    program = make_program(args.frames, args.lines, 3*num_boards, args.dds)
+    columnar = ColumnarProgram.from_program(program)
+    local = PDQ(dev=NullDev(), num_boards=num_boards, num_frames=32,
+                cache_size=0)
+
+    t0 = time.perf_counter()
+    image = base64.b64encode(local.encode_image(program)).decode()
+    t_image = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    data = base64.b64encode(columnar.to_bytes()).decode()
+    t_columnar = time.perf_counter() - t0
+
+    calls = [
+        ("program", "program", (program,), {"force_full": True}, 0.),
+        ("image", "program_image", (image,), {"force_full": True},
+         t_image),
+        ("columnar", "program_columnar", (data,), {"force_full": True},
+         t_columnar),
+    ]
+
+    controller = subprocess.Popen([
+        sys.executable, "-m", "pdq.artiq.aqctl_pdq", "--simulation",
+        "--dump", os.devnull, "--bind", "127.0.0.1", "-p", str(args.port),
+        "-b", str(num_boards), "--cache-size", "0"])
+    try:
+        client = connect(args.port)
+        try:
+            print("method    payload (kB)  client (ms)  total (ms)  "
+                  "upload (ms)  RPC (ms)")
+            for name, method, a, kw, t_client in calls:
+                size = len(pyon.encode(a))
+                total = best_of(args.repeat, getattr(client, method),
+                                *a, **kw)
+                upload = best_of(args.repeat, getattr(local, method),
+                                 *a, **kw)
+                print("{:9s} {:12.1f} {:12.2f} {:11.2f} {:12.2f} "
+                      "{:9.2f}".format(
+                          name, size*1e-3, t_client*1e3, total*1e3,
+                          upload*1e3, (total - upload)*1e3))
+        finally:
+            client.close_rpc()
+    finally:
+        controller.terminate()
+        controller.wait()
+
+
+if __name__ == "__main__":
+    main()
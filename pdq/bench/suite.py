@@ -0,0 +1,231 @@
+"""Host side benchmark suite.
+
+Measures the serialization of synthetic wavesynth programs,
+re-programming with a single changed frame, the checksum, escaping,
+splitting programs over stacks and the memory use without any hardware.
+The results and the environment are written as JSON to allow tracking
+them across releases.
+
+Run with ``python -m pdq.bench.suite``.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from ..host.protocol import crc8
+from ..host.group import split_program
+from ..host.profile import Profile
+from ..host.usb import PDQ
+from .usb import NullDev
+
+
+def make_program(num_frames, num_lines, num_channels, dds=1/3, seed=0):
+    """Generate a random wavesynth program.
+
+    Args:
+        num_frames (int): Number of frames.
+        num_lines (int): Number of lines per frame.
+        num_channels (int): Number of channels.
+        dds (float): Fraction of channels with DDS data, the others have
+            bias data.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        list: Wavesynth program.
+    """
+    rng = np.random.RandomState(seed)
+    num_dds = int(round(dds*num_channels))
+    program = []
+    for i in range(num_frames):
+        frame = []
+        for j in range(num_lines):
+            channel_data = []
+            for k in range(num_channels):
+                c = rng.uniform(-1, 1, 4)*[5, 1e-3, 1e-6, 1e-9]
+                if k < num_channels - num_dds:
+                    channel_data.append(
+                        {"bias": {"amplitude": c.tolist()}})
+                else:
+                    p = rng.uniform(0, 1, 3)*[.5, 1e-2, 1e-5]
+                    channel_data.append({"dds": {
+                        "amplitude": c.tolist(), "phase": p.tolist(),
+                        "clear": bool(j == 0)}})
+            frame.append({
+                "duration": int(rng.randint(10, 1000)),
+                "trigger": j == 0,
+                "channel_data": channel_data,
+            })
+        program.append(frame)
+    return program
+
+
+def best_of(repeat, f, *args, **kwargs):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        f(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def environment():
+    import pdq
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "numpy": np.__version__,
+        "pdq": getattr(pdq, "__version__", None),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def bench_program(args, program, dev_factory):
+    dev = dev_factory()
+    lines = sum(len(frame) for frame in program)
+
+    def run():
+        dev.program(program, force_full=True)
+
+    t = best_of(args.repeat, run)
+    tracemalloc.start()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    dev.profile = Profile()
+    run()
+    return {
+        "time": t,
+        "lines_per_s": lines/t,
+        "bytes": dev.profile.counts["program.bytes"],
+        "memory_peak": peak,
+        "phases": dev.profile.times,
+    }
+
+
+def bench_reprogram(args, program, dev_factory):
+    uncached = dev_factory(cache_size=0)
+    t_full = best_of(args.repeat, uncached.program, program,
+                     force_full=True)
+    dev = dev_factory()
+    dev.program(program)
+    frame = program[len(program)//2]
+    line = frame[len(frame)//2]
+
+    def run():
+        # one changed frame, the others are cached
+        line["duration"] ^= 1
+        dev.program(program)
+
+    t = best_of(args.repeat, run)
+    num = len(uncached.channels)
+    t_key = best_of(args.repeat, lambda: [
+        dev.frame_key(frame, num) for frame in program])
+    return {"time_full": t_full, "time_one_changed": t,
+            "time_keys": t_key, "speedup": t_full/t}
+
+
+def bench_crc(args, rng):
+    r = {}
+    for size in 64, 1 << 12, 1 << 20:
+        data = rng.bytes(size)
+        n = max(1, (1 << 22)//size)
+
+        def run():
+            for i in range(n):
+                crc8(data)
+
+        t = best_of(args.repeat, run)
+        r[str(size)] = {"time": t/n, "bytes_per_s": size*n/t}
+    return r
+
+
+def bench_escape(args, rng):
+    r = {}
+    size = 1 << 22
+    data = {
+        "none": rng.bytes(size).replace(b"\xa5", b"\xa4"),
+        "random": rng.bytes(size),
+        "all": b"\xa5"*size,
+    }
+    for name, buf in sorted(data.items()):
+        dev = PDQ(dev=NullDev())
+        t = best_of(args.repeat, dev.write, buf)
+        r[name] = {"time": t, "bytes_per_s": size/t}
+    return r
+
+
+def bench_split(args, program):
+    num_channels = [3]*((args.channels + 2)//3)
+    num_channels[-1] -= sum(num_channels) - args.channels
+    t = best_of(args.repeat, split_program, program, num_channels)
+    lines = sum(len(frame) for frame in program)
+    return {"time": t, "lines_per_s": lines/t}
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""Host side benchmark
+            suite. Writes the results as JSON.""")
+    parser.add_argument("-f", "--frames", default=8, type=int,
+                        help="frames per program [%(default)s]")
+    parser.add_argument("-l", "--lines", default=32, type=int,
+                        help="lines per frame [%(default)s]")
+    parser.add_argument("-c", "--channels", default=9, type=int,
+                        help="channels [%(default)s]")
+    parser.add_argument("-d", "--dds", default=1/3, type=float,
+                        help="fraction of DDS channels [%(default)s]")
+    parser.add_argument("-s", "--seed", default=0, type=int,
+                        help="random seed [%(default)s]")
+    parser.add_argument("-r", "--repeat", default=5, type=int,
+                        help="repetitions, best is reported [%(default)s]")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output file [stdout]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    rng = np.random.RandomState(args.seed)
+    program = make_program(args.frames, args.lines, args.channels,
+                           args.dds, args.seed)
+    geometry = dict(num_boards=(args.channels + 2)//3,
+                    num_frames=args.frames, cache_size=0)
+
+    def cached(**kwargs):
+        kw = dict(geometry, cache_size=1 << 22)
+        kw.update(kwargs)
+        return PDQ(dev=NullDev(), **kw)
+
+    results = {
+        "environment": environment(),
+        "parameters": vars(args),
+        "program_bytesio": bench_program(
+            args, program, lambda: PDQ(dev=io.BytesIO(), **geometry)),
+        "program_null": bench_program(
+            args, program, lambda: PDQ(dev=NullDev(), **geometry)),
+        "crc": bench_crc(args, rng),
+        "escape": bench_escape(args, rng),
+        "split": bench_split(args, program),
+        "reprogram": bench_reprogram(args, program, cached),
+    }
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark escaping and writing to the USB device.
+
+Run with ``python -m pdq.bench.usb``.
+"""
+
+import argparse
+import os
+import time
+
+from ..host.protocol import crc8
+from ..host.usb import PDQ
+
+
+class NullDev:
+    """Device that discards the data."""
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class WholePDQ(PDQ):
+    """Previous implementation: escape and write each buffer at once."""
+    def write(self, *data):
+        self._write(b"\xa5\x02")
+        for part in data:
+            self.checksum = crc8(part, self.checksum)
+            if b"\xa5" in part:
+                part = part.replace(b"\xa5", b"\xa5\xa5")
+            self._write(part)
+        self._write(b"\xa5\x03")
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""USB write speed
+            benchmark.""")
+    parser.add_argument("-s", "--size", default=1 << 24, type=int,
+                        help="bytes per write [%(default)s]")
+    parser.add_argument("-c", "--chunk", default=1 << 16, type=int,
+                        help="chunk size [%(default)s]")
+    return parser
+
+
+def main(args=None):
+    args = get_argparser().parse_args(args)
+    data = {
+        "random": os.urandom(args.size),
+        "no escapes": os.urandom(args.size).replace(b"\xa5", b"\xa4"),
+    }
+    print("data        implementation  time (s)  MB/s")
+    for name, buf in sorted(data.items()):
+        for impl, cls in ("whole", WholePDQ), ("chunked", PDQ):
+            dev = cls(dev=NullDev(), chunk_size=args.chunk)
+            t0 = time.perf_counter()
+            dev.write(buf)
+            dt = time.perf_counter() - t0
+            print("{:11s} {:15s} {:8.3f} {:5.0f}".format(
+                name, impl, dt, len(buf)/dt*1e-6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import time
+
+
+def canonical_hash(obj):
+    """Hash a wavesynth program or parts of it.
+
+    Equal objects that are built the same way hash equal, independent
+    of their identity. Differences in dictionary item order or in the
+    types of numbers lead to different hashes but unequal objects never
+    share a hash.
+
+    Args:
+        obj: Object composed of dictionaries, lists, tuples, strings,
+            numbers and NumPy arrays and scalars.
+
+    Returns:
+        str: Hexadecimal SHA-1 digest.
+    """
+    return hashlib.sha1(pickle.dumps(obj, 4)).hexdigest()
+
+
+class LRUCache:
+    """Least recently used cache with a size budget.
+
+    Args:
+        size (int): Maximum total size of the cached values in bytes.
+
+    Attributes:
+        size (int): Maximum total size of the cached values in bytes.
+        used (int): Total size of the cached values in bytes.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Look up a value and mark it as recently used.
+
+        Args:
+            key: Key of the value.
+
+        Returns:
+            The value or ``None`` if it is not cached.
+        """
+        try:
+            value, size = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size):
+        """Add a value to the cache.
+
+        Least recently used values are evicted until the value fits.
+        Values larger than the budget are not cached.
+
+        Args:
+            key: Key of the value.
+            value: Value to cache.
+            size (int): Size of the value in bytes.
+        """
+        self.pop(key)
+        if size > self.size:
+            return
+        while self.used + size > self.size:
+            self.popitem()
+        self._items[key] = value, size
+        self.used += size
+
+    def pop(self, key):
+        """Remove a value from the cache.
+
+        Args:
+            key: Key of the value.
+
+        Returns:
+            The value or ``None`` if it was not cached.
+        """
+        try:
+            value, size = self._items.pop(key)
+        except KeyError:
+            return None
+        self.used -= size
+        return value
+
+    def popitem(self):
+        """Evict the least recently used value.
+
+        Returns:
+            tuple: Key and value.
+        """
+        key, (value, size) = self._items.popitem(last=False)
+        self.used -= size
+        return key, value
+
+    def clear(self):
+        """Remove all values."""
+        self._items.clear()
+        self.used = 0
+
+
+def program_hash(program, channels=None):
+    """Key of a program in a :class:`ProgramCache`.
+
+    Clients can compute the key of a program without sending it (see
+    :meth:`pdq.host.protocol.PDQBase.has_program`).
+
+    Args:
+        program (list): Wavesynth program.
+        channels (list[int]): Channel indices the program is written to or
+            ``None`` for all channels.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    if channels is not None:
+        channels = [int(channel) for channel in channels]
+    return canonical_hash([program, channels])
+
+
+class ProgramCache:
+    """Memory and disk cache of serialized programs.
+
+    The values are the contents of memory image files (see
+    :mod:`pdq.host.image`). Recently used values are kept in memory. If a
+    directory is given, all values are also stored there as
+    ``<key>.pdqimg`` files and survive restarts. Both are limited in size
+    and evict the least recently used values (on disk by modification
+    time, which is updated on use).
+
+    Args:
+        size (int): Memory budget in bytes.
+        directory (str): Directory to store the values in or ``None``.
+        disk_size (int): Disk budget in bytes.
+
+    Attributes:
+        memory (LRUCache): The values held in memory.
+        directory (str): The directory or ``None``.
+        disk_size (int): Disk budget in bytes.
+    """
+    suffix = ".pdqimg"
+
+    def __init__(self, size=1 << 26, directory=None, disk_size=1 << 30):
+        self.memory = LRUCache(size)
+        self.directory = directory
+        self.disk_size = disk_size
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not all(c in "0123456789abcdef" for c in key):
+            raise ValueError("invalid key")
+        return os.path.join(self.directory, key + self.suffix)
+
+    def __contains__(self, key):
+        if key in self.memory:
+            return True
+        return self.directory is not None and os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Look up a value.
+
+        Values found on disk are moved into memory.
+
+        Args:
+            key (str): Key as returned by :func:`program_hash`.
+
+        Returns:
+            bytes: The value or ``None`` if it is not cached.
+        """
+        value = self.memory.get(key)
+        if value is not None or self.directory is None:
+            return value
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        self.memory.put(key, value, len(value))
+        return value
+
+    def put(self, key, value):
+        """Add a value.
+
+        Args:
+            key (str): Key as returned by :func:`program_hash`.
+            value (bytes): Memory image file content.
+        """
+        self.memory.put(key, value, len(value))
+        if self.directory is None or len(value) > self.disk_size:
+            return
+        path = self._path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+        self._touch(path)
+        self._evict()
+
+    @staticmethod
+    def _touch(path):
+        # explicit time: the file system may use coarse timestamps
+        t = time.time()
+        os.utime(path, (t, t))
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                st = os.stat(os.path.join(self.directory, name))
+                files.append((st.st_mtime, st.st_size, name))
+        used = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if used <= self.disk_size:
+                break
+            os.unlink(os.path.join(self.directory, name))
+            used -= size
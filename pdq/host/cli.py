@@ -17,19 +17,12 @@
 # along with pdq.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import numpy as np
-try:
-    from scipy import interpolate
-except ImportError:
-    import warnings
-    warnings.warn("no scipy found, will not inteprolate")
-    interpolate = None
-
-from .usb import PDQ
-
 import argparse
 import time
 
+# numpy, scipy and the device code are imported when needed to keep
+# the startup (e.g. --help) fast
+
 
 def get_argparser():
     parser = argparse.ArgumentParser(description="""PDQ frontend.
@@ -49,6 +42,10 @@ def get_argparser():
     parser.add_argument("-o", "--order", default=3, type=int,
                         help="interpolation (0: const, 1: lin, 2: quad,"
                         " 3: cubic) [%(default)s]")
+    parser.add_argument("-l", "--tolerance", default=None, type=float,
+                        help="fit the fewest lines within this tolerance "
+                        "(V) instead of one line per sample interval "
+                        "[%(default)s]")
     parser.add_argument("-a", "--aux-miso", default=False, action="store_true",
                         help="route MISO to AUX/F5 TTL output [%(default)s]")
     parser.add_argument("-k", "--aux-dac", default=0b111, type=int,
@@ -65,6 +62,15 @@ def get_argparser():
                         help="software trigger [%(default)s]")
     parser.add_argument("-d", "--debug", default=False,
                         action="store_true", help="debug communications")
+    parser.add_argument("-p", "--profile", default=False,
+                        action="store_true",
+                        help="print a breakdown of the time spent in the "
+                        "phases of programming [%(default)s]")
+    commands = parser.add_subparsers(dest="command")
+    load = commands.add_parser(
+        "load", help="upload a memory image file saved with "
+        "PDQBase.save_image() instead of the samples")
+    load.add_argument("image", help="image file (.pdqimg)")
     return parser
 
 
@@ -73,7 +79,8 @@ def main(dev=None, args=None):
 
     Parse command line arguments, configures PDQ stack, interpolate the
     time/voltage data using a spline, generate a wavesynth program from the
-    data and upload it to the specified channel. Then perform the desired
+    data and upload it to the specified channel (or upload a memory image
+    file with ``pdq load``). Then perform the desired
     arming/triggering/starting functions on the stack.
     """
     parser = get_argparser()
@@ -84,53 +91,101 @@ def main(dev=None, args=None):
     else:
         logging.basicConfig(level=logging.WARNING)
 
+    from .usb import PDQ
+    from .profile import Profile
+
+    geometry = {}
+    if args.command == "load":
+        from .image import PDQImage
+        with PDQImage.open(args.image) as image:
+            geometry = image.geometry()
+
     if args.dump:
         dev = open(args.dump, "wb")
-    dev = PDQ(args.serial, dev)
+    dev = PDQ(args.serial, dev, **geometry)
+    if args.profile:
+        dev.profile = Profile()
 
     if args.reset:
-        dev.write(b"")  # flush eop
-        dev.set_config(reset=True)
+        with dev.batch():
+            dev.write(b"")  # flush eop
+            dev.set_config(reset=True)
         time.sleep(.1)
 
-    dev.set_crc(0)
-    dev.checksum = 0
+    with dev.batch():
+        dev.set_crc(0)
+        dev.checksum = 0
+        dev.set_config(reset=False, clk2x=args.multiplier, enable=False,
+                       trigger=False, aux_miso=args.aux_miso,
+                       aux_dac=args.aux_dac, board=0xf)
+
+    if args.command == "load":
+        dev.load_image(args.image)
+    else:
+        upload_samples(dev, args)
+
+    with dev.batch():
+        dev.set_frame(args.frame)
+        dev.set_config(reset=False, clk2x=args.multiplier,
+                       enable=not args.disarm, trigger=args.free,
+                       aux_miso=args.aux_miso, aux_dac=args.aux_dac,
+                       board=0xf)
+
+    if args.profile:
+        print(dev.profile.report())
+
+
+def upload_samples(dev, args):
+    """Evaluate and interpolate the samples and upload them."""
+    import numpy as np
+    from .profile import span
 
     freq = 50e6
     if args.multiplier:
         freq *= 2
 
-    times = np.around(eval(args.times, globals(), {})*freq)
-    voltages = eval(args.voltages, globals(), dict(t=times/freq))
-
-    dev.set_config(reset=False, clk2x=args.multiplier, enable=False,
-                   trigger=False, aux_miso=args.aux_miso,
-                   aux_dac=args.aux_dac, board=0xf)
+    times = np.around(eval(args.times, dict(np=np), {})*freq)
+    voltages = eval(args.voltages, dict(np=np), dict(t=times/freq))
 
-    dt = np.diff(times.astype(np.int))
-    if args.order and interpolate:
-        tck = interpolate.splrep(times, voltages, k=args.order, s=0)
-        u = interpolate.spalde(times, tck)
-    else:
-        u = voltages[:, None]
-    segment = []
-    for dti, ui in zip(dt, u):
-        segment.append({
-            "duration": int(dti),
-            "channel_data": [{
-                "bias": {
-                    "amplitude": [float(uij) for uij in ui]
-                }
-            }]
-        })
+    with span(dev.profile, "interpolate"):
+        segment = interpolate_segment(times, voltages, args)
     program = [[] for i in range(dev.channels[args.channel].num_frames)]
     program[args.frame] = segment
     dev.program(program, [args.channel])
 
-    dev.set_frame(args.frame)
-    dev.set_config(reset=False, clk2x=args.multiplier, enable=not args.disarm,
-                   trigger=args.free, aux_miso=args.aux_miso,
-                   aux_dac=args.aux_dac, board=0xf)
+
+def interpolate_segment(times, voltages, args):
+    """Generate the wavesynth lines of a frame from the samples."""
+    import numpy as np
+
+    if args.tolerance is not None:
+        from .fit import fit
+        segment = fit(times, voltages, args.tolerance, args.order)
+    else:
+        dt = np.diff(times.astype(int))
+        interpolate = None
+        if args.order:
+            try:
+                from scipy import interpolate
+            except ImportError:
+                import warnings
+                warnings.warn("no scipy found, will not inteprolate")
+        if interpolate:
+            tck = interpolate.splrep(times, voltages, k=args.order, s=0)
+            u = interpolate.spalde(times, tck)
+        else:
+            u = voltages[:, None]
+        segment = []
+        for dti, ui in zip(dt, u):
+            segment.append({
+                "duration": int(dti),
+                "channel_data": [{
+                    "bias": {
+                        "amplitude": [float(uij) for uij in ui]
+                    }
+                }]
+            })
+    return segment
 
 
 if __name__ == "__main__":
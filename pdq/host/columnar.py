@@ -0,0 +1,301 @@
+import io
+
+import numpy as np
+
+
+BIAS, DDS = 0, 1
+_targets = ["bias", "dds"]
+
+
+class ColumnarFrame:
+    """A frame of a wavesynth program stored as NumPy arrays.
+
+    Equivalent to a list of wavesynth lines (see :ref:`wavesynth-format`)
+    with ``C`` channels and ``N`` lines. Unused coefficients are ignored.
+
+    Args:
+        duration (array[N]): Durations of the lines.
+        amplitude (array[C, N, M]): Bias or DDS amplitude coefficients,
+            ``M <= 4``.
+        num_amplitude (array[C, N]): Number of amplitude coefficients of
+            each line and channel. Defaults to ``M``.
+        typ (array[C, N]): Target of each line and channel: :data:`BIAS`
+            or :data:`DDS`. Defaults to bias.
+        phase (array[C, N, K]): DDS phase coefficients, ``K <= 3``.
+        num_phase (array[C, N]): Number of phase coefficients of each
+            line and channel. Defaults to ``K`` for DDS lines.
+        shift (array[N]): Duration and spline evolution exponent
+            (``log2(dac_divider)``).
+        trigger (array[N]): Wait for a trigger before the line.
+        silence (array[C, N]): Disable the DAC clock during the line.
+        aux (array[C, N]): Assert the AUX output during the line.
+        clear (array[C, N]): Clear the DDS phase accumulator.
+
+    All arguments except ``amplitude`` may also be scalars applying to
+    all lines (and channels).
+    """
+    def __init__(self, duration, amplitude, num_amplitude=None, typ=BIAS,
+                 phase=None, num_phase=None, shift=0, trigger=False,
+                 silence=False, aux=False, clear=False):
+        self.amplitude = np.asarray(amplitude, dtype=np.float64)
+        if self.amplitude.ndim != 3 or self.amplitude.shape[2] > 4:
+            raise ValueError("amplitude must be of shape (C, N, M <= 4)")
+        c, n, m = self.amplitude.shape
+        self.duration = np.broadcast_to(duration, (n,)).astype(np.int64)
+        self.shift = np.broadcast_to(shift, (n,)).astype(np.uint8)
+        self.trigger = np.broadcast_to(trigger, (n,)).astype(np.bool_)
+        if num_amplitude is None:
+            num_amplitude = m
+        self.num_amplitude = np.broadcast_to(
+            num_amplitude, (c, n)).astype(np.uint8)
+        self.typ = np.broadcast_to(typ, (c, n)).astype(np.uint8)
+        if phase is None:
+            phase = np.zeros((c, n, 0))
+        self.phase = np.asarray(phase, dtype=np.float64)
+        if self.phase.shape[:2] != (c, n) or self.phase.shape[2] > 3:
+            raise ValueError("phase must be of shape (C, N, K <= 3)")
+        if num_phase is None:
+            num_phase = np.where(self.typ == DDS, self.phase.shape[2], 0)
+        self.num_phase = np.broadcast_to(num_phase, (c, n)).astype(np.uint8)
+        self.silence = np.broadcast_to(silence, (c, n)).astype(np.bool_)
+        self.aux = np.broadcast_to(aux, (c, n)).astype(np.bool_)
+        self.clear = np.broadcast_to(clear, (c, n)).astype(np.bool_)
+
+    def __len__(self):
+        return len(self.duration)
+
+    @property
+    def num_channels(self):
+        return self.amplitude.shape[0]
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays in bytes."""
+        return sum(a.nbytes for a in vars(self).values())
+
+    @classmethod
+    def from_lines(cls, data, num_channels=None):
+        """Convert a list of wavesynth lines.
+
+        Args:
+            data (list): List of wavesynth lines.
+            num_channels (int): Number of channels. Defaults to the number
+                of channels of the first line.
+
+        Returns:
+            ColumnarFrame: Equivalent frame. The lines are not modified.
+        """
+        n = len(data)
+        if num_channels is None:
+            num_channels = len(data[0]["channel_data"]) if n else 0
+        c = num_channels
+        kw = dict(
+            duration=np.zeros(n, np.int64),
+            amplitude=np.zeros((c, n, 4)),
+            num_amplitude=np.zeros((c, n), np.uint8),
+            typ=np.zeros((c, n), np.uint8),
+            phase=np.zeros((c, n, 3)),
+            num_phase=np.zeros((c, n), np.uint8),
+            shift=np.zeros(n, np.uint8),
+            trigger=np.zeros(n, np.bool_),
+            silence=np.zeros((c, n), np.bool_),
+            aux=np.zeros((c, n), np.bool_),
+            clear=np.zeros((c, n), np.bool_),
+        )
+        for j, line in enumerate(data):
+            dac_divider = line.get("dac_divider", 1)
+            shift = dac_divider.bit_length() - 1
+            if 1 << shift != dac_divider:
+                raise ValueError("only power-of-two dac_dividers supported")
+            kw["shift"][j] = shift
+            kw["duration"][j] = line["duration"]
+            kw["trigger"][j] = line.get("trigger", False)
+            for i, channel_data in enumerate(line["channel_data"][:c]):
+                kw["silence"][i, j] = channel_data.get("silence", False)
+                targets = [t for t in channel_data if t != "silence"]
+                if len(targets) != 1:
+                    raise ValueError("only one target per channel and line "
+                                     "supported")
+                target = targets[0]
+                kw["typ"][i, j] = _targets.index(target)
+                args = dict(channel_data[target])
+                a = args.pop("amplitude", [])
+                kw["amplitude"][i, j, :len(a)] = a
+                kw["num_amplitude"][i, j] = len(a)
+                if target == "dds":
+                    p = args.pop("phase", [])
+                    kw["phase"][i, j, :len(p)] = p
+                    kw["num_phase"][i, j] = len(p)
+                for flag in "aux", "clear":
+                    kw[flag][i, j] = args.pop(flag, False)
+                if args:
+                    raise ValueError("unsupported arguments {}".format(
+                        sorted(args)))
+        return cls(**kw)
+
+    def to_lines(self):
+        """Convert to a list of wavesynth lines.
+
+        Returns:
+            list: List of wavesynth lines.
+        """
+        data = []
+        for j in range(len(self)):
+            channel_data = []
+            for i in range(self.num_channels):
+                target = _targets[self.typ[i, j]]
+                args = {"amplitude": self.amplitude[
+                    i, j, :self.num_amplitude[i, j]].tolist()}
+                if self.num_phase[i, j]:
+                    args["phase"] = self.phase[
+                        i, j, :self.num_phase[i, j]].tolist()
+                for flag in "aux", "clear":
+                    if getattr(self, flag)[i, j]:
+                        args[flag] = True
+                channel_data.append({target: args})
+                if self.silence[i, j]:
+                    channel_data[-1]["silence"] = True
+            data.append({
+                "duration": int(self.duration[j]),
+                "dac_divider": 1 << int(self.shift[j]),
+                "trigger": bool(self.trigger[j]),
+                "channel_data": channel_data,
+            })
+        return data
+
+    def split(self, num_channels):
+        """Split by channel.
+
+        Args:
+            num_channels (int): Number of channels to split into.
+
+        Returns:
+            list[ColumnarLines]: The lines of each channel.
+        """
+        return [ColumnarLines(self, i) for i in range(
+            min(num_channels, self.num_channels))] + [
+                ColumnarLines(None, None)
+                for i in range(self.num_channels, num_channels)]
+
+
+class ColumnarLines:
+    """The lines of one channel of a :class:`ColumnarFrame`.
+
+    Args:
+        frame (ColumnarFrame): Frame or ``None`` for no lines.
+        channel (int): Channel index.
+    """
+    def __init__(self, frame, channel):
+        self.columns = None
+        if frame is not None:
+            i = channel
+            self.columns = (
+                frame.duration, frame.shift, frame.trigger,
+                frame.typ[i], frame.amplitude[i], frame.num_amplitude[i],
+                frame.phase[i], frame.num_phase[i], frame.silence[i],
+                frame.aux[i], frame.clear[i])
+
+    def encode(self, segment):
+        """Append the lines to a segment.
+
+        Consecutive lines with the same target and numbers of
+        coefficients are serialized at once using :meth:`Segment.bias_many`
+        and :meth:`Segment.dds_many`. The data is identical to that of the
+        equivalent wavesynth lines.
+
+        Args:
+            segment (Segment): Segment to append to.
+        """
+        if self.columns is None:
+            return
+        (duration, shift, trigger, typ, amplitude, num_amplitude, phase,
+         num_phase, silence, aux, clear) = self.columns
+        n = len(duration)
+        if not n:
+            return
+        layout = (typ.astype(np.int64) << 16 |
+                  num_amplitude.astype(np.int64) << 8 | num_phase)
+        breaks = np.flatnonzero(layout[1:] != layout[:-1]) + 1
+        for start, stop in zip(np.r_[0, breaks], np.r_[breaks, n]):
+            run = slice(start, stop)
+            kwargs = dict(
+                duration=duration[run], shift=shift[run],
+                trigger=trigger[run], silence=silence[run], aux=aux[run],
+                clear=clear[run])
+            a = amplitude[run, :num_amplitude[start]]
+            if typ[start] == BIAS:
+                segment.bias_many(amplitude=a, **kwargs)
+            else:
+                segment.dds_many(
+                    amplitude=a, phase=phase[run, :num_phase[start]],
+                    **kwargs)
+
+
+class ColumnarProgram(list):
+    """A wavesynth program as a list of :class:`ColumnarFrame`.
+
+    Can be passed to :meth:`pdq.host.protocol.PDQBase.program` and
+    :meth:`pdq.artiq.spi.PDQ.program_host` instead of the nested
+    dictionaries of the wavesynth format. The serialized data is
+    identical but the program uses a fraction of the memory and is
+    serialized faster.
+    """
+    @classmethod
+    def from_program(cls, program, num_channels=None):
+        """Convert a wavesynth program.
+
+        Args:
+            program (list): Wavesynth program.
+            num_channels (int): Number of channels. Defaults to the number
+                of channels in the first line of each frame.
+
+        Returns:
+            ColumnarProgram: Equivalent program.
+        """
+        return cls(ColumnarFrame.from_lines(frame, num_channels)
+                   for frame in program)
+
+    def to_program(self):
+        """Convert to a wavesynth program.
+
+        Returns:
+            list: Wavesynth program.
+        """
+        return [frame.to_lines() for frame in self]
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays in bytes."""
+        return sum(frame.nbytes for frame in self)
+
+    def to_bytes(self):
+        """Serialize the arrays.
+
+        Returns:
+            bytes: The arrays of all frames in the NumPy ``.npz`` format.
+        """
+        arrays = {"num_frames": np.array(len(self))}
+        for i, frame in enumerate(self):
+            for name, value in vars(frame).items():
+                arrays["{}.{}".format(i, name)] = value
+        f = io.BytesIO()
+        np.savez(f, **arrays)
+        return f.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a program serialized with :meth:`to_bytes`.
+
+        Args:
+            data (bytes): Serialized program.
+
+        Returns:
+            ColumnarProgram: The program.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            frames = [{} for i in range(int(arrays["num_frames"]))]
+            for key in arrays.files:
+                if key != "num_frames":
+                    i, name = key.split(".")
+                    frames[int(i)][name] = arrays[key]
+        return cls(ColumnarFrame(**frame) for frame in frames)
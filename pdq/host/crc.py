@@ -1,3 +1,10 @@
+from functools import reduce
+from itertools import cycle, islice
+from operator import getitem, xor
+
+import numpy as np
+
+
 class CRC:
     """Generic and simple table driven CRC calculator.
 
@@ -10,15 +17,59 @@ class CRC:
 
     Handle any variation on those details outside this class.
 
+    Messages are processed using one table per data word position
+    (slice-by-N): the CRC is linear and the contribution of a data word is
+    its CRC followed by the zero words after it.
+
+    If the effect of the register on the CRC repeats after ``period`` data
+    words (i.e. the shift by ``period`` zero words is the identity, as for
+    the CRC8 of the PDQ), there are ``period`` tables and the position of a
+    data word is taken modulo ``period``. Large byte messages are then
+    XOR-folded into a single block of ``period`` bytes using NumPy.
+    Otherwise ``slices`` words are processed at a time with the register
+    folded into the first data words.
+
     >>> r = CRC(0x1814141AB)(b"123456789")  # crc-32q
     >>> assert r == 0x3010BF7F, hex(r)
+    >>> crc8 = CRC(0x107)
+    >>> a, b = b"1234", b"56789"
+    >>> assert crc8.combine(crc8(a), crc8(b), len(b)) == crc8(a + b)
+
+    Args:
+        poly (int): Polynomial.
+        data_width (int): Width of the data words in bits.
+        slices (int): Number of data words processed at a time if there is
+            no short period.
+
+    Attributes:
+        period (int): Number of zero data words that leave the register
+            unchanged or ``None`` if there is no such number below
+            ``4096``.
     """
-    def __init__(self, poly, data_width=8):
+    _max_period = 1 << 12
+    _numpy_min = 1 << 8
+
+    def __init__(self, poly, data_width=8, slices=8):
         self.poly = poly
         self.crc_width = poly.bit_length() - 1
         self.data_width = data_width
+        self._mask = (1 << self.crc_width) - 1
         self._table = [self._one(i << self.crc_width - data_width)
                        for i in range(1 << data_width)]
+        self.period = self._period()
+        if self.period is not None:
+            slices = self.period
+        elif self.crc_width % data_width:
+            slices = 1
+        self.slices = max(slices, self.crc_width//data_width)
+        # _tables[k][i]: CRC of word i followed by k zero words
+        self._tables = [self._table]
+        for k in range(1, self.slices):
+            self._tables.append([self._zero(c) for c in self._tables[-1]])
+        if self.period is not None:
+            # by position in a block of `period` words
+            self._blocks = self._tables[::-1]
+            self._blocks_np = np.array(self._blocks, np.uint64)
 
     def _one(self, i):
         for j in range(self.data_width):
@@ -27,9 +78,113 @@ class CRC:
                 i ^= self.poly
         return i
 
+    def _zero(self, crc):
+        """Shift the register by one zero data word."""
+        return (self._table[crc >> self.crc_width - self.data_width] ^
+                crc << self.data_width & self._mask)
+
+    def _period(self):
+        if not self.poly & 1:
+            return None
+        crc = self._zero(1)
+        for i in range(1, self._max_period + 1):
+            if crc == 1:
+                return i
+            crc = self._zero(crc)
+
     def __call__(self, msg, crc=0):
-        for data in msg:
-            p = data ^ crc >> self.crc_width - self.data_width
-            q = crc << self.data_width & (1 << self.crc_width) - 1
-            crc = self._table[p] ^ q
+        if self.period is None:
+            return self._slices(msg, crc)
+        if self.data_width == 8 and len(msg) >= self._numpy_min:
+            return self._fold(msg, crc)
+        return self._cycle(msg, crc)
+
+    def _slices(self, msg, crc):
+        n = self.slices
+        i = len(msg) - len(msg) % n
+        tables = self._tables[::-1]
+        # register words
+        shifts = [self.crc_width - (k + 1)*self.data_width
+                  for k in range(self.crc_width//self.data_width)]
+        word_mask = (1 << self.data_width) - 1
+        for data in zip(*(msg[k:i:n] for k in range(n))):
+            v = 0
+            for k, s in enumerate(shifts):
+                v ^= tables[k][data[k] ^ crc >> s & word_mask]
+            for k in range(len(shifts), n):
+                v ^= tables[k][data[k]]
+            crc = v
+        table = self._table
+        shift = self.crc_width - self.data_width
+        for data in msg[i:]:
+            crc = (table[data ^ crc >> shift] ^
+                   crc << self.data_width & self._mask)
         return crc
+
+    def _cycle(self, msg, crc):
+        n = len(msg) % self.period
+        blocks = islice(cycle(self._blocks), self.period - n, None)
+        return reduce(xor, map(getitem, blocks, msg), self.shift(crc, n))
+
+    def _fold(self, msg, crc):
+        # XOR the blocks (aligned to the end of the message) first,
+        # eight blocks at a time as 64 bit words
+        p = self.period
+        a = np.frombuffer(msg, np.uint8)
+        n = len(a) % (8*p)
+        block = np.zeros(8*p, np.uint8)
+        block[8*p - n:] = a[:n]
+        block ^= np.bitwise_xor.reduce(
+            a[n:].view(np.uint64).reshape(-1, p), axis=0).view(np.uint8)
+        block = np.bitwise_xor.reduce(block.reshape(8, p), axis=0)
+        v = np.bitwise_xor.reduce(self._blocks_np[np.arange(p), block])
+        return int(v) ^ self.shift(crc, len(a))
+
+    def shift(self, crc, n):
+        """Shift the register by zero data words.
+
+        Args:
+            crc (int): Initial register value.
+            n (int): Number of zero data words.
+
+        Returns:
+            int: ``self(bytes(n), crc)``
+        """
+        if self.period is not None:
+            n %= self.period
+        if n == 0:
+            return crc
+        if n <= self.slices and self.crc_width == self.data_width:
+            return self._tables[n - 1][crc]
+        # images of the register bits under 2**k zero words
+        op = [self._zero(1 << i) for i in range(self.crc_width)]
+        while n:
+            if n & 1:
+                crc = self._apply(op, crc)
+            n >>= 1
+            if n:
+                op = [self._apply(op, c) for c in op]
+        return crc
+
+    @staticmethod
+    def _apply(op, crc):
+        v = 0
+        for c in op:
+            if crc & 1:
+                v ^= c
+            crc >>= 1
+        return v
+
+    def combine(self, crc_a, crc_b, len_b):
+        """CRC of the concatenation of two messages.
+
+        Args:
+            crc_a (int): CRC of the first message (with any initial value).
+            crc_b (int): CRC of the second message with zero initial
+                value.
+            len_b (int): Length of the second message in data words.
+
+        Returns:
+            int: CRC of the concatenated messages.
+        """
+        return self.shift(crc_a, len_b) ^ crc_b
@@ -0,0 +1,166 @@
+import numpy as np
+
+from .protocol import Segment
+
+
+# header fields (see gateware.dac.line_layout)
+header_layout = [
+    ("length", 4),
+    ("typ", 2),
+    ("trigger", 1),
+    ("silence", 1),
+    ("aux", 1),
+    ("shift", 4),
+    ("end", 1),
+    ("clear", 1),
+    ("wait", 1),
+]
+
+line_dtype = np.dtype(
+    [("addr", "<u4")] +
+    [(name, "?" if width == 1 else "u1") for name, width in header_layout] +
+    [
+        ("duration", "<u2"),
+        ("data", "<u2", (14,)),
+        ("amplitude", "<f8", (4,)),
+        ("phase", "<f8", (3,)),
+    ])
+
+
+def _as_words(mem):
+    if isinstance(mem, np.ndarray):
+        return mem.astype(np.uint16, copy=False)
+    return np.frombuffer(mem, "<u2")
+
+
+def _steps():
+    # words from a header to the next, 0 to stop (invalid or end)
+    header = np.arange(1 << 16)
+    length = header & 0xf
+    return np.where((length == 0) | (header & (1 << 13) != 0), 0,
+                    length + 1).astype(np.int32)
+
+
+_steps = _steps()
+
+
+def walk(mem, starts, stride=3):
+    """Find the line headers reachable from some addresses.
+
+    Follows each line to the next (the line length is in the header) until
+    a line that returns to the frame table (``end``), an invalid line of
+    zero length, or the end of the memory.
+
+    The lines are walked vectorized: pointer doubling yields the header
+    ``2**stride`` lines after each word. The walks advance by that many
+    lines at a time and the headers in between are then filled in by
+    reversing the doubling.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        starts (array[int]): Addresses to start from.
+        stride (int): Number of doublings.
+
+    Returns:
+        array[int]: Sorted addresses of the line headers.
+    """
+    words = _as_words(mem)
+    n = len(words)
+    # jumps[k]: the header 2**k lines after, itself at the last line,
+    # n past the end
+    nxt = np.arange(n + 1, dtype=np.int32)
+    nxt[:n] += _steps[words]
+    np.minimum(nxt, n, out=nxt)
+    jumps = [nxt]
+    for k in range(stride):
+        jumps.append(jumps[-1][jumps[-1]])
+    far = jumps[-1]
+    anchors = set()
+    for addr in set(int(i) for i in starts):
+        while 0 < addr < n and addr not in anchors:
+            anchors.add(addr)
+            addr, last = far.item(addr), addr
+            if addr == last:
+                break
+    marked = np.zeros(n + 1, np.bool_)
+    marked[list(anchors)] = True
+    for jump in reversed(jumps[:-1]):
+        # up to 2**k lines after each marked header
+        marked[jump[np.flatnonzero(marked)]] = True
+    return np.flatnonzero(marked[:n])
+
+
+def decode(mem, addr):
+    """Decode lines.
+
+    The data words are converted back to the coefficients passed to
+    :meth:`Segment.bias` and :meth:`Segment.dds` (undoing the discrete time
+    and CORDIC gain compensation). Coefficients not present in the line are
+    zero. Lines that do not target bias or DDS have zero coefficients.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        addr (array[int]): Addresses of the line headers.
+
+    Returns:
+        array[line_dtype]: The decoded lines.
+    """
+    words = _as_words(mem)
+    addr = np.asarray(addr, np.int64)
+    words = np.concatenate([words, np.zeros(15, np.uint16)])
+    lines = np.zeros(len(addr), line_dtype)
+    lines["addr"] = addr
+    header = words[addr]
+    pos = 0
+    for name, width in header_layout:
+        lines[name] = (header >> pos) & ((1 << width) - 1)
+        pos += width
+    lines["duration"] = words[addr + 1]
+    data = words[addr[:, None] + 2 + np.arange(14)]
+    # zero the words after the line
+    data[np.arange(1, 15) >= lines["length"][:, None]] = 0
+    lines["data"] = data
+
+    d = data.astype(np.int64)
+    v = [_signed(d[:, 0], 16),
+         _signed(d[:, 1] | d[:, 2] << 16, 32)*2.**-16,
+         _signed(d[:, 3] | d[:, 4] << 16 | d[:, 5] << 32, 48)*2.**-32,
+         _signed(d[:, 6] | d[:, 7] << 16 | d[:, 8] << 32, 48)*2.**-32]
+    # undo discrete_compensate()
+    v[2] -= v[3]
+    v[1] -= v[2]/2. + v[3]/6.
+    amplitude = np.array(v).T/Segment.out_scale
+    dds = lines["typ"] == 1
+    amplitude[dds] *= Segment.cordic_gain
+    amplitude[lines["typ"] > 1] = 0.
+    lines["amplitude"] = amplitude
+    d = d[dds]
+    lines["phase"][dds] = np.array([
+        _signed(d[:, 9], 16)*2.**-16,
+        _signed(d[:, 10] | d[:, 11] << 16, 32)*2.**-32,
+        _signed(d[:, 12] | d[:, 13] << 16, 32)*2.**-32]).T
+    return lines
+
+
+def _signed(v, bits):
+    return ((v + (1 << bits - 1)) & ((1 << bits) - 1)) - (1 << bits - 1)
+
+
+def disassemble(mem, num_frames=32):
+    """Disassemble a channel memory image.
+
+    Inverse of :meth:`Channel.serialize`: decodes the frame address table
+    and all lines reachable from it.
+
+    Args:
+        mem (bytes or array[uint16]): Channel memory, e.g. from
+            :meth:`Channel.serialize` or read back from the device.
+        num_frames (int): Size of the frame address table.
+
+    Returns:
+        tuple(array[uint16], array[line_dtype]): Frame address table and
+        lines sorted by address.
+    """
+    words = _as_words(mem)
+    table = words[:num_frames].copy()
+    return table, decode(words, walk(words, table))
@@ -0,0 +1,739 @@
+from collections import OrderedDict
+from math import atan, pi
+import sys
+
+import numpy as np
+
+from .protocol import PDQBase, crc8
+
+
+_table_size = 1 << 17
+_block = 1 << 16
+_tables = None
+
+
+def _binom_tables():
+    """``C(k, p)`` for ``p`` up to 3 and ``k`` below :data:`_table_size`."""
+    global _tables
+    if _tables is None:
+        k = np.arange(_table_size, dtype=np.uint64)
+        _tables = [k, _binom2(k), _binom3(k)]
+    return _tables
+
+
+def _binom2(m):
+    # exact modulo 2**64
+    return np.where(m & np.uint64(1), m*((m - np.uint64(1)) >> np.uint64(1)),
+                    (m >> np.uint64(1))*(m - np.uint64(1)))
+
+
+def _binom3(m):
+    # exact modulo 2**64 for m < 2**32
+    c2 = _binom2(m)
+    d = m - np.uint64(2)
+    return np.where(d % np.uint64(3) == 0, c2*(d//np.uint64(3)),
+                    (c2//np.uint64(3))*d)
+
+
+def evolve(v, m):
+    """Evolve a spline accumulator.
+
+    The accumulator is the 48 bit cascade of :class:`gateware.dac.Volt`
+    and of the amplitude of :class:`gateware.dac.Dds`.
+
+    Args:
+        v (list[int]): Register values after loading (up to four, offset
+            first).
+        m (array[uint64] or tuple[int, int]): Number of increments. A tuple
+            ``(start, n)`` denotes ``start + arange(n)``.
+
+    Returns:
+        array[uint64]: Offset register values (not masked to 48 bits).
+    """
+    v = [np.uint64(int(vi) & ((1 << 64) - 1)) for vi in v]
+    if isinstance(m, tuple):
+        start, n = m
+        if start + n <= _table_size:
+            basis = [t[start:start + n] for t in _binom_tables()]
+        else:
+            m = np.arange(start, start + n, dtype=np.uint64)
+    else:
+        m = np.asarray(m, np.uint64)
+    if not isinstance(m, tuple):
+        if len(m) and m.max() < _table_size:
+            basis = [t[m] for t in _binom_tables()]
+        else:
+            basis = [m, _binom2(m), _binom3(m)]
+    out = np.full(len(basis[0]), v[0], np.uint64)
+    tmp = np.empty_like(out)
+    for vi, b in zip(v[1:], basis):
+        if vi:
+            out += np.multiply(b, vi, out=tmp)
+    return out
+
+
+def _top16(v):
+    if sys.byteorder == "little":
+        # bits 32 to 47 without a copy
+        return v.view(np.uint16)[2::4]
+    return (v >> np.uint64(32)).astype(np.uint16)
+
+
+class Cordic:
+    """Model of the pipelined four-quadrant rotating CORDIC in
+    :class:`gateware.dac.Dds` (``Cordic(width=16, guard=None)``).
+
+    Only the ``x`` output with ``yi = 0`` is modeled. The model follows
+    the stage arithmetic of ``misoc.cores.cordic`` (angles, guard bits,
+    quadrant folding and truncating shifts) but has not been validated
+    against a simulation of that core. It agrees with
+    ``x*cos(z)*cordic_gain`` to within a few LSB.
+
+    Direct evaluation costs 16 passes over the samples. Runs of at least
+    :attr:`min_run` samples with constant ``x`` (DDS lines without
+    amplitude slopes) are instead looked up in a table of the output for
+    every phase. The tables of the :attr:`num_tables` most recently used
+    amplitudes are kept.
+
+    Attributes:
+        width (int): Input and output width.
+        guard (int): Guard bits.
+        stages (int): Number of stages and pipeline latency.
+        angles (list[int]): Stage rotation angles.
+        min_run (int): Shortest run of constant ``x`` that is looked up.
+        num_tables (int): Number of cached tables.
+    """
+    min_run = 1 << 10
+    num_tables = 32
+
+    def __init__(self, width=16):
+        self.width = width
+        self.guard = int(np.log2(width))
+        self.stages = width
+        bits = width + self.guard
+        self.angles = [int(atan(2**-i)*2**(bits - 1)/pi)
+                       for i in range(self.stages)]
+        self._directions = None
+        self._tables = OrderedDict()
+
+    def directions(self):
+        """Rotation directions for each input phase.
+
+        Returns:
+            array[uint16]: Bit ``i`` is set where stage ``i`` rotates
+            clockwise (the residual phase is negative), for each 16 bit
+            input phase.
+        """
+        if self._directions is None:
+            zi = np.arange(-(1 << self.width - 1), 1 << self.width - 1,
+                           dtype=np.int32)
+            q = self._quadrant(zi)
+            z = np.where(q, zi + (1 << self.width - 1), zi)
+            z = self._wrap(z, self.width) << self.guard
+            d = np.zeros(len(z), np.uint16)
+            for i, a in enumerate(self.angles):
+                neg = z < 0
+                d |= neg.astype(np.uint16) << np.uint16(i)
+                z -= np.where(neg, -a, a)
+            self._directions = d
+        return self._directions
+
+    def _quadrant(self, zi):
+        # zi in quadrant II or III
+        return ((zi >> self.width - 1) ^ (zi >> self.width - 2)) & 1 == 1
+
+    @staticmethod
+    def _wrap(v, bits):
+        return ((v + (1 << bits - 1)) & ((1 << bits) - 1)) - (1 << bits - 1)
+
+    def table(self, xi):
+        """Output for a constant ``x`` input and every phase.
+
+        Args:
+            xi (int): ``x`` input.
+
+        Returns:
+            array[int16]: ``x`` output for the phase inputs ``-2**15``
+            to ``2**15 - 1``.
+        """
+        t = self._tables.pop(xi, None)
+        if t is None:
+            n = 1 << self.width
+            t = self._evaluate(np.full(n, xi, np.int16),
+                               np.arange(-(n >> 1), n >> 1, dtype=np.int16))
+            if len(self._tables) >= self.num_tables:
+                self._tables.popitem(last=False)
+        self._tables[xi] = t
+        return t
+
+    def __call__(self, xi, zi):
+        """Evaluate the CORDIC.
+
+        Args:
+            xi (array[int16]): ``x`` input.
+            zi (array[int16]): Phase input.
+
+        Returns:
+            array[int16]: ``x`` output.
+        """
+        xi = np.asarray(xi, np.int16)
+        zi = np.asarray(zi, np.int16)
+        n = len(xi)
+        edges = np.flatnonzero(xi[1:] != xi[:-1]) + 1
+        if len(edges)*self.min_run >= n:
+            return self._evaluate(xi, zi)
+        starts = np.concatenate([[0], edges])
+        lengths = np.diff(np.concatenate([starts, [n]]))
+        long = lengths >= self.min_run
+        out = np.empty(n, np.int16)
+        if not long.all():
+            short = np.repeat(~long, lengths)
+            out[short] = self._evaluate(xi[short], zi[short])
+        for i, m in zip(starts[long], lengths[long]):
+            z = zi[i:i + m].view(np.uint16) ^ np.uint16(1 << self.width - 1)
+            np.take(self.table(int(xi[i])), z, out=out[i:i + m])
+        return out
+
+    def _evaluate(self, xi, zi):
+        xi = np.asarray(xi, np.int32)
+        zi = np.asarray(zi, np.int16).astype(np.int32)
+        d = self.directions()[zi + (1 << self.width - 1)].astype(np.int32)
+        x = np.where(self._quadrant(zi), -xi, xi)
+        x = self._wrap(x, self.width) << self.guard
+        y = np.zeros_like(x)
+        bits = self.width + self.guard
+        # the stages can only overflow for large amplitudes
+        wrap = np.abs(xi).max(initial=0) > (1 << self.width - 1)/1.7
+        neg, dx, dy = np.empty_like(x), np.empty_like(x), np.empty_like(x)
+        for i in range(self.stages):
+            # 0 or -1, s*v == (v ^ neg) - neg
+            np.right_shift(d, i, out=neg)
+            neg &= 1
+            np.negative(neg, out=neg)
+            np.right_shift(y, i, out=dx)
+            dx ^= neg
+            dx -= neg
+            np.right_shift(x, i, out=dy)
+            dy ^= neg
+            dy -= neg
+            y += dy
+            x -= dx
+            if wrap:
+                x = self._wrap(x, bits)
+                y = self._wrap(y, bits)
+        return self._wrap(x >> self.guard, self.width).astype(np.int16)
+
+
+cordic = Cordic()
+
+
+class Line:
+    """A line decoded from channel memory.
+
+    Attributes:
+        addr (int): Address of the line header.
+        length (int): Number of words after the header.
+        typ (int): Target executor (0: bias, 1: DDS, other: none).
+        trigger, silence, aux, end, clear, wait (bool): Header flags.
+        shift (int): Time shift exponent.
+        duration (int): Line duration in units of ``2**shift`` cycles.
+        data (list[int]): The 14 data words, zero padded.
+    """
+    def __init__(self, mem, addr):
+        n = len(mem)
+        header = int(mem[addr % n])
+        self.addr = addr
+        self.length = header & 0xf
+        if not self.length:
+            raise ValueError("line at {:#x} has zero length".format(addr))
+        self.typ = (header >> 4) & 3
+        self.trigger = bool(header & (1 << 6))
+        self.silence = bool(header & (1 << 7))
+        self.aux = bool(header & (1 << 8))
+        self.shift = (header >> 9) & 0xf
+        self.end = bool(header & (1 << 13))
+        self.clear = bool(header & (1 << 14))
+        self.wait = bool(header & (1 << 15))
+        self.duration = int(mem[(addr + 1) % n])
+        self.data = [int(mem[(addr + 2 + i) % n])
+                     for i in range(self.length - 1)]
+        self.data += [0]*(14 - len(self.data))
+
+    def next_addr(self):
+        return self.addr + self.length + 1
+
+    def cycles(self):
+        """Number of cycles from loading to the end of the line."""
+        return (self.duration or 1 << 16) << self.shift
+
+    def word(self, start, n):
+        v = 0
+        for i in range(n):
+            v |= self.data[start + i] << 16*i
+        return v
+
+    def amplitude(self):
+        """Accumulator register values after loading."""
+        return [self.word(0, 1) << 32, self.word(1, 2) << 16,
+                self.word(3, 3), self.word(6, 3)]
+
+
+def emulate(mem, cycles, frame=0, trigger=True, mem_depth=None):
+    """Emulate the output of a DAC channel.
+
+    Reproduces the cycle-by-cycle behavior of :class:`gateware.dac.Dac`:
+    the memory :class:`gateware.dac.Parser` timing, the line sequencing
+    including durations, ``shift``, trigger and wait handling, stalls, the
+    48 bit spline accumulators of the bias and DDS executors and the
+    pipelined CORDIC. The CORDIC model has not been validated against the
+    gateware core (see :class:`Cordic`).
+
+    The channel is enabled (armed and started) from reset at cycle 0 and
+    the frame selection is constant.
+
+    The lines are sequenced one after the other, the samples of each line
+    are computed vectorized.
+
+    Args:
+        mem (bytes or array[uint16]): Channel memory image, e.g. from
+            :meth:`Channel.serialize`.
+        cycles (int): Number of clock cycles to emulate.
+        frame (int): Selected frame.
+        trigger (bool or array[int]): ``True`` if the trigger is always
+            asserted, ``False`` if it is never asserted, or the sorted
+            cycles at which it is asserted.
+        mem_depth (int): Memory depth in words. Addresses wrap around at
+            this depth. Memory beyond the image reads as zero.
+            Defaults to the image size.
+
+    Returns:
+        tuple(array[int16], array[bool], array[bool]): DAC output data, AUX
+        and silence for each cycle.
+    """
+    if not isinstance(mem, np.ndarray):
+        mem = np.frombuffer(mem, "<u2")
+    if mem_depth is not None and mem_depth > len(mem):
+        mem = np.concatenate([mem, np.zeros(mem_depth - len(mem), "<u2")])
+    if trigger is True:
+        triggers = None
+    elif trigger is False:
+        triggers = np.zeros(0, np.int64)
+    else:
+        triggers = np.asarray(trigger, np.int64)
+
+    # executor outputs and header flags for each cycle
+    volt = np.zeros(cycles, np.uint16)
+    aux = np.zeros(cycles, np.bool_)
+    silence = np.zeros(cycles, np.bool_)
+    dds_x = dds_z = None
+
+    # executor registers after loading and increments since loading
+    volt_v, volt_m = [0]*4, 0
+    dds_v, dds_m = [0]*4, 0
+    dds_z0 = dds_z1 = dds_z2 = dds_za = 0
+
+    prev = None  # line executing, None for the reset state
+    a = -1  # cycle the line executing was loaded
+    done = 0  # cycle the line executing can be replaced
+    addr = None  # address of the next line, None to jump through the table
+    jump = 0  # cycle of the parser JUMP state
+    header = None  # cycle of the parser HEADER state
+    while True:
+        # Parser: JUMP, FRAME, HEADER, LINE (length cycles), STB
+        line = None
+        if addr is None:
+            addr = int(mem[frame % len(mem)])
+            header = jump + 2
+        if addr:
+            line = Line(mem, addr)
+            ready = header + 1 + line.length
+            # Sequencer: replace the line executing
+            nxt = max(ready, done)
+            if prev is not None and prev.wait or line.trigger:
+                if triggers is not None:
+                    i = np.searchsorted(triggers, nxt)
+                    nxt = int(triggers[i]) if i < len(triggers) else cycles
+        else:
+            nxt = cycles  # empty frame
+        # the line executing is current from a + 1 to nxt
+        start, stop = a + 1, min(nxt, cycles - 1) + 1
+        if prev is not None:
+            n_inc = (prev.duration or 1 << 16) - 1
+            # if stalled, one more increment when tic and toc assert
+            extra = prev.shift == 0 and n_inc > 0 and nxt > done
+        else:
+            n_inc, extra = 0, False
+        if start < stop:
+            runs = _runs(start - a - 1, stop - start, prev, n_inc, extra)
+            if any(volt_v):
+                _evaluate(volt[start:stop], volt_v, volt_m, runs)
+            if dds_x is not None:
+                _evaluate(dds_x[start:stop], dds_v, dds_m, runs)
+                # the phase accumulator is 32 bits wide
+                n = stop - start
+                za0 = np.uint32(dds_za)
+                if dds_z2:
+                    z1 = _expand(runs, n, np.uint32)
+                    z1 += np.uint32(dds_m & 0xffffffff)
+                    z1 *= np.uint32(dds_z2)
+                    z1 += np.uint32(dds_z1)
+                    za = np.cumsum(z1, dtype=np.uint32)
+                    za -= z1
+                    dds_za += int(za[-1]) + int(z1[-1])
+                else:
+                    za = np.arange(n, dtype=np.uint32)
+                    za *= np.uint32(dds_z1)
+                    dds_za += n*dds_z1
+                dds_za &= 0xffffffff
+                za += za0
+                za >>= np.uint32(16)
+                za += np.uint32(dds_z0)
+                dds_z[start:stop] = za
+            if prev is not None:
+                aux[start:stop] = prev.aux
+                silence[start:stop] = prev.silence
+        if nxt >= cycles:
+            break
+        volt_m += n_inc + extra
+        dds_m += n_inc + extra
+        # load the next line
+        if line.typ == 0:
+            volt_v, volt_m = line.amplitude(), 0
+        elif line.typ == 1:
+            if dds_x is None:
+                dds_x = np.zeros(cycles, np.uint16)
+                dds_z = np.zeros(cycles, np.uint16)
+            dds_v, dds_m = line.amplitude(), 0
+            dds_z0 = line.word(9, 1)
+            dds_z1 = line.word(10, 2)
+            dds_z2 = line.word(12, 2)
+            if line.clear:
+                dds_za = 0
+        prev, a = line, nxt
+        done = a + line.cycles()
+        if line.end:
+            addr, jump = None, a + 1
+        else:
+            addr, header = line.next_addr(), a + 1
+    data = volt
+    if dds_x is not None:
+        lat = cordic.stages
+        # in blocks to bound the CORDIC temporaries
+        for i in range(0, cycles - lat, _block):
+            j = min(i + _block, cycles - lat)
+            x = dds_x[i:j].view(np.int16)
+            if x.any():
+                z = dds_z[i:j].view(np.int16)
+                data[i + lat:j + lat] += cordic(x, z).view(np.uint16)
+    # Sequencer data, aux and silence are registered
+    return tuple(np.concatenate([np.zeros(1, v.dtype), v[:-1]])
+                 for v in (data.view(np.int16), aux, silence))
+
+
+def _runs(offset, n, line, n_inc, extra):
+    """Number of increments since a line was loaded.
+
+    Args:
+        offset (int): First cycle, counted from the cycle after loading.
+        n (int): Number of cycles.
+        line (Line): Line executing or ``None`` for the reset state.
+        n_inc (int): Increments during the line.
+        extra (bool): The line stalls and has an additional increment.
+
+    Returns:
+        list[tuple(int, int, int)]: Runs of ``(first, count, length)``
+        covering the ``n`` cycles. Either ``count == 1`` and the number of
+        increments is ``first`` for ``length`` cycles, or the number of
+        increments is ``first + i`` for ``2**line.shift`` cycles each,
+        for ``i`` up to ``count``.
+    """
+    if line is None:
+        return [(0, 1, n)]
+    shift = line.shift
+    runs = []
+    u, end = offset, offset + n
+    # increments every 2**shift cycles up to n_inc
+    ramp = min(n_inc << shift, end)
+    if u < ramp and u & ((1 << shift) - 1):
+        head = min(((u >> shift) + 1) << shift, ramp)
+        runs.append((u >> shift, 1, head - u))
+        u = head
+    count = (ramp - u) >> shift if u < ramp else 0
+    if count:
+        runs.append((u >> shift, count, count << shift))
+        u += count << shift
+    if u < ramp:
+        runs.append((u >> shift, 1, ramp - u))
+        u = ramp
+    # constant after the last increment, one more if stalled
+    stall = min(n_inc + 1 if extra else end, end)
+    if u < stall:
+        runs.append((n_inc, 1, stall - u))
+        u = stall
+    if u < end:
+        runs.append((n_inc + 1, 1, end - u))
+    return runs
+
+
+def _evaluate(out, v, m, runs):
+    """Evaluate the top 16 bits of a spline accumulator for some runs (see
+    :func:`_runs`) of increments, offset by ``m``."""
+    i = 0
+    for first, count, length in runs:
+        if count == 1:
+            out[i:i + length] = _top16(evolve(v, [m + first]))[0]
+        else:
+            vals = _top16(evolve(v, (m + first, count)))
+            if length != count:
+                vals = np.repeat(vals, length//count)
+            out[i:i + length] = vals
+        i += length
+
+
+def _expand(runs, n, dtype=np.uint64):
+    """Number of increments for each cycle of some runs (see
+    :func:`_runs`)."""
+    m = np.empty(n, dtype)
+    i = 0
+    for first, count, length in runs:
+        if count == 1:
+            m[i:i + length] = first
+        elif count == length:
+            m[i:i + length] = np.arange(first, first + count, dtype=dtype)
+        else:
+            m[i:i + length] = np.repeat(
+                np.arange(first, first + count, dtype=dtype),
+                length//count)
+        i += length
+    return m
+
+
+# Protocol FSM states (see gateware.comm.Protocol)
+_CMD, _IGNORE, _REG_DO, _MEM_ADRL, _MEM_ADRH, _MEM_DO = range(6)
+
+
+class Comm:
+    """Emulation of the communication gateware of a PDQ stack.
+
+    Consumes the byte stream that :class:`usb.PDQ` writes and applies it
+    like :class:`gateware.comm.Comm` (:class:`gateware.escape.Unescaper`,
+    :class:`gateware.comm.FTDI2SPI` framing and the
+    :class:`gateware.comm.Protocol` command state machine) of each board in
+    the stack does: memory writes, register writes and the running
+    checksum.
+
+    The stream is processed in bulk: escape sequences are located
+    vectorized and memory writes are copied as slices. The checksum of
+    each memory write is computed once over the whole payload. Throughput
+    is a few hundred MB/s (see ``python -m pdq.bench.comm``). The stream
+    can be split arbitrarily across calls to :meth:`write`. It can
+    therefore be used as the ``dev`` of :class:`usb.PDQ` or to replay a
+    dump.
+
+    Register and memory reads are answered on SPI MISO, which is not
+    part of the USB stream. They only affect the checksum. A
+    configuration write with ``reset`` set resets the registers of the
+    board immediately.
+
+    Args:
+        num_boards (int): Number of boards in the stack.
+        num_dacs (int): Number of DAC channels per board.
+        mem_depths (list[int]): Channel memory depths in 16 bit words.
+            Defaults to those of the gateware built for ``num_dacs``
+            channels.
+
+    Attributes:
+        mems (list[list[bytearray]]): Channel memories of each board.
+        config (list[int]): Configuration register of each board.
+        checksum (list[int]): Checksum register of each board.
+        frame (list[int]): Frame register of each board.
+        bytes_received (int): Number of bytes consumed.
+    """
+    def __init__(self, num_boards=3, num_dacs=3, mem_depths=None):
+        if mem_depths is None:
+            mem_depths = [i << 10 for i in PDQBase._mem_sizes[num_dacs]]
+        self.num_boards = num_boards
+        self.mem_depths = list(mem_depths)
+        self.mems = [[bytearray(2*depth) for depth in mem_depths]
+                     for board in range(num_boards)]
+        self.config = [0]*num_boards
+        self.checksum = [0]*num_boards
+        self.frame = [0]*num_boards
+        self.bytes_received = 0
+        self._escape = False  # previous byte was an unpaired escape
+        self._eop = True  # outside of a frame
+        self._state = [_CMD]*num_boards
+        self._cmd = [0]*num_boards
+        self._adr = [0]*num_boards
+
+    def write(self, data):
+        """Consume bytes from the stream.
+
+        Args:
+            data (bytes-like): Data written to the device.
+
+        Returns:
+            int: Number of bytes consumed (all).
+        """
+        data = memoryview(data).cast("B")
+        n = len(data)
+        self.bytes_received += n
+        if self._escape and n:
+            self._escape = False
+            if data[0] == 0xa5:
+                self._data(b"\xa5")
+            else:
+                self._command(data[0])
+            data = data[1:]
+        a = np.frombuffer(data, np.uint8)
+        escapes = np.flatnonzero(a == 0xa5)
+        if not len(escapes):
+            if len(data):
+                self._data(data)
+            return n
+        # runs of escape characters alternate between escape and escaped
+        # escape
+        start = np.ones(len(escapes), np.bool_)
+        start[1:] = np.diff(escapes) != 1
+        rank = np.arange(len(escapes))
+        rank -= np.maximum.accumulate(np.where(start, rank, 0))
+        escape = escapes[rank % 2 == 0]
+        # escapes not followed by an escape are followed by a command
+        follows = escape + 1
+        k = np.searchsorted(escapes, follows).clip(max=len(escapes) - 1)
+        command = follows[escapes[k] != follows]
+        if len(command) and command[-1] == len(a):
+            self._escape = True
+            command = command[:-1]
+        keep = np.ones(len(a), np.bool_)
+        keep[escape] = False
+        keep[command] = False
+        payload = a[keep]
+        # payload bytes before each command
+        split = command - np.searchsorted(escape, command)
+        split -= np.arange(len(command))
+        i = 0
+        for j, c in zip(split.tolist(), a[command].tolist()):
+            if j > i:
+                self._data(payload[i:j])
+            self._command(c)
+            i = j
+        if i < len(payload):
+            self._data(payload[i:])
+        return n
+
+    def readfrom(self, f, chunk_size=1 << 20):
+        """Consume a stream from a file.
+
+        Args:
+            f (file-like): File to read the stream from, e.g. a dump written
+                by ``aqctl_pdq --simulation`` or ``pdq --dump``.
+            chunk_size (int): Number of bytes to read at a time.
+        """
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            self.write(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _command(self, c):
+        if c == 0x02:
+            if self._eop:
+                self._state = [_CMD]*self.num_boards
+            self._eop = False
+        elif c == 0x03:
+            self._eop = True
+
+    def _data(self, data):
+        if self._eop:
+            return
+        data = memoryview(data).cast("B")
+        crcs = {}
+        for board in range(self.num_boards):
+            self._protocol(board, data, crcs)
+
+    def _protocol(self, board, data, crcs):
+        state = self._state[board]
+        cmd = self._cmd[board]
+        checksum = self.checksum[board]
+        # start of the data not yet included in the checksum
+        i = j = 0
+        n = len(data)
+        while j < n:
+            if state == _CMD:
+                cmd = data[j]
+                if (cmd >> 3) & 0xf in (board, 0xf):
+                    state = _MEM_ADRL if cmd & 0x4 else _REG_DO
+                else:
+                    state = _IGNORE
+                j += 1
+            elif state == _IGNORE:
+                j = n
+            elif state == _REG_DO:
+                checksum = self._crc(checksum, data, i, j, crcs)
+                i = j + 1  # reads are answered and not included
+                if cmd & 0x80:
+                    checksum = self._set_reg(board, cmd & 3, data[j],
+                                             checksum)
+                state = _IGNORE
+                j += 1
+            elif state == _MEM_ADRL:
+                self._adr[board] = data[j]
+                state = _MEM_ADRH
+                j += 1
+            elif state == _MEM_ADRH:
+                self._adr[board] |= data[j] << 8
+                state = _MEM_DO
+                j += 1
+            else:  # _MEM_DO
+                if cmd & 0x80:
+                    self._write_mem(board, cmd & 3, data[j:])
+                else:
+                    # read data is answered and not included
+                    checksum = self._crc(checksum, data, i, j, crcs)
+                    i = n
+                self._adr[board] = (self._adr[board] + n - j) & 0xffff
+                j = n
+        self.checksum[board] = self._crc(checksum, data, i, n, crcs)
+        self._state[board] = state
+        self._cmd[board] = cmd
+
+    def _crc(self, checksum, data, i, j, crcs):
+        if i >= j:
+            return checksum
+        key = checksum, i, j
+        if key not in crcs:
+            crcs[key] = crc8(data[i:j], checksum)
+        return crcs[key]
+
+    def _set_reg(self, board, adr, value, checksum):
+        """Write a register and return the new checksum."""
+        if adr == 0:
+            if value & 1:  # reset
+                self.config[board] = self.frame[board] = 0
+                return 0
+            self.config[board] = value
+        elif adr == 1:
+            return value
+        else:  # the frame register is also mapped at 3
+            self.frame[board] = value & 0x1f
+        return crc8(bytes([value]), checksum)
+
+    def _write_mem(self, board, mem, data):
+        mem = min(mem, len(self.mem_depths) - 1)
+        buf = self.mems[board][mem]
+        # the byte address wraps at 16 bits, the word address at the
+        # memory address width
+        span = 2 << (self.mem_depths[mem] - 1).bit_length()
+        adr = self._adr[board]
+        while len(data):
+            n = min(len(data), (1 << 16) - adr, span - adr % span)
+            start = adr % span
+            if start < len(buf):
+                end = min(start + n, len(buf))
+                buf[start:end] = data[:end - start]
+            data = data[n:]
+            adr = (adr + n) & 0xffff
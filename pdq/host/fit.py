@@ -0,0 +1,195 @@
+import numpy as np
+
+from .emulate import evolve
+from .protocol import Segment, discrete_compensate
+
+
+# quantization of the forward differences in DAC steps
+# (see Segment.bias and gateware.dac.Volt)
+_quanta = [1., 2.**-16, 2.**-32, 2.**-32]
+_shifts = [32, 16, 0, 0]
+# ranges of the packed line data (see Segment.pack): int16, int32, int48
+_limits = [1 << 15, 1 << 31, 1 << 47, 1 << 47]
+
+
+def _binom(k, order):
+    """Binomial basis ``C(k, p)`` for ``p`` up to ``order``, one row per
+    ``p``."""
+    k = np.asarray(k, np.float64)
+    b = np.empty((order + 1, len(k)))
+    b[0] = 1.
+    for p in range(1, order + 1):
+        b[p] = b[p - 1]*(k - (p - 1))/p
+    return b
+
+
+def quantize(amplitude):
+    """Integer line data that :meth:`Segment.bias` generates.
+
+    Args:
+        amplitude (list[float]): Bias amplitude coefficients in Volt.
+
+    Returns:
+        list[int]: Forward differences in units of their respective
+        quanta.
+    """
+    coef = [Segment.out_scale*a for a in amplitude]
+    discrete_compensate(coef)
+    return [int(round(c*(1 << 16*w))) for c, w in zip(coef, [0, 1, 2, 2])]
+
+
+def bias_output(amplitude, duration):
+    """Evaluate a bias line exactly as the DAC does.
+
+    Args:
+        amplitude (list[float]): Bias amplitude coefficients in Volt.
+        duration (int): Number of samples to evaluate.
+
+    Returns:
+        array[int16]: DAC output for each clock cycle of the line.
+    """
+    return _output(quantize(amplitude), np.arange(duration))
+
+
+def _output(ints, k):
+    v = evolve([q << s for q, s in zip(ints, _shifts)], k)
+    return (v >> np.uint64(32)).astype(np.uint16).view(np.int16)
+
+
+def _amplitude(ints):
+    """Bias amplitude coefficients for given forward differences."""
+    d = [q*qq for q, qq in zip(ints, _quanta)]
+    a = list(d)
+    if len(d) > 3:
+        a[2] = d[2] - d[3]
+    if len(d) > 2:
+        a[1] = d[1] - a[2]/2.
+    if len(d) > 3:
+        a[1] -= a[3]/6.
+    return [ai/Segment.out_scale for ai in a]
+
+
+def _fit(k, y, order):
+    """Least squares fit of the forward differences.
+
+    The coefficients are rounded to their quanta from the highest order
+    down, refitting the lower orders each time to absorb the rounding
+    error.
+    """
+    b = _binom(k, order)
+    # k is increasing and non-negative
+    scale = b[:, -1].copy()
+    scale[scale == 0] = 1.
+    b /= scale[:, None]
+    res = y.copy()
+    ints = [0]*(order + 1)
+    for p in range(order, -1, -1):
+        bp = b[:p + 1]
+        if len(k) > 2*(p + 1):
+            # normal equations, well conditioned for the scaled basis
+            c = np.linalg.solve(bp @ bp.T, bp @ res)
+        else:
+            c = np.linalg.lstsq(bp.T, res, rcond=None)[0]
+        ints[p] = q = int(round(c[p]/scale[p]/_quanta[p]))
+        res -= q*_quanta[p]*scale[p]*b[p]
+    return ints
+
+
+def _check(t, y, i, j, order, tol):
+    """Fit samples ``i`` to ``j`` (inclusive) and check the error.
+
+    Coefficients that can not be packed into the line data fail the
+    check and are returned as ``None``.
+    """
+    k = t[i:j + 1] - t[i]
+    yi = y[i:j + 1]
+    ints = _fit(k, yi, order)
+    ints = quantize(_amplitude(ints))
+    if any(not -l <= q < l for q, l in zip(ints, _limits)):
+        return False, None
+    err = np.abs(_output(ints, k) - yi).max()
+    return err <= tol, ints
+
+
+def fit(times, voltages, tolerance, order=3):
+    """Fit a sampled waveform with the fewest bias lines.
+
+    Greedily extends each line over as many samples as possible while the
+    DAC output (evaluated exactly in fixed point, including quantization
+    of the coefficients) is within ``tolerance`` of the samples.
+    The line order (constant, linear, quadratic, cubic) is the lowest that
+    achieves the longest line, up to ``order``. Lines start and end at
+    sample times and are shorter than :attr:`Segment.max_time`. Each line
+    spans at least one sample interval. If no line within the tolerance
+    or with coefficients that fit into the line data exists for that
+    interval, the first sample is held.
+
+    The tolerance should be larger than the DAC resolution
+    (``1/Segment.out_scale``).
+
+    Args:
+        times (array[int]): Strictly increasing sample times in clock
+            cycles.
+        voltages (array[float]): Sample values in Volt.
+        tolerance (float): Maximum deviation in Volt.
+        order (int): Maximum spline order (0 to 3).
+
+    Returns:
+        list: Wavesynth lines (for a single channel) covering the times
+        from the first to the last sample.
+    """
+    t = np.asarray(times, np.int64)
+    y = np.asarray(voltages, np.float64)*Segment.out_scale
+    if t.ndim != 1 or t.shape != y.shape or len(t) < 2:
+        raise ValueError("need matching one dimensional times and "
+                         "voltages with at least two samples")
+    if np.any(np.diff(t) <= 0):
+        raise ValueError("times must be strictly increasing")
+    if np.any(np.diff(t) >= Segment.max_time):
+        raise ValueError("sample interval too long")
+    if np.abs(y).max() >= Segment.max_val - 1:
+        raise ValueError("voltages out of range")
+    if not 0 <= order <= 3:
+        raise ValueError("only orders up to cubic are supported")
+    tol = tolerance*Segment.out_scale
+    n = len(t)
+    lines = []
+    i = 0
+    step = 1
+    while i < n - 1:
+        # last sample reachable within max_time
+        stop = np.searchsorted(t, t[i] + Segment.max_time - 1, "right") - 1
+        stop = min(stop, n - 1)
+        good = i + 1
+        # gallop, then bisect the last feasible end sample
+        bad = None
+        while good < stop:
+            j = min(good + step, stop)
+            ok, _ = _check(t, y, i, j, order, tol)
+            if not ok:
+                bad = j
+                break
+            good = j
+            step *= 2
+        if bad is not None:
+            while bad - good > 1:
+                j = (good + bad)//2
+                ok, _ = _check(t, y, i, j, order, tol)
+                if ok:
+                    good = j
+                else:
+                    bad = j
+        for p in range(order + 1):
+            ok, ints = _check(t, y, i, good, p, tol)
+            if ok:
+                break
+        else:
+            # a single interval that can not be followed, hold the sample
+            ints = quantize([y[i]/Segment.out_scale])
+        step = max(1, (good - i)//2)
+        lines.append({
+            "duration": int(t[good] - t[i]),
+            "channel_data": [{"bias": {"amplitude": _amplitude(ints)}}],
+        })
+        i = good
+    return lines
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+def split_program(program, num_channels):
+    """Split a wavesynth program by channel.
+
+    Like :meth:`pdq.artiq.mediator.CompoundPDQ.arm`, each line of the
+    program is copied with the slice of ``channel_data`` of the
+    respective stack.
+
+    Args:
+        program (list): Wavesynth program for all channels.
+        num_channels (list[int]): Number of channels of each stack.
+
+    Returns:
+        list[list]: Wavesynth program for each stack.
+    """
+    programs = []
+    n = 0
+    for dn in num_channels:
+        programs.append([
+            [dict(line, channel_data=line["channel_data"][n:n + dn])
+             for line in frame]
+            for frame in program])
+        n += dn
+    return programs
+
+
+class PDQGroup:
+    """Several PDQ stacks driven concurrently.
+
+    Each stack (e.g. a :class:`pdq.host.usb.PDQ` on its own serial port)
+    has a thread that performs its writes. Programs are split by channel
+    over the stacks in order and uploaded in parallel. Register writes are
+    released on all threads at once to minimize the skew between the
+    stacks.
+
+    Args:
+        pdqs (list[PDQBase]): PDQ stacks.
+
+    Attributes:
+        pdqs (list[PDQBase]): PDQ stacks.
+        num_channels (int): Total number of channels.
+        upload_times (list[float]): Duration of the last upload of each
+            stack in seconds.
+        wall_time (float): Duration of the last upload in seconds.
+        skew (float): Spread of the start times of the last register write
+            on the stacks in seconds.
+    """
+    def __init__(self, pdqs):
+        self.pdqs = list(pdqs)
+        self.num_channels = sum(pdq.get_num_channels() for pdq in self.pdqs)
+        self.upload_times = [0.]*len(self.pdqs)
+        self.wall_time = 0.
+        self.skew = 0.
+        self._executors = [ThreadPoolExecutor(1) for pdq in self.pdqs]
+
+    def get_num_channels(self):
+        return self.num_channels
+
+    def _map(self, fn, args):
+        futures = [executor.submit(fn, pdq, *a) for executor, pdq, a in
+                   zip(self._executors, self.pdqs, args)]
+        # wait for all before raising the first error
+        errors = [f.exception() for f in futures]
+        for e in errors:
+            if e is not None:
+                raise e
+        return [f.result() for f in futures]
+
+    def program(self, program, **kwargs):
+        """Upload a wavesynth program to all stacks in parallel.
+
+        Args:
+            program (list): Wavesynth program for all channels of all
+                stacks (in order).
+            **kwargs: Passed to :meth:`PDQBase.program` of each stack.
+        """
+        programs = split_program(
+            program, [pdq.get_num_channels() for pdq in self.pdqs])
+
+        def upload(pdq, program):
+            t0 = time.perf_counter()
+            pdq.program(program, **kwargs)
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        self.upload_times = self._map(upload, [(p,) for p in programs])
+        self.wall_time = time.perf_counter() - t0
+
+    def _fanout(self, name, *args, **kwargs):
+        barrier = threading.Barrier(len(self.pdqs))
+
+        def call(pdq):
+            barrier.wait()
+            t = time.perf_counter()
+            getattr(pdq, name)(*args, **kwargs)
+            return t
+
+        starts = self._map(call, [()]*len(self.pdqs))
+        self.skew = max(starts) - min(starts)
+
+    def set_frame(self, frame, board=0xf):
+        """Select a frame on all stacks.
+
+        See :meth:`PDQBase.set_frame`.
+        """
+        self._fanout("set_frame", frame, board=board)
+
+    def set_config(self, **kwargs):
+        """Set the configuration register on all stacks.
+
+        See :meth:`PDQBase.set_config`.
+        """
+        self._fanout("set_config", **kwargs)
+
+    def set_crc(self, crc=0, board=0xf):
+        """Set the checksum register on all stacks.
+
+        See :meth:`PDQBase.set_crc`.
+        """
+        self._fanout("set_crc", crc, board=board)
+
+    def close(self):
+        """Stop the threads and close the stacks."""
+        for executor in self._executors:
+            executor.shutdown()
+        for pdq in self.pdqs:
+            if hasattr(pdq, "close"):
+                pdq.close()
+
+    def ping(self):
+        return True
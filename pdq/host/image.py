@@ -0,0 +1,207 @@
+"""Binary memory image files (``.pdqimg``).
+
+A file holds the serialized channel memories of a PDQ stack as written by
+:meth:`pdq.host.protocol.PDQBase.program`. It can be uploaded again with
+:meth:`pdq.host.protocol.PDQBase.load_image` without re-serializing the
+wavesynth program.
+
+Layout (little endian, version 1):
+
+    * Header: magic ``b"\\x89PDQIMG\\n"``, version (u16), ``num_boards``,
+      ``num_dacs``, ``num_frames``, number of images (u16 each), checksum
+      (u8), one padding byte.
+    * Memory sizes: ``num_dacs`` times u16, the depth of each DAC channel
+      memory in units of 1024 words (``PDQBase._mem_sizes[num_dacs]``).
+    * Directory: for each image the channel index (u16), the CRC8 of the
+      image (u8), one padding byte, the offset and the length of the image
+      in bytes (u64 each).
+    * The images, each aligned to 8 bytes. An image is the content of a
+      channel memory starting at address 0. It starts with the frame
+      address table of the channel (``num_frames`` times u16).
+
+The checksum is the CRC8 (:data:`pdq.host.protocol.crc8`) of the memory
+write messages (command, address and data) of all images in order, i.e.
+:attr:`PDQBase.checksum` after :meth:`PDQBase.set_crc` to zero and a full
+upload.
+"""
+
+import mmap
+import os
+import struct
+
+from .protocol import crc8, PDQ_CMD
+
+
+MAGIC = b"\x89PDQIMG\n"
+VERSION = 1
+
+_header = struct.Struct("<8sHHHHHBx")
+_record = struct.Struct("<HBxQQ")
+_align = 8
+
+
+class ImageError(Exception):
+    """Raised when a file is not a valid image or does not match the
+    stack."""
+    pass
+
+
+def write_checksum(board, mem, data, crc=0):
+    """CRC8 of a memory write message.
+
+    Args:
+        board (int): Board.
+        mem (int): Channel memory.
+        data (bytes-like): Data written to address 0.
+        crc (int): Checksum before the message.
+
+    Returns:
+        int: Checksum after the message.
+    """
+    crc = crc8(bytes([PDQ_CMD(board, 1, mem, 1), 0, 0]), crc)
+    return crc8(data, crc)
+
+
+def save(f, num_boards, num_dacs, num_frames, mem_sizes, images):
+    """Write an image file.
+
+    Args:
+        f (file-like): Binary file to write to.
+        num_boards (int): Number of boards in the stack.
+        num_dacs (int): Number of DAC channels per board.
+        num_frames (int): Number of frames.
+        mem_sizes (tuple[int]): Memory depth of each DAC channel in units
+            of 1024 words.
+        images (list[tuple[int, bytes]]): Channel index and memory image
+            of each channel.
+    """
+    checksum = 0
+    records = []
+    pos = _header.size + 2*num_dacs + _record.size*len(images)
+    offset = pos
+    for channel, data in images:
+        board, mem = divmod(channel, num_dacs)
+        checksum = write_checksum(board, mem, data, checksum)
+        offset = (offset + _align - 1) & -_align
+        records.append((channel, crc8(data), offset, len(data)))
+        offset += len(data)
+    f.write(_header.pack(MAGIC, VERSION, num_boards, num_dacs, num_frames,
+                         len(images), checksum))
+    f.write(struct.pack("<{}H".format(num_dacs), *mem_sizes))
+    for record in records:
+        f.write(_record.pack(*record))
+    for (channel, data), (_, _, offset, length) in zip(images, records):
+        f.write(bytes(offset - pos))
+        f.write(data)
+        pos = offset + length
+
+
+class PDQImage:
+    """Memory images read from a buffer.
+
+    Use :meth:`open` to map a file. The images are views into the buffer
+    and are not copied.
+
+    Args:
+        buf (bytes-like): Content of an image file.
+
+    Attributes:
+        version (int): Format version.
+        num_boards (int): Number of boards in the stack.
+        num_dacs (int): Number of DAC channels per board.
+        num_frames (int): Number of frames.
+        mem_sizes (tuple[int]): Memory depth of each DAC channel in units
+            of 1024 words.
+        checksum (int): CRC8 of the memory writes of all images.
+        images (list[tuple[int, memoryview]]): Channel index and memory
+            image of each channel.
+    """
+    def __init__(self, buf):
+        self._mmap = None
+        self._view = view = memoryview(buf).cast("B")
+        if len(view) < _header.size:
+            raise ImageError("file too short")
+        (magic, self.version, self.num_boards, self.num_dacs,
+         self.num_frames, num_images, self.checksum) = _header.unpack_from(
+             view)
+        if magic != MAGIC:
+            raise ImageError("not a PDQ image")
+        if self.version != VERSION:
+            raise ImageError("unsupported version {}".format(self.version))
+        pos = _header.size
+        self.mem_sizes = struct.unpack_from(
+            "<{}H".format(self.num_dacs), view, pos)
+        pos += 2*self.num_dacs
+        self.images = []
+        for i in range(num_images):
+            channel, crc, offset, length = _record.unpack_from(view, pos)
+            pos += _record.size
+            if offset + length > len(view):
+                raise ImageError("image of channel {} truncated".format(
+                    channel))
+            data = view[offset:offset + length]
+            if crc8(data) != crc:
+                raise ImageError("image of channel {} corrupt".format(
+                    channel))
+            self.images.append((channel, data))
+
+    @classmethod
+    def open(cls, filename):
+        """Map an image file into memory.
+
+        Args:
+            filename (str): Image file.
+
+        Returns:
+            PDQImage: The image. Use it as a context manager or
+            call :meth:`close` to unmap the file.
+        """
+        with open(filename, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise ImageError("file empty")
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # if the file is invalid, the views may still be referenced and
+        # the map is closed when it is collected
+        image = cls(m)
+        image._mmap = m
+        return image
+
+    def close(self):
+        """Release the images and unmap the file."""
+        for channel, data in self.images:
+            data.release()
+        self.images = []
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def geometry(self):
+        """Keyword arguments for a matching stack.
+
+        Returns:
+            dict: ``num_boards``, ``num_dacs`` and ``num_frames``.
+        """
+        return dict(num_boards=self.num_boards, num_dacs=self.num_dacs,
+                    num_frames=self.num_frames)
+
+    def table(self, channel):
+        """Frame address table of a channel.
+
+        Args:
+            channel (int): Channel index.
+
+        Returns:
+            list[int]: Word address of the entry segment of each frame.
+        """
+        for i, data in self.images:
+            if i == channel:
+                return list(struct.unpack_from(
+                    "<{}H".format(self.num_frames), data))
+        raise KeyError(channel)
@@ -0,0 +1,39 @@
+"""Lightweight stand-in for :func:`artiq.language.core.portable`.
+
+The host side code does not require ARTIQ and importing it is slow. Methods
+decorated with :func:`portable` are marked as ARTIQ portable functions if
+ARTIQ is already imported. Otherwise they are recorded and marked once
+:func:`embed` is called (by the ARTIQ-facing modules, e.g.
+:mod:`pdq.artiq.spi`, after they have imported ARTIQ).
+"""
+
+import sys
+
+
+_pending = []
+
+
+def portable(function):
+    """Decorate a function that can be called on the host and in kernels.
+
+    Args:
+        function (callable): Function or method.
+
+    Returns:
+        callable: The same function.
+    """
+    core = sys.modules.get("artiq.language.core")
+    if core is not None:
+        return core.portable(function)
+    _pending.append(function)
+    return function
+
+
+def embed():
+    """Mark the functions decorated before ARTIQ was imported as portable.
+
+    Requires ARTIQ.
+    """
+    from artiq.language.core import portable
+    while _pending:
+        portable(_pending.pop())
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(profile, name):
+    """Time a phase if profiling is enabled.
+
+    Usage::
+
+        with span(self.profile, "program.encode"):
+            ...
+
+    Args:
+        profile (Profile): Collector or ``None`` to disable profiling.
+        name (str): Name of the phase.
+
+    Returns:
+        Context manager that records the duration of its body with the
+        collector (:meth:`Profile.add`) or does nothing.
+    """
+    if profile is None:
+        return _null_span
+    return _Span(profile, name)
+
+
+class Profile:
+    """Collector of phase durations and counters.
+
+    Assign an instance to the ``profile`` attribute of a
+    :class:`pdq.host.protocol.PDQBase` (or a
+    :class:`pdq.artiq.mediator.CompoundPDQ`) to record the time spent in
+    the phases of programming and writing and the amount of data handled.
+    With ``profile = None`` (the default) the instrumentation reduces to a
+    few attribute lookups.
+
+    The phases are:
+
+        * ``program.encode``: wavesynth lines to segments
+          (:meth:`PDQBase.encode_program`)
+        * ``program.serialize``: placement and memory images
+          (:meth:`Channel.serialize`)
+        * ``program.write``: differential memory writes
+          (:meth:`PDQBase.update_mem`)
+        * ``load_image.write``: the same for :meth:`PDQBase.load_image`
+        * ``write.crc``, ``write.escape``, ``write.device``: checksum,
+          escaping and device writes of :meth:`pdq.host.usb.PDQ.write`
+        * ``program_host.encode``, ``program_host.serialize``: the same
+          for :meth:`pdq.artiq.spi.PDQ.program_host`
+        * ``arm.split``, ``arm.program``, ``arm.config``: splitting the
+          program over the stacks, programming and configuring them in
+          :meth:`pdq.artiq.mediator.CompoundPDQ.arm`
+
+    Nested phases are included in their parents (``write.*`` in
+    ``program.write``).
+
+    Args:
+        callback (callable): Called as ``callback(name, duration)`` for
+            each completed phase. May be used to forward the durations to
+            other collectors.
+
+    Attributes:
+        times (dict): Total duration of each phase in seconds.
+        calls (dict): Number of completed spans of each phase.
+        counts (dict): Counters (e.g. ``program.lines``,
+            ``program.bytes``, ``write.bytes``).
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all durations and counters."""
+        self.times = OrderedDict()
+        self.calls = OrderedDict()
+        self.counts = OrderedDict()
+
+    def span(self, name):
+        """Context manager timing a phase (see :func:`span`)."""
+        return _Span(self, name)
+
+    def add(self, name, duration):
+        """Record a completed phase.
+
+        Args:
+            name (str): Name of the phase.
+            duration (float): Duration in seconds.
+        """
+        # the USB writer thread records concurrently
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.) + duration
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback(name, duration)
+
+    def count(self, name, n=1):
+        """Increment a counter.
+
+        Args:
+            name (str): Name of the counter.
+            n (int): Increment.
+        """
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self):
+        """Format the phase breakdown.
+
+        Returns:
+            str: Table of durations, calls and counters.
+        """
+        lines = ["{:24s} {:>10s} {:>8s}".format("phase", "time/ms", "calls")]
+        for name, t in self.times.items():
+            lines.append("{:24s} {:10.3f} {:8d}".format(
+                name, t*1e3, self.calls[name]))
+        if self.counts:
+            lines.append("{:24s} {:>10s}".format("counter", "value"))
+            for name, n in self.counts.items():
+                lines.append("{:24s} {:10d}".format(name, n))
+        return "\n".join(lines)
@@ -1,15 +1,19 @@
+import base64
+import bisect
+import hashlib
+import io
 from math import log, sqrt
 import logging
 import struct
-import warnings
+import threading
 
-try:
-    from artiq.language.core import portable
-except ImportError:
-    warnings.warn("no artiq found")
-    portable = lambda f: f
+import numpy as np
 
+from .portable import portable
 from .crc import CRC
+from .cache import LRUCache, canonical_hash, program_hash
+from .profile import span
+from .columnar import ColumnarFrame, ColumnarLines, ColumnarProgram
 
 
 logger = logging.getLogger(__name__)
@@ -47,7 +51,9 @@ class Segment:
         out_scale (float): Steps per Volt.
         cordic_gain (float): CORDIC amplitude gain.
         addr (int): Address assigned to this segment.
-        data (bytes): Serialized segment data.
+        data (bytearray): Serialized segment data.
+        terminated (bool): The last line of this segment returns to the
+            frame address table.
     """
     max_time = 1 << 16  # uint16 timer
     max_val = 1 << 15  # int16 DAC
@@ -58,8 +64,9 @@ class Segment:
         cordic_gain *= sqrt(1 + 2**(-2*i))
 
     def __init__(self):
-        self.data = b""
+        self.data = bytearray()
         self.addr = None
+        self.terminated = False
 
     def line(self, typ, duration, data, trigger=False, silence=False,
              aux=False, shift=0, jump=False, clear=False, wait=False):
@@ -91,7 +98,9 @@ class Segment:
             (aux << 8) | (shift << 9) | (jump << 13) | (clear << 14) |
             (wait << 15)
         )
-        self.data += struct.pack("<HH", header, duration) + data
+        self.data += struct.pack("<HH", header, duration)
+        self.data += data
+        self.terminated = bool(jump)
 
     @staticmethod
     def pack(widths, values):
@@ -122,6 +131,97 @@ class Segment:
                          values, widths, ud, fmt, e)
             raise e
 
+    @staticmethod
+    def pack_many(widths, values):
+        """Pack spline data for many lines at once.
+
+        Vectorized equivalent of :meth:`pack`. Each row of ``values`` is
+        packed exactly like :meth:`pack` would pack it.
+
+        Args:
+            widths (list[int]): Widths of values in multiples of 16 bits.
+            values (array[N, M]): Values to pack, one row per line.
+                ``M <= len(widths)``.
+
+        Returns:
+            array[N]: Packed data as a structured array with one record
+            per line.
+
+        Raises:
+            ValueError: If a value is not finite or does not fit into its
+                width.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 2:
+            raise ValueError("values must be two-dimensional")
+        fields = []
+        columns = []
+        for i, width in enumerate(widths[:values.shape[1]]):
+            value = np.rint(values[:, i] * (1 << 16*width))
+            limit = 1 << 16*(width + 1) - 1
+            bad = ~((value >= -limit) & (value < limit))
+            if np.any(bad):
+                j = np.flatnonzero(bad)[0]
+                logger.error("can not pack %s as %s in line %i",
+                             values[j], widths, j)
+                raise ValueError("value out of range in line {}".format(j))
+            value = value.astype(np.int64)
+            if width == 2:
+                fields.append(("l{}".format(i), "<u2"))
+                columns.append(value & 0xffff)
+                value >>= 16
+                width -= 1
+            fields.append(("v{}".format(i), "<" + "hi"[width]))
+            columns.append(value)
+        data = np.empty(len(values), dtype=fields)
+        for (name, _), column in zip(fields, columns):
+            data[name] = column
+        return data
+
+    def line_many(self, typ, duration, data, trigger=False, silence=False,
+                  aux=False, shift=0, jump=False, clear=False, wait=False):
+        """Append many lines to this segment.
+
+        Vectorized equivalent of :meth:`line`. All lines share the output
+        module and the data layout.
+
+        Args:
+            typ (int): Output module to target with these lines.
+            duration (array[N]): Durations of the lines.
+            data (array[N]): Line data as returned by :meth:`pack_many`.
+            trigger, silence, aux, shift, jump, clear, wait: See
+                :meth:`line`. Either scalars applying to all lines or
+                arrays with one entry per line.
+        """
+        words = data.dtype.itemsize//2
+        assert data.dtype.itemsize % 2 == 0, data.dtype
+        assert words <= 14
+        duration = np.asarray(duration)
+        if np.any((duration < 0) | (duration >= self.max_time)):
+            raise ValueError("duration out of range")
+        header = np.uint16(1 + words | (typ << 4))
+        for flag, pos in ((trigger, 6), (silence, 7), (aux, 8), (shift, 9),
+                          (jump, 13), (clear, 14), (wait, 15)):
+            header = header | np.asarray(flag, dtype=np.uint16) << pos
+        lines = np.empty(len(data), dtype=[
+            ("header", "<u2"), ("duration", "<u2")] + data.dtype.descr)
+        lines["header"] = header
+        lines["duration"] = duration
+        for name in data.dtype.names:
+            lines[name] = data[name]
+        self.data += lines.tobytes()
+        if len(lines):
+            self.terminated = bool(np.asarray(jump).ravel()[-1])
+
+    def terminate(self):
+        """Append an empty line that ends a frame.
+
+        The line stalls the memory reader before it jumps through the frame
+        table (`wait` does not prevent reading the next line).
+        """
+        self.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
+                  jump=True)
+
     def bias(self, amplitude=[], **kwargs):
         """Append a bias line to this segment.
 
@@ -159,23 +259,96 @@ class Segment:
         data = self.pack([0, 1, 2, 2, 0, 1, 1], coef)
         self.line(typ=1, data=data, **kwargs)
 
+    def bias_many(self, duration, amplitude, **kwargs):
+        """Append many bias lines to this segment.
+
+        Vectorized equivalent of repeated calls to :meth:`bias`. The
+        serialized data is identical.
+
+        Args:
+            duration (array[N]): Durations of the lines.
+            amplitude (array[N, M]): Amplitude coefficients, one row per
+                line. See :meth:`bias`.
+            **kwargs: Passed to :meth:`line_many`.
+        """
+        coef = self.out_scale*np.asarray(amplitude, dtype=np.float64)
+        discrete_compensate(coef.T)
+        data = self.pack_many([0, 1, 2, 2], coef)
+        self.line_many(typ=0, duration=duration, data=data, **kwargs)
+
+    def dds_many(self, duration, amplitude, phase=None, **kwargs):
+        """Append many DDS lines to this segment.
+
+        Vectorized equivalent of repeated calls to :meth:`dds`. The
+        serialized data is identical.
+
+        Args:
+            duration (array[N]): Durations of the lines.
+            amplitude (array[N, M]): Amplitude coefficients, one row per
+                line. See :meth:`dds`.
+            phase (array[N, K]): Phase/frequency/chirp coefficients, one
+                row per line. See :meth:`dds`.
+            **kwargs: Passed to :meth:`line_many`.
+        """
+        scale = self.out_scale/self.cordic_gain
+        coef = scale*np.asarray(amplitude, dtype=np.float64)
+        discrete_compensate(coef.T)
+        if phase is not None and np.shape(phase)[1]:
+            assert coef.shape[1] == 4
+            phase = np.asarray(phase, dtype=np.float64)
+            coef = np.concatenate([coef, phase*self.max_val*2], axis=1)
+        data = self.pack_many([0, 1, 2, 2, 0, 1, 1], coef)
+        self.line_many(typ=1, duration=duration, data=data, **kwargs)
+
+
+class ChannelMemoryError(Exception):
+    """Raised when a segment does not fit into the free channel memory."""
+    pass
+
 
 class Channel:
     """PDQ Channel.
 
+    Channel memory after the frame address table is managed by an
+    allocator with a free-list. Segments are allocated contiguously by
+    :meth:`place`. Individual frames can be replaced with :meth:`replace`,
+    which reuses and releases memory. The resulting fragmentation can be
+    undone with :meth:`compact`.
+
+    Terminated segments (see :attr:`Segment.terminated`) with identical data
+    are stored only once and share their address. Sharing does not apply to
+    segments that follow a segment which is not terminated, as these are
+    entered by the memory parser from the preceding segment.
+
     Attributes:
         num_frames (int): Number of frames supported.
         max_data (int): Number of 16 bit data words per channel.
-        segments (list[Segment]): Segments added to this channel.
+        segments (list[Segment]): Segments added to this channel. The
+            segment with index ``i`` is the entry segment of frame ``i``.
+        best_fit (bool): Allocate the smallest sufficient free block
+            instead of the first one.
+        dedup_ratio (float): Ratio of the size of all segments to the size
+            of the memory they occupy after the last :meth:`place`.
     """
-    def __init__(self, max_data, num_frames):
+    def __init__(self, max_data, num_frames, best_fit=False):
         self.max_data = max_data
         self.num_frames = num_frames
+        self.best_fit = best_fit
         self.segments = []
+        self.dedup_ratio = 1.
+        self._reset()
+
+    def _reset(self):
+        self._free = [(self.num_frames, self.max_data)]
+        self._blocks = {}  # addr: size
+        self._refs = {}  # addr: reference count
+        self._keys = {}  # addr: content key
+        self._content = {}  # content key: addr
 
     def clear(self):
         """Remove all segments."""
         self.segments.clear()
+        self._reset()
 
     def new_segment(self):
         """Create and attach a new :class:`Segment` to this channel.
@@ -187,21 +360,271 @@ class Channel:
         self.segments.append(segment)
         return segment
 
+    def append(self, segment):
+        """Attach and allocate a segment.
+
+        The segment is stored only once if a segment with identical data is
+        allocated already and both are terminated.
+
+        Args:
+            segment (Segment): Segment to attach.
+
+        Returns:
+            bool: Whether memory has been allocated for the segment data.
+            If not, the data is shared with another segment or empty.
+        """
+        self.segments.append(segment)
+        segment.addr = self._alloc_segment(segment)
+        return self._refs.get(segment.addr, 0) == 1
+
+    def alloc(self, size):
+        """Allocate channel memory.
+
+        Args:
+            size (int): Number of 16 bit words.
+
+        Returns:
+            int: Address of the allocated block.
+
+        Raises:
+            ChannelMemoryError: If there is no sufficiently large free block.
+        """
+        fits = [(stop - start, i) for i, (start, stop) in
+                enumerate(self._free) if stop - start >= size]
+        if not fits:
+            raise ChannelMemoryError(
+                "no free block of {} words, largest is {}".format(
+                    size, self.largest_free_bytes()//2))
+        if self.best_fit:
+            i = min(fits)[1]
+        else:
+            i = fits[0][1]
+        start, stop = self._free[i]
+        if stop - start == size:
+            del self._free[i]
+        else:
+            self._free[i] = start + size, stop
+        if size:
+            self._blocks[start] = size
+            self._refs[start] = 1
+        return start
+
+    def _alloc_segment(self, segment):
+        size = len(segment.data)//2
+        if not (size and segment.terminated):
+            return self.alloc(size)
+        key = hashlib.sha1(segment.data).digest()
+        addr = self._content.get(key)
+        if addr is not None:
+            self._refs[addr] += 1
+            return addr
+        addr = self.alloc(size)
+        self._content[key] = addr
+        self._keys[addr] = key
+        return addr
+
+    def release(self, addr):
+        """Release a block of channel memory.
+
+        Blocks that are shared between segments are only released when
+        the last reference to them is released.
+
+        Args:
+            addr (int): Address of the block, as returned by :meth:`alloc`.
+        """
+        if addr not in self._blocks:
+            return
+        self._refs[addr] -= 1
+        if self._refs[addr]:
+            return
+        del self._refs[addr]
+        key = self._keys.pop(addr, None)
+        if key is not None:
+            del self._content[key]
+        size = self._blocks.pop(addr)
+        start, stop = addr, addr + size
+        i = bisect.bisect(self._free, (start, stop))
+        if i < len(self._free) and self._free[i][0] == stop:
+            stop = self._free.pop(i)[1]
+        if i > 0 and self._free[i - 1][1] == start:
+            i -= 1
+            start = self._free.pop(i)[0]
+        self._free.insert(i, (start, stop))
+
+    def _shrink(self, addr, size):
+        old = self._blocks[addr]
+        self._blocks[addr] = size
+        if old > size:
+            self._blocks[addr + size] = old - size
+            self._refs[addr + size] = 1
+            self.release(addr + size)
+
+    def snapshot(self):
+        """Record the segments and the allocation state.
+
+        Returns:
+            tuple: State to be passed to :meth:`restore`.
+        """
+        return (list(self.segments), list(self._free), dict(self._blocks),
+                dict(self._refs), dict(self._keys), dict(self._content))
+
+    def restore(self, state):
+        """Undo the allocations and replacements since :meth:`snapshot`.
+
+        Args:
+            state (tuple): State returned by :meth:`snapshot`.
+        """
+        (segments, self._free, self._blocks, self._refs, self._keys,
+         self._content) = state
+        self.segments[:] = segments
+
+    def free_bytes(self):
+        """Amount of free channel memory in bytes."""
+        return 2*sum(stop - start for start, stop in self._free)
+
+    def largest_free_bytes(self):
+        """Size of the largest free block of channel memory in bytes."""
+        return 2*max([stop - start for start, stop in self._free] + [0])
+
     def place(self):
         """Place segments contiguously.
 
         Assign segment start addresses and determine length of data.
+        All previous allocations are discarded. Identical terminated
+        segments share their address.
 
         Returns:
             int: Amount of memory in use on this channel.
         """
+        self._reset()
         addr = self.num_frames
+        size = 0
+        shared = True
         for segment in self.segments:
-            segment.addr = addr
-            addr += len(segment.data)//2
-        assert addr <= self.max_data, addr
+            n = len(segment.data)//2
+            if shared:
+                segment.addr = self._alloc_segment(segment)
+            else:
+                segment.addr = self.alloc(n)
+            shared = segment.terminated
+            addr = max(addr, segment.addr + n)
+            size += n
+        used = sum(self._blocks.values())
+        self.dedup_ratio = size/used if used else 1.
         return addr
 
+    def replace(self, frame, segment):
+        """Replace the entry segment of a frame.
+
+        The new segment is assigned the address of the segment it replaces
+        if it fits there and the remaining memory is released. Otherwise
+        the old segment is released and the new one is allocated, possibly
+        overlapping the memory of the old one.
+        The segments must have been placed before.
+
+        Args:
+            frame (int): Frame index. Frames are assumed to be entered at
+                the segment with the same index (see :meth:`table`).
+                The frame following the last segment can be added.
+            segment (Segment): New segment.
+
+        Raises:
+            ChannelMemoryError: If the new segment does not fit. The old
+                segment is kept in that case.
+        """
+        if not 0 <= frame <= min(len(self.segments), self.num_frames - 1):
+            raise ValueError("frame index out of range")
+        size = len(segment.data)//2
+        if frame < len(self.segments):
+            old = self.segments[frame]
+            if old.addr is None:
+                raise ValueError("segments have not been placed")
+            key = hashlib.sha1(segment.data).digest()
+            if (self._refs.get(old.addr) == 1 and
+                    self._blocks[old.addr] >= size > 0 and
+                    key not in self._content):
+                self._shrink(old.addr, size)
+                old_key = self._keys.pop(old.addr, None)
+                if old_key is not None:
+                    del self._content[old_key]
+                segment.addr = old.addr
+                if segment.terminated:
+                    self._content[key] = segment.addr
+                    self._keys[segment.addr] = key
+            else:
+                # the old block counts as free, it may be merged with its
+                # neighbors and reused
+                state = self.snapshot()
+                self.release(old.addr)
+                try:
+                    segment.addr = self._alloc_segment(segment)
+                except ChannelMemoryError:
+                    self.restore(state)
+                    raise
+            self.segments[frame] = segment
+        else:
+            segment.addr = self._alloc_segment(segment)
+            self.segments.append(segment)
+
+    def compaction_plan(self):
+        """Plan the compaction of the channel memory.
+
+        Allocated blocks are moved towards the frame address table,
+        preserving their order, such that the free memory becomes a single
+        block at the end. Blocks that are already in place are not moved.
+        Each move is to a lower address, so that executing the moves in
+        order never overwrites a block that has not been moved yet.
+
+        Returns:
+            tuple[list, list]: List of moves as tuples of
+            ``(segment, old_addr, new_addr)`` and list of frame address
+            table rewrites as tuples of ``(frame, new_addr)``.
+        """
+        addrs = {}
+        addr = self.num_frames
+        for old in sorted(self._blocks):
+            addrs[old] = addr
+            addr += self._blocks[old]
+        moves = []
+        table = []
+        moved = set()
+        for frame, segment in enumerate(self.segments):
+            new = addrs.get(segment.addr, segment.addr)
+            if new == segment.addr:
+                continue
+            if segment.addr not in moved:
+                moved.add(segment.addr)
+                moves.append((segment, segment.addr, new))
+            if frame < self.num_frames:
+                table.append((frame, new))
+        moves.sort(key=lambda move: move[1])
+        return moves, table
+
+    def compact(self):
+        """Compact the channel memory.
+
+        Executes the bookkeeping of :meth:`compaction_plan`: segment
+        addresses are updated and the free memory becomes a single block.
+        The memory on the device has to be updated accordingly by
+        executing the moves in order and patching the frame address table
+        entries of each moved segment right after it has been written
+        (see :meth:`PDQBase.compact`).
+
+        Returns:
+            tuple[list, list]: See :meth:`compaction_plan`.
+        """
+        moves, table = self.compaction_plan()
+        addrs = {old: new for segment, old, new in moves}
+        for segment in self.segments:
+            segment.addr = addrs.get(segment.addr, segment.addr)
+        for attr in "_blocks", "_refs", "_keys":
+            setattr(self, attr, {addrs.get(addr, addr): value for
+                                 addr, value in getattr(self, attr).items()})
+        self._content = {key: addr for addr, key in self._keys.items()}
+        addr = self.num_frames + sum(self._blocks.values())
+        self._free = [(addr, self.max_data)] if addr < self.max_data else []
+        return moves, table
+
     def table(self, entry=None):
         """Generate the frame address table.
 
@@ -233,17 +656,134 @@ class Channel:
 
         Places the segments contiguously in memory after the frame table.
         Allocates and assigns segment and frame table addresses.
-        Serializes segment data and prepends frame address table.
+        Copies the frame address table and the segment data into a single
+        buffer of the size of the used channel memory.
 
         Args:
             entry (list[Segment]): See :meth:`table`.
 
         Returns:
-            bytes: Channel memory data.
+            bytearray: Channel memory data.
         """
-        self.place()
-        data = b"".join([segment.data for segment in self.segments])
-        return self.table(entry) + data
+        data = bytearray(2*self.place())
+        data[:2*self.num_frames] = self.table(entry)
+        done = set()
+        for segment in self.segments:
+            if not segment.data or segment.addr in done:
+                continue
+            done.add(segment.addr)
+            addr = 2*segment.addr
+            data[addr:addr + len(segment.data)] = segment.data
+        return data
+
+
+def diff_ranges(old, new, gap=0):
+    """Find the ranges where a memory image differs from a previous one.
+
+    Images are compared in units of 16 bit words. Data in ``new`` beyond
+    the end of ``old`` is always considered changed. Changed ranges that are
+    separated by no more than ``gap`` unchanged bytes are merged.
+
+    Args:
+        old (bytes): Previous memory image.
+        new (bytes): New memory image.
+        gap (int): Maximum number of unchanged bytes to merge.
+
+    Returns:
+        list[tuple[int, int]]: Start and stop byte addresses of the changed
+        ranges in ``new``.
+    """
+    n = min(len(old), len(new))
+    changed = np.ones(len(new)//2, dtype=np.bool_)
+    changed[:n//2] = (
+        np.frombuffer(memoryview(old)[:n], dtype="<u2") !=
+        np.frombuffer(memoryview(new)[:n], dtype="<u2"))
+    idx = np.flatnonzero(changed)
+    if not len(idx):
+        return []
+    breaks = np.flatnonzero(np.diff(idx) > gap//2 + 1)
+    starts = idx[np.r_[0, breaks + 1]]
+    stops = idx[np.r_[breaks, len(idx) - 1]] + 1
+    return [(2*int(i), 2*int(j)) for i, j in zip(starts, stops)]
+
+
+def split_lines(data, num_channels):
+    """Split wavesynth lines by channel.
+
+    Args:
+        data (list or ColumnarFrame): List of wavesynth lines.
+        num_channels (int): Number of channels to split into.
+
+    Returns:
+        list[list[tuple]]: For each channel the list of its lines as tuples
+        of target (``"bias"`` or ``"dds"``), target arguments, ``shift``,
+        ``duration``, ``trigger`` and ``silence``. For a
+        :class:`ColumnarFrame`, a :class:`ColumnarLines` for each channel.
+    """
+    if isinstance(data, ColumnarFrame):
+        return data.split(num_channels)
+    channels = [[] for i in range(num_channels)]
+    for line in data:
+        dac_divider = line.get("dac_divider", 1)
+        shift = int(log(dac_divider, 2))
+        if 2**shift != dac_divider:
+            raise ValueError("only power-of-two dac_dividers supported")
+        duration = line["duration"]
+        trigger = line.get("trigger", False)
+        for lines, data in zip(channels, line["channel_data"]):
+            silence = data.get("silence", False)
+            targets = [target for target in data if target != "silence"]
+            if len(targets) != 1:
+                raise ValueError("only one target per channel and line "
+                                 "supported")
+            target = targets[0]
+            lines.append((target, data[target], shift, duration, trigger,
+                          silence))
+    return channels
+
+
+def encode_lines(segment, lines):
+    """Append lines of one channel to a segment.
+
+    Args:
+        segment (Segment): Segment to append to.
+        lines (list[tuple]): Lines as returned by :func:`split_lines`.
+    """
+    if isinstance(lines, ColumnarLines):
+        lines.encode(segment)
+        return
+    for target, kwargs, shift, duration, trigger, silence in lines:
+        getattr(segment, target)(
+            shift=shift, duration=duration, trigger=trigger,
+            silence=silence, **kwargs)
+
+
+def encode_frames(frames):
+    """Serialize and terminate the frames of one channel.
+
+    This is executed by the workers of :meth:`PDQBase.encode_program`.
+
+    Args:
+        frames (list[list[tuple]]): For each frame, the lines as returned by
+            :func:`split_lines`.
+
+    Returns:
+        list[bytes]: Serialized data of each frame.
+    """
+    data = []
+    for lines in frames:
+        segment = Segment()
+        encode_lines(segment, lines)
+        segment.terminate()
+        data.append(bytes(segment.data))
+    return data
+
+
+def _decode_payload(data):
+    # base64 is more compact than escaped bytes in text RPC protocols
+    if isinstance(data, str):
+        return base64.b64decode(data)
+    return data
 
 
 @portable
@@ -270,33 +810,58 @@ class PDQBase:
     """
     PDQ stack.
 
+    The memory images last written by :meth:`program` are kept as shadow
+    copies. Subsequent calls to :meth:`program` only write the ranges of
+    the channel memories that changed.
+
     Attributes:
         checksum (int): Running checksum of data written.
+        bytes_written (int): Number of channel memory bytes written by
+            :meth:`program`.
+        bytes_skipped (int): Number of channel memory bytes that
+            :meth:`program` did not need to write because they were
+            unchanged.
         num_channels (int): Number of channels in this stack.
         num_boards (int): Number of boards in this stack.
         num_dacs (int): Number of DAC outputs per board.
         num_frames (int): Number of frames supported.
         channels (list[Channel]): List of :class:`Channel` in this stack.
+        frame_cache (LRUCache): Cache of serialized frames or ``None``.
+        profile (Profile): Collector of phase durations or ``None``
+            (see :class:`pdq.host.profile.Profile`).
+        program_cache (ProgramCache): Cache of the memory images of
+            programs or ``None`` (see :class:`pdq.host.cache.ProgramCache`).
     """
     freq = 50e6
+    profile = None
+    program_cache = None
 
-    _mem_sizes = [None, (20,), (10, 10), (8, 6, 6)]  # 10kx16 units
+    _mem_sizes = [None, (20,), (10, 10), (8, 6, 6)]  # 1024x16 bit units
+    _mem_overhead = 3  # bytes per write_mem(): command and address
 
-    def __init__(self, num_boards=3, num_dacs=3, num_frames=32):
+    def __init__(self, num_boards=3, num_dacs=3, num_frames=32,
+                 cache_size=1 << 22):
         """Initialize PDQ stack.
 
         Args:
             num_boards (int): Number of boards in this stack.
             num_dacs (int): Number of DAC outputs per board.
             num_frames (int): Number of frames supported.
+            cache_size (int): Size budget of the frame cache in bytes.
+                If zero, serialized frames are not cached.
         """
         self.checksum = 0
+        self.frame_cache = LRUCache(cache_size) if cache_size else None
+        self.bytes_written = 0
+        self.bytes_skipped = 0
+        self._shadow = {}
+        self._shadow_lock = threading.Lock()
         self.num_boards = num_boards
         self.num_dacs = num_dacs
         self.num_frames = num_frames
         self.num_channels = self.num_dacs * self.num_boards
         m = self._mem_sizes[num_dacs]
-        self.channels = [Channel(m[j] << 11, num_frames)
+        self.channels = [Channel(m[j] << 10, num_frames)
                          for i in range(num_boards)
                          for j in range(num_dacs)]
 
@@ -424,26 +989,189 @@ class PDQBase:
         Args:
             segments (list[Segment]): List of :class:`Segment` to append the
                 lines to.
-            data (list): List of wavesynth lines.
-        """
-        for i, line in enumerate(data):
-            dac_divider = line.get("dac_divider", 1)
-            shift = int(log(dac_divider, 2))
-            if 2**shift != dac_divider:
-                raise ValueError("only power-of-two dac_dividers supported")
-            duration = line["duration"]
-            trigger = line.get("trigger", False)
-            for segment, data in zip(segments, line["channel_data"]):
-                silence = data.pop("silence", False)
-                if len(data) != 1:
-                    raise ValueError("only one target per channel and line "
-                                     "supported")
-                for target, target_data in data.items():
-                    getattr(segment, target)(
-                        shift=shift, duration=duration, trigger=trigger,
-                        silence=silence, **target_data)
-
-    def program(self, program, channels=None):
+            data (list or ColumnarFrame): List of wavesynth lines.
+        """
+        for segment, lines in zip(segments, split_lines(data, len(segments))):
+            encode_lines(segment, lines)
+
+    def update_mem(self, mem, adr, data, board=0xf, force_full=False):
+        """Update a range of channel memory.
+
+        Compares the data with the shadow copy of what was last written to
+        this memory and only writes the changed ranges. Ranges separated by
+        fewer unchanged bytes than the overhead of a separate
+        :meth:`write_mem` are coalesced.
+
+        The shadow copy is established by writing an image starting at
+        address 0. Until then, all data is written. It is updated once the
+        data has been written and discarded if writing fails.
+
+        Args:
+            mem (int): Channel memory to write to.
+            adr (int): Start address to write data to.
+            data (bytearray): Data to write to memory.
+            board (int): Board to write to (0-0xe).
+            force_full (bool): Write all data, regardless of the shadow
+                copy.
+        """
+        with self._shadow_lock:
+            shadow = self._shadow.get((board, mem))
+            if shadow is None or force_full:
+                ranges = [(0, len(data))]
+            else:
+                ranges = diff_ranges(
+                    memoryview(shadow)[adr:adr + len(data)], data,
+                    self._mem_overhead)
+            if shadow is None and adr == 0:
+                self._shadow[board, mem] = shadow = bytearray()
+            elif shadow is not None and len(shadow) < adr:
+                del self._shadow[board, mem]  # unknown gap
+                shadow = None
+        try:
+            for start, stop in ranges:
+                if stop - start == len(data):
+                    chunk = data
+                else:
+                    chunk = data[start:stop]
+                self.write_mem(mem=mem, adr=adr + start, data=chunk,
+                               board=board)
+                self.bytes_written += stop - start
+                self.bytes_skipped -= stop - start
+        except:
+            # the memory is in an unknown state
+            with self._shadow_lock:
+                if self._shadow.get((board, mem)) is shadow:
+                    del self._shadow[board, mem]
+            raise
+        if shadow is not None:
+            with self._shadow_lock:
+                shadow[adr:adr + len(data)] = data
+        self.bytes_skipped += len(data)
+
+    def frame_key(self, data, num_segments):
+        """Cache key for the serialized data of a frame.
+
+        The key is a hash of the pickled frame. Computing it traverses all
+        lines and costs about a twentieth of serializing the frame.
+
+        Args:
+            data (list or ColumnarFrame): List of wavesynth lines.
+            num_segments (int): Number of segments (channels) the frame is
+                serialized for.
+
+        Returns:
+            str: Hash of the frame, the number of segments and the
+            :class:`Segment` scaling constants.
+        """
+        return canonical_hash([
+            data, num_segments, Segment.max_time, Segment.max_val,
+            Segment.out_scale, Segment.cordic_gain])
+
+    def program_frame_segments(self, segments, data):
+        """Append the wavesynth lines of a frame to the given segments and
+        terminate them.
+
+        The serialized data of the frame is looked up in and added to
+        :attr:`frame_cache`.
+
+        Args:
+            segments (list[Segment]): List of :class:`Segment` to append the
+                lines to.
+            data (list or ColumnarFrame): List of wavesynth lines.
+        """
+        key = None
+        if self.frame_cache is not None:
+            key = self.frame_key(data, len(segments))
+            if self._from_cache(segments, key):
+                return
+        start = [len(segment.data) for segment in segments]
+        self.program_segments(segments, data)
+        for segment in segments:
+            segment.terminate()
+        if key is not None:
+            self.frame_cache.put(key, *self._frame_data(
+                [segment.data[i:] for segment, i in zip(segments, start)]))
+
+    def _from_cache(self, segments, key):
+        cached = self.frame_cache.get(key)
+        if cached is None:
+            return False
+        for segment, segment_data in zip(segments, cached):
+            segment.data += segment_data
+            segment.terminated = True
+        return True
+
+    @staticmethod
+    def _frame_data(data):
+        data = [bytes(d) for d in data]
+        return data, sum(len(d) for d in data)
+
+    def encode_program(self, program, channels=None, executor=None,
+                       workers=None):
+        """Clear channels and append each frame of a wavesynth program to
+        fresh segments of the channels.
+
+        Frames are looked up in and added to :attr:`frame_cache`. With an
+        executor, the frames that are not cached are serialized
+        concurrently, one task per channel (see :func:`encode_frames`).
+        The result is identical to serial encoding.
+
+        Args:
+            program (list or ColumnarProgram): Wavesynth program to
+                serialize (see :class:`pdq.host.columnar.ColumnarProgram`).
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+            executor (concurrent.futures.Executor): Executor to serialize
+                the channels with.
+            workers (int): If given and no executor is given, serialize
+                the channels using a temporary
+                :class:`concurrent.futures.ProcessPoolExecutor` with this
+                many worker processes.
+
+        Returns:
+            list[Channel]: The channels.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        chs = [self.channels[i] for i in channels]
+        for channel in chs:
+            channel.clear()
+        segments = [[c.new_segment() for c in chs] for frame in program]
+        if executor is None and workers is not None:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers) as executor:
+                self._encode_frames(program, segments, executor)
+        elif executor is None:
+            for segs, frame in zip(segments, program):
+                self.program_frame_segments(segs, frame)
+        else:
+            self._encode_frames(program, segments, executor)
+        return chs
+
+    def _encode_frames(self, program, segments, executor):
+        num = len(segments[0]) if segments else 0
+        todo = []
+        keys = []
+        for segs, frame in zip(segments, program):
+            key = None
+            if self.frame_cache is not None:
+                key = self.frame_key(frame, num)
+                if self._from_cache(segs, key):
+                    continue
+            todo.append((segs, split_lines(frame, num)))
+            keys.append(key)
+        data = executor.map(encode_frames, [
+            [lines[i] for segs, lines in todo] for i in range(num)])
+        data = list(zip(*data)) or [()]*len(todo)
+        for (segs, lines), key, frame_data in zip(todo, keys, data):
+            for segment, segment_data in zip(segs, frame_data):
+                segment.data += segment_data
+                segment.terminated = True
+            if key is not None:
+                self.frame_cache.put(key, *self._frame_data(frame_data))
+
+    def program(self, program, channels=None, force_full=False,
+                executor=None, workers=None):
         """Serialize a wavesynth program and write it to the channels
         in the stack.
 
@@ -458,28 +1186,294 @@ class PDQBase:
         can be reliably parked in the frame address table.
         The first line of each frame is mandatorily triggered.
 
+        Only the parts of the channel memories that differ from what was
+        last written to them are sent (see :meth:`update_mem`).
+
+        If :attr:`program_cache` is set, the memory images are added to it
+        and programs found there are written without serializing them
+        (see :meth:`program_cached`).
+
         Args:
-            program (list): Wavesynth program to serialize.
+            program (list or ColumnarProgram): Wavesynth program to
+                serialize (see :class:`pdq.host.columnar.ColumnarProgram`).
             channels (list[int]): Channel indices to use. If unspecified, all
                 channels are used.
+            force_full (bool): Write the complete memory images even if the
+                shadow copies indicate that parts are unchanged. Use this if
+                the memory may have been modified by other means (power
+                cycle, other hosts, direct :meth:`write_mem`).
+            executor (concurrent.futures.Executor): Executor to serialize
+                the channels concurrently (see :meth:`encode_program`).
+            workers (int): Number of worker processes to serialize the
+                channels concurrently (see :meth:`encode_program`).
         """
+        key = None
+        if self.program_cache is not None:
+            key = program_hash(program, channels)
+            if key in self.program_cache:
+                self.program_cached(key, force_full)
+                return
         if channels is None:
             channels = range(self.num_channels)
-        chs = [self.channels[i] for i in channels]
-        for channel in chs:
-            channel.clear()
-        for frame in program:
-            segments = [c.new_segment() for c in chs]
-            self.program_segments(segments, frame)
-            # append an empty line to stall the memory reader before jumping
-            # through the frame table (`wait` does not prevent reading
-            # the next line)
-            for segment in segments:
-                segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
-                             jump=True)
+        profile = self.profile
+        if profile is not None:
+            profile.count("program.lines", sum(len(f) for f in program))
+        with span(profile, "program.encode"):
+            chs = self.encode_program(program, channels, executor, workers)
+        images = []
         for channel, ch in zip(channels, chs):
             board, mem = divmod(channel, self.num_dacs)
-            self.write_mem(mem=mem, adr=0, data=ch.serialize(), board=board)
+            with span(profile, "program.serialize"):
+                data = ch.serialize()
+            if profile is not None:
+                profile.count("program.bytes", len(data))
+            with span(profile, "program.write"):
+                self.update_mem(mem, 0, data, board, force_full)
+            images.append((channel, data))
+        if key is not None:
+            f = io.BytesIO()
+            self._save_image(f, images)
+            self.program_cache.put(key, f.getvalue())
+
+    def compact(self, channels=None):
+        """Compact the memory of channels.
+
+        Moves the segments on the channels such that their free memory
+        becomes contiguous (see :meth:`Channel.compact`). Each moved
+        segment is written to its new address and the frame address table
+        entries referring to it are patched right after that. A frame
+        therefore always points to a complete copy of its data, except
+        while a segment is written to a new address that overlaps its
+        old one. Frames that are moved must not be playing during
+        compaction. Frames that are not moved are not affected.
+
+        Args:
+            channels (list[int]): Channel indices to compact. If unspecified,
+                all channels are compacted.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        for channel in channels:
+            board, mem = divmod(channel, self.num_dacs)
+            moves, table = self.channels[channel].compact()
+            frames = {}
+            for frame, new in table:
+                frames.setdefault(new, []).append(frame)
+            for segment, old, new in moves:
+                self.update_mem(mem, 2*new, segment.data, board)
+                for frame in frames.get(new, ()):
+                    self.update_mem(mem, 2*frame, struct.pack("<H", new),
+                                    board)
+
+    def program_frame(self, frame, data, channels=None):
+        """Serialize a single frame of a wavesynth program and write it to
+        the channels in the stack.
+
+        The channels must have been programmed with :meth:`program` before.
+        The frame replaces the segment of the frame with the same index.
+        It is written to the same memory if it fits there, else it is
+        allocated from the free channel memory (see :meth:`Channel.replace`).
+        Memory is allocated on all channels before anything is written. If
+        the frame does not fit on one of them, all allocations are undone
+        and nothing is written. The frame address table entry is patched
+        last with a single memory write.
+
+        The other frames are not modified and can continue to be played.
+        The frame being replaced must not be playing while it is written.
+
+        Args:
+            frame (int): Index of the frame to replace.
+            data (list or ColumnarFrame): List of wavesynth lines of the
+                frame.
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+
+        Raises:
+            ChannelMemoryError: If the frame does not fit into the free
+                memory of a channel. :meth:`compact` may make room.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        chs = [self.channels[i] for i in channels]
+        segments = [Segment() for ch in chs]
+        self.program_frame_segments(segments, data)
+        states = [ch.snapshot() for ch in chs]
+        try:
+            for ch, segment in zip(chs, segments):
+                ch.replace(frame, segment)
+        except:
+            for ch, state in zip(chs, states):
+                ch.restore(state)
+            raise
+        for channel, segment in zip(channels, segments):
+            board, mem = divmod(channel, self.num_dacs)
+            self.update_mem(mem, 2*segment.addr, segment.data, board)
+            self.update_mem(mem, 2*frame, struct.pack("<H", segment.addr),
+                            board)
+
+    def save_image(self, filename, program=None, channels=None):
+        """Save the channel memory images to a file.
+
+        The images can be uploaded again with :meth:`load_image` without
+        serializing the program. See :mod:`pdq.host.image` for the format.
+
+        Args:
+            filename (str): Image file (``.pdqimg``).
+            program (list or ColumnarProgram): Wavesynth program to
+                serialize (without writing it, see :meth:`encode_program`).
+                If unspecified, the program last serialized for the
+                channels is saved.
+            channels (list[int]): Channel indices to save. If unspecified,
+                all channels are saved.
+        """
+        with open(filename, "wb") as f:
+            f.write(self.encode_image(program, channels))
+
+    def encode_image(self, program=None, channels=None):
+        """Serialize the channel memory images.
+
+        Like :meth:`save_image` but returns the content of the file, e.g.
+        to be sent to a controller (see :meth:`program_image`).
+
+        Args:
+            program (list or ColumnarProgram): See :meth:`save_image`.
+            channels (list[int]): See :meth:`save_image`.
+
+        Returns:
+            bytes: Image file content.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        if program is not None:
+            self.encode_program(program, channels)
+        images = [(channel, self.channels[channel].serialize())
+                  for channel in channels]
+        f = io.BytesIO()
+        self._save_image(f, images)
+        return f.getvalue()
+
+    def _save_image(self, f, images):
+        from . import image
+        image.save(f, self.num_boards, self.num_dacs, self.num_frames,
+                   self._mem_sizes[self.num_dacs], images)
+
+    def load_image(self, filename, force_full=False):
+        """Upload the channel memory images from a file.
+
+        The file is memory mapped and the images are written without
+        copying them (see :meth:`update_mem`). The geometry of the stack
+        must match that of the file.
+
+        The :class:`Channel` of the channels in the file are cleared. Use
+        :meth:`program` before modifying individual frames with
+        :meth:`program_frame`.
+
+        Args:
+            filename (str): Image file (``.pdqimg``) written by
+                :meth:`save_image`.
+            force_full (bool): Write the complete memory images (see
+                :meth:`program`).
+
+        Returns:
+            int: Checksum of a full upload of the images (see
+            :attr:`pdq.host.image.PDQImage.checksum`).
+
+        Raises:
+            pdq.host.image.ImageError: If the file is invalid or does not
+                match the stack.
+        """
+        from .image import PDQImage
+
+        with PDQImage.open(filename) as img:
+            return self._load_image(img, force_full)
+
+    def _load_image(self, img, force_full):
+        from .image import ImageError
+
+        if (img.geometry() != dict(num_boards=self.num_boards,
+                                   num_dacs=self.num_dacs,
+                                   num_frames=self.num_frames) or
+                img.mem_sizes != self._mem_sizes[self.num_dacs]):
+            raise ImageError("image geometry does not match the stack")
+        for channel, data in img.images:
+            if channel >= self.num_channels:
+                raise ImageError("invalid channel {}".format(channel))
+        for channel, data in img.images:
+            board, mem = divmod(channel, self.num_dacs)
+            self.channels[channel].clear()
+            with span(self.profile, "load_image.write"):
+                self.update_mem(mem, 0, data, board, force_full)
+        return img.checksum
+
+    def program_image(self, data, force_full=False):
+        """Write memory images received in bulk.
+
+        Binary alternative to :meth:`program` for remote procedure calls:
+        the client serializes the program (:meth:`encode_image`) and the
+        images are only written here (see :meth:`load_image`).
+
+        Args:
+            data (bytes or str): Image file content, or that content
+                base64 encoded.
+            force_full (bool): See :meth:`program`.
+
+        Returns:
+            int: Checksum of a full upload of the images.
+        """
+        from .image import PDQImage
+        return self._load_image(PDQImage(_decode_payload(data)), force_full)
+
+    def program_columnar(self, data, channels=None, force_full=False):
+        """Serialize and write a columnar program received in bulk.
+
+        Binary alternative to :meth:`program` for remote procedure calls
+        that avoids sending nested dictionaries.
+
+        Args:
+            data (bytes or str): Program serialized with
+                :meth:`pdq.host.columnar.ColumnarProgram.to_bytes`, or
+                that base64 encoded.
+            channels (list[int]): See :meth:`program`.
+            force_full (bool): See :meth:`program`.
+        """
+        self.program(ColumnarProgram.from_bytes(_decode_payload(data)),
+                     channels, force_full)
+
+    def has_program(self, key):
+        """Check whether a program is in :attr:`program_cache`.
+
+        Args:
+            key (str): Key of the program and channels as returned by
+                :func:`pdq.host.cache.program_hash`.
+
+        Returns:
+            bool: The program can be written with :meth:`program_cached`.
+        """
+        return self.program_cache is not None and key in self.program_cache
+
+    def program_cached(self, key, force_full=False):
+        """Write a program from :attr:`program_cache`.
+
+        The memory images of a program previously written with
+        :meth:`program` are written without serializing the program (see
+        :meth:`load_image`).
+
+        Args:
+            key (str): Key of the program and channels as returned by
+                :func:`pdq.host.cache.program_hash`.
+            force_full (bool): See :meth:`program`.
+
+        Raises:
+            KeyError: If the program is not cached.
+        """
+        from .image import PDQImage
+
+        value = None
+        if self.program_cache is not None:
+            value = self.program_cache.get(key)
+        if value is None:
+            raise KeyError(key)
+        self._load_image(PDQImage(value), force_full)
 
     def ping(self):
         """Ping method returning True. Required for ARTIQ remote
@@ -1,14 +1,21 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 import logging
+import queue
+import re
 import struct
+import threading
 
-import serial
-
-from .protocol import PDQBase, crc8, PDQ_CMD
+from .protocol import PDQBase, Segment, crc8, PDQ_CMD
+from .profile import span
 
 
 logger = logging.getLogger(__name__)
 
 
+_escape = re.compile(b"\xa5")
+
+
 class PDQ(PDQBase):
     """Initialize PDQ USB/Parallel device stack.
 
@@ -22,42 +29,409 @@ class PDQ(PDQBase):
             ``/dev/ttyUSB0`` for a Linux serial port.
         dev (file-like): File handle to use as device. If passed, ``url``
             is ignored.
+        chunk_size (int): Number of data bytes escaped and written at a
+            time.
+        max_pending (int): Maximum number of transactions waiting to be
+            sent by the writer thread (see :meth:`submit`).
         **kwargs: See :class:`PDQBase` .
+
+    Attributes:
+        device_writes (int): Number of writes to the device.
+        writes_saved (int): Number of device writes avoided by coalescing
+            messages in :meth:`batch`.
     """
-    def __init__(self, url=None, dev=None, **kwargs):
+    _mem_overhead = 7  # SOF, command, address, EOF
+
+    def __init__(self, url=None, dev=None, chunk_size=1 << 16,
+                 max_pending=4, **kwargs):
         if dev is None:
+            import serial
             dev = serial.serial_for_url(url)
         self.dev = dev
+        self.chunk_size = chunk_size
+        self.device_writes = 0
+        self.writes_saved = 0
+        self._batch = None
+        self._batched = 0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._pending = queue.Queue(max_pending)
+        self._writer = None
+        self._encoder = None
+        self._generation = 0
         PDQBase.__init__(self, **kwargs)
 
-    def write(self, data):
+    def write(self, *data):
         """Write data to the PDQ board over USB/parallel.
 
         SOF/EOF control sequences are appended/prepended to
         the (escaped) data. The running checksum is updated.
 
+        The data is escaped and written in chunks of at most
+        :attr:`chunk_size` bytes and the checksum is updated chunk by chunk.
+        Chunks without escape characters are handed to the device without
+        copying them. Small chunks are coalesced with the control
+        sequences into a single device write.
+
+        Args:
+            *data (bytes-like): Data to write. Multiple buffers are written
+                as a single message, as if they were concatenated.
+        """
+        capture = getattr(self._local, "capture", None)
+        if capture is not None:
+            capture.append(tuple(
+                part if isinstance(part, bytes) else bytes(part)
+                for part in data))
+            return
+        with self._lock:
+            self._write_message(data)
+
+    def _write_message(self, data):
+        profile = self.profile
+        buf = bytearray(b"\xa5\x02")
+        for part in data:
+            logger.debug("> %r", part)
+            if isinstance(part, (bytes, bytearray)):
+                search = part.find  # memchr()
+            else:
+                search = None
+            part = memoryview(part).cast("B")
+            if profile is not None:
+                profile.count("write.bytes", len(part))
+            for i in range(0, len(part), self.chunk_size):
+                chunk = part[i:i + self.chunk_size]
+                with span(profile, "write.crc"):
+                    self.checksum = crc8(chunk, self.checksum)
+                with span(profile, "write.escape"):
+                    if search is None:
+                        escape = _escape.search(chunk) is not None
+                    else:
+                        escape = search(b"\xa5", i, i + len(chunk)) >= 0
+                    if escape:
+                        chunk = chunk.tobytes().replace(
+                            b"\xa5", b"\xa5\xa5")
+                if len(chunk) >= self.chunk_size:
+                    if buf:
+                        self._write(buf)
+                        buf = bytearray()
+                    self._write(chunk)
+                else:
+                    if len(buf) + len(chunk) > self.chunk_size:
+                        self._write(buf)
+                        buf = bytearray()
+                    buf += chunk
+        buf += b"\xa5\x03"
+        self._write(buf)
+
+    def _write(self, msg):
+        if self._batch is None:
+            self._send(msg)
+            return
+        if len(msg) >= self.chunk_size:
+            self._flush_batch()
+            self._send(msg)
+            return
+        self._batch += msg
+        self._batched += 1
+        if len(self._batch) >= self.chunk_size:
+            self._flush_batch()
+
+    def _send(self, msg):
+        """Write all of ``msg`` to the device.
+
+        Partial writes are continued. If the device does not accept any
+        data, it is flushed before retrying. A device that does not
+        return the number of bytes written is assumed to have written
+        everything.
+        """
+        profile = self.profile
+        if profile is not None:
+            profile.count("write.device_bytes", len(msg))
+        msg = memoryview(msg)
+        with span(profile, "write.device"):
+            while msg:
+                written = self.dev.write(msg)
+                self.device_writes += 1
+                if not isinstance(written, int):
+                    break
+                if not written:
+                    self.dev.flush()
+                msg = msg[written:]
+
+    def _flush_batch(self):
+        if not self._batch:
+            return
+        writes = self.device_writes
+        self._send(self._batch)
+        self.writes_saved += self._batched - (self.device_writes - writes)
+        self._batch = bytearray()
+        self._batched = 0
+
+    @contextmanager
+    def batch(self):
+        """Coalesce the messages written within the context.
+
+        The messages (register and memory writes) are buffered in order
+        and written to the device as one contiguous write when the
+        context is left or :meth:`flush` is called. The buffer is also
+        written when it reaches :attr:`chunk_size` bytes and large chunks
+        of memory data are written directly after it. The checksum is
+        updated as each message is issued. Messages issued before an
+        exception are written as well. Batches can be nested and are then
+        written when the outermost batch is left.
+
+        >>> with dev.batch():
+        ...     dev.set_frame(2)
+        ...     dev.set_config(enable=1)
+        """
+        with self._lock:
+            if self._batch is not None:
+                yield
+                return
+            self._batch = bytearray()
+            try:
+                yield
+            finally:
+                try:
+                    self._flush_batch()
+                finally:
+                    self._batch = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a transaction for the writer thread.
+
+        Calls ``fn(*args, **kwargs)`` on the calling thread. The messages
+        that it writes (e.g. through :meth:`program`, :meth:`set_config`
+        or :meth:`write_mem`) are recorded and queued as one transaction.
+        A writer thread sends the transactions in order, each as a
+        :meth:`batch`. If :attr:`max_pending` transactions are waiting,
+        this blocks until one has been sent.
+
+        The checksum is updated when a transaction is sent. If a
+        transaction that writes to memory is cancelled or fails, the shadow
+        copies of the memories are discarded (the next :meth:`program` then
+        writes them completely). Transactions that write to memory and were
+        queued before that are cancelled as well since they may only
+        contain the differences to the data that was not written.
+
+        Transactions are not ordered with respect to direct writes from
+        other threads. Call :meth:`drain` first.
+
+        Args:
+            fn (callable): Function issuing the messages of the
+                transaction.
+            *args, **kwargs: Passed to ``fn``.
+
+        Returns:
+            concurrent.futures.Future: Completes with ``None`` when the
+            transaction has been written. Can be cancelled until the writer
+            thread starts sending it.
+        """
+        messages = []
+        with self._shadow_lock:
+            generation = self._generation
+        self._local.capture = messages
+        try:
+            fn(*args, **kwargs)
+        except:
+            self._invalidate(messages)
+            raise
+        finally:
+            del self._local.capture
+        future = Future()
+        with self._shadow_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._run_writer, name="pdq-writer", daemon=True)
+                self._writer.start()
+        self._pending.put((future, messages, generation))
+        return future
+
+    def _run_writer(self):
+        for future, messages, generation in iter(self._pending.get, None):
+            try:
+                with self._shadow_lock:
+                    stale = generation < self._generation
+                if stale and _writes_mem(messages):
+                    future.cancel()
+                if not future.set_running_or_notify_cancel():
+                    self._invalidate(messages)
+                    continue
+                try:
+                    # only the device writes hold the send lock
+                    with self.batch():
+                        for data in messages:
+                            self._write_message(data)
+                except Exception as e:
+                    self._invalidate(messages)
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+            finally:
+                self._pending.task_done()
+        self._pending.task_done()
+
+    def _invalidate(self, messages):
+        """Discard the shadow copies if memory was not written."""
+        if _writes_mem(messages):
+            with self._shadow_lock:
+                self._generation += 1
+                self._shadow.clear()
+
+    def drain(self):
+        """Wait until all queued transactions have been sent."""
+        self._pending.join()
+
+    def cancel_pending(self):
+        """Cancel all transactions that have not started to be sent.
+
+        Returns:
+            int: Number of transactions cancelled.
+        """
+        n = 0
+        for future, messages, generation in list(self._pending.queue):
+            n += future.cancel()
+        return n
+
+    async def program_async(self, program, channels=None, **kwargs):
+        """Program the device without blocking the event loop.
+
+        Like :meth:`program` but the program is encoded on an encoder
+        thread and queued as a transaction for the writer thread (see
+        :meth:`submit`). Encoding of a program overlaps with the sending
+        of the previous ones.
+
+        Cancelling the coroutine cancels the transaction if it has not
+        started to be sent.
+
         Args:
-            data (bytes): Data to write.
+            program (list): See :meth:`program`.
+            channels (list[int]): See :meth:`program`.
+            **kwargs: Passed to :meth:`program`.
         """
-        logger.debug("> %r", data)
-        msg = b"\xa5\x02" + data.replace(b"\xa5", b"\xa5\xa5") + b"\xa5\x03"
-        written = self.dev.write(msg)
-        if isinstance(written, int):
-            assert written == len(msg), (written, len(msg))
-        self.checksum = crc8(data, self.checksum)
+        import asyncio  # already imported by the running event loop
+        with self._shadow_lock:
+            if self._encoder is None:
+                self._encoder = ThreadPoolExecutor(1)
+        encoded = self._encoder.submit(self.submit, self.program, program,
+                                       channels, **kwargs)
+        try:
+            sent = await asyncio.wrap_future(encoded)
+        except asyncio.CancelledError:
+            encoded.add_done_callback(_cancel_sent)
+            raise
+        await asyncio.wrap_future(sent)
 
     def set_reg(self, adr, data, board):
         self.write(bytes([PDQ_CMD(board, 0, adr, 1), data]))
 
     def write_mem(self, mem, adr, data, board=0xf):
-        self.write(bytes([PDQ_CMD(board, 1, mem, 1), adr & 0xff, adr >> 8]) +
-                data)
+        self.write(bytes([PDQ_CMD(board, 1, mem, 1), adr & 0xff, adr >> 8]),
+                   data)
+
+    def program_stream(self, frames, channels=None, queue_size=4):
+        """Serialize and write a wavesynth program frame by frame.
+
+        An encoder thread serializes the frames (see
+        :meth:`program_frame_segments`) while the calling thread writes
+        them to the channel memories. At most ``queue_size`` encoded frames
+        are buffered in between. The frames are consumed from ``frames``
+        as they are needed and can be produced by a generator.
+
+        The frame address tables are first overwritten with zeros and
+        the segments are written contiguously after them. The tables are
+        written last. If encoding or writing fails, the zeroed tables
+        remain. The channels must not be playing while they are written.
+
+        Only data that differs from what was last written is sent (see
+        :meth:`update_mem`).
+
+        Args:
+            frames (iterable): Frames of the wavesynth program. At most
+                :attr:`num_frames` frames.
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+            queue_size (int): Maximum number of encoded frames waiting to be
+                written.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        chs = [self.channels[i] for i in channels]
+        for channel, ch in zip(channels, chs):
+            ch.clear()
+            board, mem = divmod(channel, self.num_dacs)
+            self.update_mem(mem, 0, bytes(2*ch.num_frames), board)
+
+        encoded = queue.Queue(queue_size)
+        stop = threading.Event()
+        error = []
+
+        def encode():
+            try:
+                for i, frame in enumerate(frames):
+                    if stop.is_set():
+                        break
+                    if i >= self.num_frames:
+                        raise ValueError("too many frames")
+                    segments = [Segment() for ch in chs]
+                    self.program_frame_segments(segments, frame)
+                    encoded.put(segments)
+            except Exception as e:
+                error.append(e)
+            finally:
+                encoded.put(None)
+
+        encoder = threading.Thread(target=encode, name="pdq-encoder")
+        encoder.start()
+        try:
+            for segments in iter(encoded.get, None):
+                for channel, ch, segment in zip(channels, chs, segments):
+                    if ch.append(segment):
+                        board, mem = divmod(channel, self.num_dacs)
+                        self.update_mem(mem, 2*segment.addr, segment.data,
+                                        board)
+        except:
+            stop.set()
+            while encoded.get() is not None:
+                pass
+            raise
+        finally:
+            encoder.join()
+        if error:
+            raise error[0]
+        for channel, ch in zip(channels, chs):
+            board, mem = divmod(channel, self.num_dacs)
+            self.update_mem(mem, 0, ch.table(), board)
 
     def close(self):
-        """Close the USB device handle."""
+        """Close the USB device handle.
+
+        Queued transactions are sent first.
+        """
+        if self._encoder is not None:
+            self._encoder.shutdown()
+        if self._writer is not None:
+            self._pending.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._lock:
+            if self._batch is not None:
+                self._flush_batch()
         self.dev.close()
         del self.dev
 
     def flush(self):
-        """Flush pending data."""
-        self.dev.flush()
+        """Flush pending data, including that of a :meth:`batch`."""
+        with self._lock:
+            if self._batch is not None:
+                self._flush_batch()
+            self.dev.flush()
+
+
+def _writes_mem(messages):
+    return any(data and data[0] and data[0][0] & 0x04 for data in messages)
+
+
+def _cancel_sent(encoded):
+    if not encoded.cancelled() and encoded.exception() is None:
+        encoded.result().cancel()
@@ -0,0 +1,128 @@
+import copy
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..host.cache import LRUCache, ProgramCache, canonical_hash, program_hash
+from ..host.image import ImageError
+from .test_program import MemPDQ, make_program
+
+
+class TestLRU(unittest.TestCase):
+    def test_budget(self):
+        c = LRUCache(10)
+        c.put("a", 1, 4)
+        c.put("b", 2, 4)
+        self.assertEqual(c.get("a"), 1)
+        c.put("c", 3, 4)
+        self.assertNotIn("b", c)
+        self.assertEqual(c.used, 8)
+        c.put("d", 4, 11)
+        self.assertNotIn("d", c)
+        self.assertIsNone(c.get("b"))
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+    def test_hash(self):
+        a = {"x": [1, 2.5], "y": {"z": np.arange(3)}}
+        self.assertEqual(canonical_hash(a), canonical_hash(copy.deepcopy(a)))
+        self.assertNotEqual(canonical_hash(a), canonical_hash([a]))
+        a["x"][1] = 2.25
+        self.assertNotEqual(canonical_hash(a), canonical_hash({
+            "x": [1, 2.5], "y": {"z": np.arange(3)}}))
+
+
+class TestFrameCache(unittest.TestCase):
+    def test_identical(self):
+        program = make_program()
+        ref = MemPDQ(num_boards=1, cache_size=0)
+        ref.program(program)
+        p = MemPDQ(num_boards=1)
+        p.program(program)
+        self.assertEqual(p.frame_cache.misses, 4)
+        program[2] = make_program(offset=.05)[2]
+        p.program(program)
+        self.assertEqual(p.frame_cache.hits, 3)
+        self.assertEqual(p.frame_cache.misses, 5)
+        ref.program(program)
+        self.assertEqual(p.mems, ref.mems)
+
+    def test_not_mutated(self):
+        program = make_program()
+        program[0][0]["channel_data"][1]["silence"] = True
+        orig = copy.deepcopy(program)
+        p = MemPDQ(num_boards=1)
+        p.program(program)
+        p.program(program)
+        self.assertEqual(program, orig)
+        self.assertEqual(p.frame_cache.hits, 4)
+
+    def test_budget(self):
+        p = MemPDQ(num_boards=1, cache_size=1000)
+        p.program(make_program())
+        self.assertLessEqual(p.frame_cache.used, 1000)
+        self.assertEqual(len(p.frame_cache), 1)
+
+
+class TestProgramCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_hash(self):
+        program = make_program()
+        self.assertEqual(program_hash(program), program_hash(make_program()))
+        self.assertEqual(program_hash(program, range(2)),
+                         program_hash(program, [0, 1]))
+        self.assertNotEqual(program_hash(program),
+                            program_hash(program, [0, 1]))
+
+    def test_disk(self):
+        c = ProgramCache(10, self.dir.name, 25)
+        c.put("aa", b"x"*10)
+        c.put("bb", b"y"*10)
+        self.assertIn("aa", c)
+        self.assertNotIn("aa", c.memory)
+        self.assertEqual(c.get("aa"), b"x"*10)
+        c.put("cc", b"z"*10)
+        self.assertNotIn("bb", c)  # least recently used on disk
+        self.assertIn("aa", c)
+        c = ProgramCache(10, self.dir.name, 25)
+        self.assertEqual(c.get("cc"), b"z"*10)
+        self.assertIsNone(c.get("bb"))
+        with self.assertRaises(ValueError):
+            c.get("../x")
+
+    def test_program(self):
+        program = make_program()
+        key = program_hash(program)
+        dev = MemPDQ(num_boards=1)
+        dev.program_cache = ProgramCache(1 << 20, self.dir.name)
+        self.assertFalse(dev.has_program(key))
+        with self.assertRaises(KeyError):
+            dev.program_cached(key)
+        dev.program(program)
+        self.assertTrue(dev.has_program(key))
+
+        new = MemPDQ(num_boards=1)
+        new.program_cache = ProgramCache(1 << 20, self.dir.name)
+        self.assertTrue(new.has_program(key))
+        new.program_cached(key)
+        self.assertEqual(new.mems, dev.mems)
+        new = MemPDQ(num_boards=1)
+        new.program_cache = dev.program_cache
+        new.encode_program = None  # must not serialize
+        new.program(program)
+        self.assertEqual(new.mems, dev.mems)
+
+    def test_geometry(self):
+        program = make_program()
+        dev = MemPDQ(num_boards=1)
+        dev.program_cache = ProgramCache(1 << 20, self.dir.name)
+        dev.program(program)
+        new = MemPDQ(num_boards=2)
+        new.program_cache = ProgramCache(1 << 20, self.dir.name)
+        with self.assertRaises(ImageError):
+            new.program_cached(program_hash(program))
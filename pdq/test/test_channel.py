@@ -0,0 +1,139 @@
+import unittest
+
+from ..host.protocol import Channel, ChannelMemoryError, Segment
+
+
+class TestChannel(unittest.TestCase):
+    def setUp(self):
+        self.channel = Channel(max_data=1 << 10, num_frames=8)
+
+    def fill(self, lengths):
+        for i, n in enumerate(lengths):
+            segment = self.channel.new_segment()
+            for j in range(n):
+                segment.bias([i*.1, j*1e-3], duration=10 + j)
+            segment.line(typ=3, data=b"", duration=1, jump=True)
+
+    def test_serialize(self):
+        self.fill([3, 0, 5])
+        data = self.channel.serialize()
+        self.assertIsInstance(data, bytearray)
+        self.assertEqual(data, self.channel.table() + b"".join(
+            segment.data for segment in self.channel.segments))
+        self.assertEqual(self.channel.segments[0].addr,
+                         self.channel.num_frames)
+
+
+class TestAlloc(unittest.TestCase):
+    def setUp(self):
+        self.channel = Channel(max_data=100, num_frames=4)
+
+    def test_alloc_release(self):
+        c = Channel(max_data=80, num_frames=4)
+        a = [c.alloc(n) for n in (10, 20, 30)]
+        self.assertEqual(a, [4, 14, 34])
+        self.assertEqual(c.free_bytes(), 2*16)
+        c.release(14)
+        self.assertEqual(c.largest_free_bytes(), 2*20)
+        self.assertEqual(c.alloc(5), 14)
+        c.release(4)
+        c.release(14)
+        self.assertEqual(c.largest_free_bytes(), 2*30)
+        c.release(34)
+        self.assertEqual(c.largest_free_bytes(), 2*76)
+        with self.assertRaises(ChannelMemoryError):
+            c.alloc(77)
+
+    def test_best_fit(self):
+        c = self.channel
+        a = [c.alloc(n) for n in (10, 1, 5, 1, 30)]
+        c.release(a[0])
+        c.release(a[2])
+        self.assertEqual(c.alloc(4), a[0])
+        c.best_fit = True
+        self.assertEqual(c.alloc(4), a[2])
+
+    def test_replace_compact(self):
+        c = self.channel
+        segments = [c.new_segment() for i in range(3)]
+        for i, segment in enumerate(segments):
+            segment.line(typ=0, data=bytes(2*i), duration=1)
+        c.place()
+        self.assertEqual([s.addr for s in segments], [4, 6, 9])
+        new = Segment()
+        new.line(typ=0, data=bytes(10), duration=1)
+        c.replace(0, new)
+        self.assertEqual(new.addr, 13)
+        small = Segment()
+        small.line(typ=0, data=b"", duration=1)
+        c.replace(2, small)
+        self.assertEqual(small.addr, 9)
+        moves, table = c.compaction_plan()
+        self.assertEqual(moves, [(segments[1], 6, 4), (small, 9, 7),
+                                 (new, 13, 9)])
+        self.assertEqual(table, [(0, 9), (1, 4), (2, 7)])
+        self.assertEqual(c.compact(), (moves, table))
+        self.assertEqual(c.largest_free_bytes(), 2*(100 - 16))
+        self.assertEqual(c.compaction_plan(), ([], []))
+
+    def test_replace_release_first(self):
+        c = Channel(max_data=16, num_frames=4)
+        segments = [c.new_segment() for i in range(3)]
+        for i, segment in enumerate(segments):
+            segment.line(typ=0, data=bytes(2*i), duration=1)
+        c.place()
+        large = Segment()
+        large.line(typ=0, data=bytes(12), duration=1)
+        with self.assertRaises(ChannelMemoryError):
+            c.replace(2, large)
+        self.assertEqual(c.segments, segments)
+        self.assertEqual(c.free_bytes(), 2*3)
+        new = Segment()
+        new.line(typ=0, data=bytes(8), duration=1)
+        c.replace(2, new)
+        self.assertEqual(new.addr, 9)
+        self.assertEqual(c.free_bytes(), 2*1)
+
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.channel = Channel(max_data=100, num_frames=4)
+
+    def segment(self, value, jump=True):
+        segment = Segment()
+        segment.bias([value], duration=10)
+        segment.line(typ=3, data=b"", duration=1, jump=jump)
+        return segment
+
+    def test_place(self):
+        c = self.channel
+        c.segments.extend([self.segment(.1), self.segment(.2),
+                           self.segment(.1), self.segment(.2)])
+        data = c.serialize()
+        self.assertEqual([s.addr for s in c.segments], [4, 9, 4, 9])
+        self.assertEqual(len(data), 2*14)
+        self.assertEqual(c.dedup_ratio, 2.)
+        self.assertEqual(c.table(), b"\x04\x00\x09\x00\x04\x00\x09\x00")
+
+    def test_fall_through(self):
+        c = self.channel
+        c.segments.extend([self.segment(.1), self.segment(.2, jump=False),
+                           self.segment(.1)])
+        c.place()
+        self.assertEqual([s.addr for s in c.segments], [4, 9, 14])
+
+    def test_replace(self):
+        c = self.channel
+        c.segments.extend([self.segment(.1), self.segment(.1),
+                           self.segment(.2)])
+        c.place()
+        c.replace(1, self.segment(.3))
+        self.assertEqual([s.addr for s in c.segments], [4, 14, 9])
+        c.replace(2, self.segment(.1))
+        self.assertEqual([s.addr for s in c.segments], [4, 14, 4])
+        self.assertEqual(c.free_bytes(), 2*(100 - 4 - 10))
+        c.replace(0, self.segment(.4))
+        self.assertEqual([s.addr for s in c.segments], [9, 14, 4])
+        c.replace(2, self.segment(.5))
+        self.assertEqual([s.addr for s in c.segments], [9, 14, 4])
+        self.assertEqual(c.free_bytes(), 2*(100 - 4 - 15))
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from ..host.crc import CRC
+from ..host.protocol import crc8
+
+
+def crc_bytewise(crc, msg, init=0):
+    for data in msg:
+        init = crc._table[data ^ init >> crc.crc_width - crc.data_width] ^ (
+            init << crc.data_width & (1 << crc.crc_width) - 1)
+    return init
+
+
+class TestCRC(unittest.TestCase):
+    def check(self, crc, sizes):
+        rs = np.random.RandomState(0)
+        for n in sizes:
+            msg = rs.randint(1 << crc.data_width, size=n).astype(
+                np.uint8).tobytes()
+            for init in 0, 1, (1 << crc.crc_width) - 1:
+                ref = crc_bytewise(crc, msg, init)
+                self.assertEqual(crc(msg, init), ref)
+                self.assertEqual(crc(memoryview(msg), init), ref)
+                self.assertEqual(crc.shift(init, n),
+                                 crc_bytewise(crc, bytes(n), init))
+                k = n//3
+                self.assertEqual(crc.combine(crc(msg[:k], init),
+                                             crc(msg[k:]), n - k), ref)
+
+    def test_crc8(self):
+        self.assertEqual(crc8.period, 127)
+        self.check(crc8, [0, 1, 126, 127, 128, 255, 256, 1016, 1017,
+                          10000, 100003])
+
+    def test_slices(self):
+        for poly in 0x1814141ab, 0x11021, 0x106:
+            crc = CRC(poly)
+            self.assertIsNone(crc.period)
+            self.check(crc, [0, 1, 7, 8, 9, 1000])
+
+    def test_data_width(self):
+        for poly in 0x13, 0x11021:
+            self.check(CRC(poly, data_width=4), [0, 1, 15, 16, 1000])
@@ -0,0 +1,110 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+import numpy as np
+
+from ..host.columnar import ColumnarFrame, ColumnarProgram, BIAS, DDS
+from .test_program import MemPDQ, make_program
+
+
+def make_mixed(num_frames=3, num_lines=10, num_channels=3):
+    program = []
+    for i in range(num_frames):
+        frame = []
+        for j in range(num_lines):
+            channel_data = []
+            for k in range(num_channels):
+                if (j + k) % 3 == 0:
+                    channel_data.append({"dds": {
+                        "amplitude": [.5, 1e-4*j, 0, 1e-9],
+                        "phase": [.1*i, .01*k], "clear": j == 0}})
+                elif (j + k) % 3 == 1:
+                    channel_data.append({"bias": {
+                        "amplitude": [.1*i - .01*j], "aux": True},
+                        "silence": k == 1})
+                else:
+                    channel_data.append({"bias": {
+                        "amplitude": [1., -1e-3*k, 1e-6]}})
+            frame.append({"duration": 20 + j, "trigger": j == 0,
+                          "dac_divider": 1 << (j % 2),
+                          "channel_data": channel_data})
+        program.append(frame)
+    return program
+
+
+class TestColumnar(unittest.TestCase):
+    def check_equal(self, program, columnar, **kwargs):
+        a = MemPDQ(num_boards=1, cache_size=0)
+        a.program(program, **kwargs)
+        b = MemPDQ(num_boards=1, cache_size=0)
+        b.program(columnar, **kwargs)
+        self.assertEqual(a.mems, b.mems)
+
+    def test_roundtrip(self):
+        program = make_mixed()
+        columnar = ColumnarProgram.from_program(program)
+        self.assertEqual(len(columnar), 3)
+        self.assertEqual(len(columnar[0]), 10)
+        again = ColumnarProgram.from_program(columnar.to_program())
+        for a, b in zip(columnar, again):
+            for k, v in vars(a).items():
+                np.testing.assert_equal(v, getattr(b, k))
+
+    def test_not_modified(self):
+        program = make_mixed()
+        ColumnarProgram.from_program(program)
+        self.assertEqual(program, make_mixed())
+
+    def test_program(self):
+        program = make_mixed()
+        self.check_equal(program, ColumnarProgram.from_program(program))
+        program = make_program()
+        self.check_equal(program, ColumnarProgram.from_program(program))
+
+    def test_executor(self):
+        program = make_mixed()
+        with ThreadPoolExecutor(2) as executor:
+            self.check_equal(program, ColumnarProgram.from_program(program),
+                             executor=executor)
+
+    def test_cached(self):
+        program = ColumnarProgram.from_program(make_mixed())
+        dev = MemPDQ(num_boards=1)
+        dev.program(program)
+        dev.program(program, force_full=True)
+        self.assertEqual(dev.frame_cache.hits, len(program))
+
+    def test_arrays(self):
+        n = 50
+        t = np.arange(n)
+        frame = ColumnarFrame(
+            duration=10 + t,
+            amplitude=np.stack([np.c_[.01*t, 1e-4*np.ones(n)]]*3),
+            typ=[[BIAS], [DDS], [BIAS]], trigger=t == 0)
+        self.check_equal([frame.to_lines()], [frame])
+        self.assertEqual(frame.num_channels, 3)
+        self.assertLess(frame.nbytes, 100*n)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ColumnarFrame(1, np.zeros((1, 1, 5)))
+        with self.assertRaises(ValueError):
+            ColumnarFrame.from_lines([{"duration": 1, "channel_data": [
+                {"bias": {"amplitude": [1.], "jump": True}}]}])
+
+    def test_bytes(self):
+        program = make_mixed()
+        columnar = ColumnarProgram.from_program(program)
+        again = ColumnarProgram.from_bytes(columnar.to_bytes())
+        self.assertEqual(again.to_program(), columnar.to_program())
+
+    def test_program_columnar(self):
+        program = make_mixed()
+        data = ColumnarProgram.from_program(program).to_bytes()
+        a = MemPDQ(num_boards=1, cache_size=0)
+        a.program(program)
+        for payload in data, base64.b64encode(data).decode():
+            b = MemPDQ(num_boards=1, cache_size=0)
+            b.program_columnar(payload)
+            self.assertEqual(a.mems, b.mems)
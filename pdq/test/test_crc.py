@@ -32,5 +32,15 @@ def test():
     assert out[-1] == crc8(m)
 
 
+def test_long():
+    # the sliced and folded paths
+    tb = TB(0x07)
+    out = []
+    m = bytes((i*97 + 13) & 0xff for i in range(1100))
+    run_simulation(tb, tb.run_data(m, out))
+    assert out[-1] == crc8(m)
+    assert out[99] == crc8(m[:100])
+
+
 if __name__ == "__main__":
     test()
@@ -17,10 +17,14 @@
 
 from io import BytesIO
 import struct
+import unittest
 
+import numpy as np
 from migen import *
 
 from pdq.gateware.dac import Dac
+from pdq.host.emulate import emulate
+from pdq.host.protocol import Channel
 from pdq.host.usb import PDQ
 
 
@@ -94,6 +98,75 @@ _test_program = [
 ]
 
 
+def run_dac(mem, ncycles, trigger=True, frame=0):
+    """Outputs of the DAC gateware enabled at cycle 0 (see
+    :func:`pdq.host.emulate.emulate`)."""
+    dac = Dac(mem_depth=len(mem))
+    dac.parser.mem.init = [int(i) for i in mem]
+    outputs = []
+
+    def run():
+        yield dac.parser.frame.eq(frame)
+        yield dac.parser.start.eq(1)
+        yield dac.parser.arm.eq(1)
+        yield dac.out.arm.eq(1)
+        for i in range(ncycles):
+            yield dac.out.trigger.eq(trigger is True or i in trigger)
+            yield
+            outputs.append(((yield dac.out.data), (yield dac.out.aux),
+                            (yield dac.out.silence)))
+
+    run_simulation(dac, run())
+    data, aux, silence = np.array(outputs).T
+    return data.astype(np.uint16).view(np.int16), aux == 1, silence == 1
+
+
+def random_program(seed, num_lines=10):
+    rs = np.random.RandomState(seed)
+    ch = Channel(1 << 12, 2)
+    for frame in range(2):
+        segment = ch.new_segment()
+        for i in range(num_lines):
+            kwargs = dict(
+                duration=int(rs.choice([1, 2, 3, 5, 8, 20, 40])),
+                shift=int(rs.choice([0, 0, 1, 2])),
+                trigger=bool(rs.rand() < .2), wait=bool(rs.rand() < .1),
+                silence=bool(rs.rand() < .2), aux=bool(rs.rand() < .3))
+            amplitude = rs.uniform(-1, 1, 4)*[1, 1e-2, 1e-4, 1e-6]
+            if rs.rand() < .5:
+                segment.bias(list(amplitude[:rs.randint(5)]), **kwargs)
+            else:
+                phase = rs.uniform(-1, 1, 3)*[.4, 1e-2, 1e-4]
+                segment.dds(list(amplitude/3), list(phase[:rs.randint(4)]),
+                            clear=bool(rs.rand() < .3), **kwargs)
+        segment.terminate()
+    mem = ch.serialize()
+    return np.frombuffer(mem, "<u2")
+
+
+class TestEmulate(unittest.TestCase):
+    def compare(self, mem, ncycles, trigger=True, frame=0):
+        ref = run_dac(mem, ncycles, trigger, frame)
+        out = emulate(mem, ncycles, frame, trigger)
+        for o, r in zip(out, ref):
+            np.testing.assert_equal(o, r)
+
+    def test_program(self):
+        p = PDQ(dev=BytesIO())
+        p.program(_test_program)
+        for channel in p.channels:
+            mem = np.frombuffer(channel.serialize(), "<u2")
+            self.compare(mem, 300, trigger=[20, 150, 151])
+
+    def test_random(self):
+        for seed in range(4):
+            mem = random_program(seed)
+            rs = np.random.RandomState(seed)
+            trigger = sorted(set(rs.randint(0, 500, 30)))
+            self.compare(mem, 500, trigger, frame=seed % 2)
+            self.compare(mem, 500, frame=seed % 2)
+
+
 def test():
     import logging
     logging.basicConfig(level=logging.DEBUG)
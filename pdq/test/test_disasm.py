@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+from ..host.disasm import disassemble, walk
+from ..host.protocol import Channel, Segment
+
+
+# number of spline coefficients for a given line length
+_coefficients = {1: 0, 2: 1, 4: 2, 7: 3, 10: 4, 15: 4}
+
+
+def random_line(rs):
+    kwargs = dict(
+        duration=int(rs.randint(1, 1 << 16)),
+        shift=int(rs.randint(16)),
+        trigger=bool(rs.rand() < .5),
+        silence=bool(rs.rand() < .5),
+        aux=bool(rs.rand() < .5),
+        wait=bool(rs.rand() < .5))
+    amplitude = list(rs.uniform(-1, 1, 4)*[9., 1e-2, 1e-6, 1e-11])
+    if rs.rand() < .5:
+        return "bias", dict(amplitude=amplitude[:rs.randint(5)], **kwargs)
+    phase = list(rs.uniform(-.5, .5, 3)*[1., 1e-2, 1e-6])
+    if rs.rand() < .5:
+        amplitude = amplitude[:rs.randint(5)]
+        phase = []
+    return "dds", dict(amplitude=amplitude, phase=phase,
+                       clear=bool(rs.rand() < .5), **kwargs)
+
+
+def encode(line):
+    segment = Segment()
+    typ, kwargs = line
+    getattr(segment, typ)(**kwargs)
+    return bytes(segment.data)
+
+
+def reencode(line):
+    n = _coefficients[line["length"]]
+    kwargs = dict(duration=int(line["duration"]),
+                  amplitude=list(line["amplitude"][:n]))
+    for name in "trigger", "silence", "aux", "shift", "clear", "wait":
+        kwargs[name] = line[name].item()
+    kwargs["jump"] = line["end"].item()
+    if line["typ"] == 0:
+        del kwargs["clear"]
+        return encode(("bias", kwargs))
+    if line["length"] == 15:
+        kwargs["phase"] = list(line["phase"])
+    return encode(("dds", kwargs))
+
+
+class TestDisassemble(unittest.TestCase):
+    def test_roundtrip(self):
+        rs = np.random.RandomState(0)
+        for i in range(20):
+            ch = Channel(1 << 14, 8)
+            frames = []
+            for frame in range(rs.randint(1, 9)):
+                segment = ch.new_segment()
+                lines = [random_line(rs) for j in range(rs.randint(1, 20))]
+                for typ, kwargs in lines:
+                    getattr(segment, typ)(**kwargs)
+                segment.terminate()
+                frames.append(lines)
+            mem = ch.serialize()
+            table, decoded = disassemble(mem, 8)
+            self.assertEqual(table.tobytes(), ch.table())
+            self.assertEqual(len(decoded),
+                             sum(len(lines) + 1 for lines in frames))
+            for frame, lines in enumerate(frames):
+                i = np.searchsorted(decoded["addr"], table[frame])
+                for line, d in zip(lines, decoded[i:]):
+                    typ, kwargs = line
+                    self.assertEqual(d["typ"], ["bias", "dds"].index(typ))
+                    for name in "duration", "shift", "trigger", "wait":
+                        self.assertEqual(d[name], kwargs[name])
+                    self.assertFalse(d["end"])
+                    self.assertEqual(reencode(d), encode(line))
+                    n = len(kwargs["amplitude"])
+                    np.testing.assert_allclose(
+                        d["amplitude"][:n], kwargs["amplitude"],
+                        atol=2/Segment.out_scale)
+                    np.testing.assert_equal(d["amplitude"][n:], 0.)
+                    phase = kwargs.get("phase", [])
+                    np.testing.assert_allclose(d["phase"][:len(phase)],
+                                               phase, atol=2**-16)
+                    np.testing.assert_equal(d["phase"][len(phase):], 0.)
+                # terminator
+                d = decoded[i + len(lines)]
+                self.assertTrue(d["end"])
+                self.assertEqual(d["typ"], 3)
+
+    def test_walk(self):
+        segment = Segment()
+        for i in range(1000):
+            segment.bias([i*1e-3, 1e-4][:i % 3], duration=10)
+        segment.terminate()
+        mem = np.zeros(32 + 10 + len(segment.data)//2 + 10, np.uint16)
+        mem[42:42 + len(segment.data)//2] = np.frombuffer(
+            segment.data, "<u2")
+        ref = []
+        addr = 42
+        while not mem[addr] & (1 << 13):
+            ref.append(addr)
+            addr += (mem[addr] & 0xf) + 1
+        ref.append(addr)
+        for starts in [42], [42, 42, 0, len(mem)], [ref[100], 42]:
+            for stride in range(6):
+                np.testing.assert_equal(walk(mem, starts, stride), ref)
+        # from within the data
+        np.testing.assert_equal(walk(mem, [ref[7]]), ref[7:])
+        self.assertEqual(len(walk(mem, [41])), 1)
@@ -0,0 +1,248 @@
+import io
+import unittest
+
+import numpy as np
+
+from ..host.emulate import emulate, evolve, cordic, Cordic, Line, Comm
+from ..host.fit import bias_output, quantize
+from ..host.protocol import Channel, Segment, crc8
+from ..host.usb import PDQ
+from .test_program import MemPDQ, make_program
+
+
+def image(*lines):
+    """Single frame channel image of the given bias/DDS lines."""
+    ch = Channel(1 << 10, 1)
+    segment = ch.new_segment()
+    for typ, kwargs in lines:
+        getattr(segment, typ)(**kwargs)
+    segment.terminate()
+    return bytes(ch.serialize())
+
+
+def start(mem):
+    """First cycle of DAC output of the first line."""
+    # JUMP, FRAME, HEADER, line words, load, registered output
+    return 3 + Line(np.frombuffer(mem, "<u2"), 1).length + 2
+
+
+class TestEvolve(unittest.TestCase):
+    def test_evolve(self):
+        v = [3 << 32, -5 << 16, 1 << 20, -7]
+        ref = []
+        for k in range(2000):
+            ref.append(v[0] & ((1 << 48) - 1))
+            v = [v[0] + v[1], v[1] + v[2], v[2] + v[3], v[3]]
+        v = [3 << 32, -5 << 16, 1 << 20, -7]
+        mask = np.uint64((1 << 48) - 1)
+        np.testing.assert_equal(evolve(v, (0, 2000)) & mask, ref)
+        m = np.arange(2000) + (1 << 20)
+        np.testing.assert_equal(evolve(v, m)[:5] & mask,
+                                evolve(v, ((1 << 20), 5)) & mask)
+
+
+class TestCordic(unittest.TestCase):
+    def test_rotate(self):
+        z = np.arange(-(1 << 15), 1 << 15, 7, dtype=np.int16)
+        for x in 0, 1000, -19500, 19000:
+            ref = x*Segment.cordic_gain*np.cos(np.pi*z/(1 << 15))
+            out = cordic(np.full(len(z), x, np.int16), z)
+            self.assertLessEqual(np.abs(out - ref).max(), 4)
+
+    def test_table(self):
+        rng = np.random.RandomState(0)
+        x = np.repeat(np.array([1000, -19500, 5, 19000, 0], np.int16),
+                      [3000, 5, 2000, 1, 1 << 12])
+        x[-100:] = rng.randint(-1 << 14, 1 << 14, 100)
+        z = rng.randint(-1 << 15, 1 << 15, len(x)).astype(np.int16)
+        direct = Cordic()
+        direct.min_run = len(x) + 1
+        np.testing.assert_equal(cordic(x, z), direct(x, z))
+
+
+class TestEmulate(unittest.TestCase):
+    def test_bias(self):
+        amplitude = [-1.2, 3e-4, -2e-8, 1e-12]
+        mem = image(("bias", dict(amplitude=amplitude, duration=1000)))
+        out, aux, silence = emulate(mem, 1100, trigger=False)
+        i = start(mem)
+        np.testing.assert_equal(out[:i], 0)
+        np.testing.assert_equal(out[i:i + 1000],
+                                bias_output(amplitude, 1000))
+        # stalls after one more increment
+        np.testing.assert_equal(out[i + 1001:], out[i + 1000])
+        self.assertFalse(aux.any() or silence.any())
+
+    def test_shift(self):
+        amplitude = [.3, 1e-3, 1e-6]
+        mem = image(("bias", dict(amplitude=amplitude, duration=100,
+                                  shift=3)))
+        out, _, _ = emulate(mem, 1000, trigger=False)
+        i = start(mem)
+        np.testing.assert_equal(out[i:i + 800],
+                                np.repeat(bias_output(amplitude, 100), 8))
+
+    def test_flags(self):
+        mem = image(("bias", dict(amplitude=[1.], duration=20, aux=True)),
+                    ("bias", dict(amplitude=[2.], duration=20,
+                                  silence=True)))
+        out, aux, silence = emulate(mem, 100, trigger=False)
+        i = start(mem)
+        np.testing.assert_equal(aux[i:i + 20], True)
+        np.testing.assert_equal(aux[i + 20:], False)
+        np.testing.assert_equal(silence[i + 20:], True)
+        np.testing.assert_equal(silence[:i + 20], False)
+        self.assertEqual(out[i + 20], quantize([2.])[0])
+
+    def test_trigger(self):
+        mem = image(("bias", dict(amplitude=[1.], duration=10)),
+                    ("bias", dict(amplitude=[2.], duration=10,
+                                  trigger=True)))
+        one, two = quantize([1.])[0], quantize([2.])[0]
+        i = start(mem)
+        out, _, _ = emulate(mem, 200, trigger=False)
+        np.testing.assert_equal(out[i:], one)
+        out, _, _ = emulate(mem, 200, trigger=[0, 5, 100, 150])
+        np.testing.assert_equal(out[i:102], one)
+        np.testing.assert_equal(out[102:152], two)
+        # and again from the start of the frame
+        np.testing.assert_equal(out[160:170], one)
+        out, _, _ = emulate(mem, 200)
+        np.testing.assert_equal(out[i + 10:i + 20], two)
+
+    def test_stall(self):
+        # lines shorter than the parser
+        mem = image(*(("bias", dict(amplitude=[a], duration=1))
+                      for a in (1., 2., 3.)))
+        out, _, _ = emulate(mem, 30, trigger=False)
+        i = start(mem)
+        for a in 1., 2., 3.:
+            # header, duration, data and a cycle each
+            np.testing.assert_equal(out[i:i + 4], quantize([a])[0])
+            i += 4
+        np.testing.assert_equal(out[i:], quantize([3.])[0])
+
+    def test_dds(self):
+        amplitude, phase, frequency = .5, .1, 1e-3
+        mem = image(("dds", dict(amplitude=[amplitude, 0, 0, 0],
+                                 phase=[phase, frequency], duration=1000)))
+        out, _, _ = emulate(mem, 1100)
+        t = np.arange(1000)
+        ref = amplitude*Segment.out_scale*np.cos(
+            2*np.pi*(phase + frequency*t))
+        i = start(mem) + cordic.stages
+        self.assertLessEqual(np.abs(out[i:i + 1000] - ref).max(), 4)
+
+    def test_frames(self):
+        ch = Channel(1 << 10, 2)
+        for a in 1., 2.:
+            segment = ch.new_segment()
+            segment.bias(amplitude=[a], duration=10)
+            segment.bias(amplitude=[0.], duration=10, jump=True)
+        mem = bytes(ch.serialize())
+        for frame, a in enumerate((1., 2.)):
+            out, _, _ = emulate(mem, 200, frame=frame)
+            self.assertEqual(out.max(), quantize([a])[0])
+            # loops through the frame
+            self.assertGreater((np.diff(out) > 0).sum(), 2)
+
+
+class TestComm(unittest.TestCase):
+    def setUp(self):
+        self.comm = Comm(num_boards=3, mem_depths=[8, 6, 6])
+        self.dev = PDQ(dev=self.comm, num_boards=3)
+
+    def test_program(self):
+        comm = Comm()
+        dev = PDQ(dev=comm)
+        program = make_program(num_frames=8, num_channels=9)
+        # escape characters in the data
+        program[1][3]["channel_data"][4]["bias"]["amplitude"] = [
+            (0xa5a5 - (1 << 16))/Segment.out_scale]
+        dev.program(program)
+        ref = MemPDQ()
+        ref.program(program)
+        for (board, mem), data in ref.mems.items():
+            self.assertEqual(comm.mems[board][mem][:len(data)], data)
+        self.assertEqual(comm.checksum, [dev.checksum]*3)
+        self.assertIn(b"\xa5\xa5\xa5\xa5", self.dump(program))
+
+    def dump(self, program):
+        dev = PDQ(dev=io.BytesIO())
+        dev.program(program)
+        return dev.dev.getvalue()
+
+    def test_split(self):
+        program = make_program(num_frames=2)
+        program[0][0]["channel_data"][0]["bias"]["amplitude"] = [
+            (0xa5a5 - (1 << 16))/Segment.out_scale]
+        data = self.dump(program)
+        ref = Comm()
+        ref.write(data)
+        rs = np.random.RandomState(0)
+        for i in range(10):
+            comm = Comm()
+            splits = np.sort(rs.randint(len(data), size=50))
+            # right after each escape
+            splits[:5] = np.flatnonzero(np.frombuffer(
+                data, np.uint8) == 0xa5)[:5] + 1
+            splits.sort()
+            for part in np.split(np.frombuffer(data, np.uint8), splits):
+                comm.write(part.tobytes())
+            self.assertEqual(comm.mems, ref.mems)
+            self.assertEqual(comm.checksum, ref.checksum)
+            self.assertEqual(comm.bytes_received, len(data))
+
+    def test_readfrom(self):
+        data = self.dump(make_program())
+        ref = Comm()
+        ref.write(data)
+        self.comm.readfrom(io.BytesIO(data), chunk_size=7)
+        self.assertEqual(self.comm.checksum, ref.checksum)
+
+    def test_board(self):
+        self.dev.write_mem(1, 2, b"\x01\x02\x03", board=1)
+        self.assertEqual(self.comm.mems[1][1][:6], b"\x00\x00\x01\x02\x03\x00")
+        self.assertEqual(self.comm.mems[0][1], bytes(12))
+        self.assertEqual(self.comm.mems[2][1], bytes(12))
+        # all boards checksum all data
+        self.assertEqual(self.comm.checksum, [self.dev.checksum]*3)
+
+    def test_registers(self):
+        self.dev.set_config(enable=1, board=2)
+        self.assertEqual(self.comm.config, [0, 0, 0x04 | 0xe0])
+        self.dev.set_frame(7)
+        self.assertEqual(self.comm.frame, [7]*3)
+        self.dev.set_reg(3, 9, board=0)
+        self.assertEqual(self.comm.frame, [9, 7, 7])
+        self.assertEqual(self.comm.checksum[2], self.dev.checksum)
+        self.dev.set_crc(0x12)
+        self.assertEqual(self.comm.checksum, [0x12]*3)
+        # register read on board 2, the answer is not checksummed
+        self.dev.write(b"\x10\x00")
+        self.assertEqual(self.comm.checksum,
+                         [crc8(b"\x10\x00", 0x12)]*2 + [crc8(b"\x10", 0x12)])
+        self.dev.set_config(reset=1)
+        self.assertEqual(self.comm.config, [0]*3)
+        self.assertEqual(self.comm.frame, [0]*3)
+        self.assertEqual(self.comm.checksum, [0]*3)
+
+    def test_framing(self):
+        # data outside of frames and unknown commands are ignored
+        self.comm.write(b"\xf8\x04\xa5\x01\xf8\x04")
+        self.comm.write(b"\xa5\x02\xf8\xa5\x07\x04\xa5\x03\xf8\x05")
+        self.assertEqual(self.comm.config, [0x04]*3)
+
+    def test_wrap(self):
+        # word address wraps at the address width
+        self.dev.write_mem(0, 0x1000 + 14, b"\x01\x02\x03\x04")
+        self.assertEqual(self.comm.mems[0][0][:2], b"\x03\x04")
+        self.assertEqual(self.comm.mems[0][0][14:], b"\x01\x02")
+        # out of range memories map to the last
+        self.dev.write_mem(3, 0, b"\x05", board=0)
+        self.assertEqual(self.comm.mems[0][2][:1], b"\x05")
+        # beyond the depth of the memory
+        self.dev.write_mem(1, 12, b"\x06\x07\x08\x09", board=0)
+        self.assertEqual(self.comm.mems[0][1], bytes(12))
+        self.dev.write_mem(1, 14, b"\x06\x07\x08\x09\x0a", board=0)
+        self.assertEqual(self.comm.mems[0][1][:2], b"\x08\x09")
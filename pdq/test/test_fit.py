@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from ..host.fit import fit, bias_output, quantize
+from ..host.protocol import Segment
+
+
+def output(lines):
+    return np.concatenate([
+        bias_output(line["channel_data"][0]["bias"]["amplitude"],
+                    line["duration"])
+        for line in lines])/Segment.out_scale
+
+
+class TestFit(unittest.TestCase):
+    def test_output(self):
+        amplitude = [-1.2, 3e-4, -2e-8, 1e-12]
+        d = quantize(amplitude)
+        v = [d[0] << 32, d[1] << 16, d[2], d[3]]
+        ref = []
+        for k in range(1000):
+            ref.append(((v[0] >> 32) + (1 << 15)) % (1 << 16) - (1 << 15))
+            v[0] += v[1]
+            v[1] += v[2]
+            v[2] += v[3]
+        np.testing.assert_equal(bias_output(amplitude, 1000), ref)
+
+    def test_tolerance(self):
+        t = np.arange(0, 200000, 3)
+        v = 4*np.sin(t*2e-4) + np.cos(t*3e-5)
+        tol = 2e-3
+        lines = fit(t, v, tol)
+        self.assertLess(len(lines), len(t)//100)
+        self.assertEqual(sum(line["duration"] for line in lines), t[-1])
+        for line in lines:
+            self.assertLess(line["duration"], Segment.max_time)
+        out = output(lines)[t[:-1]]
+        self.assertLessEqual(np.abs(out - v[:-1]).max(), tol)
+        segment = Segment()
+        for line in lines:
+            segment.bias(duration=line["duration"],
+                         **line["channel_data"][0]["bias"])
+
+    def test_order(self):
+        t = np.arange(1000)
+        lines = fit(t, 1 + t*1e-3, 1e-3)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(
+            len(lines[0]["channel_data"][0]["bias"]["amplitude"]), 2)
+        lines = fit(t, 1 + t*1e-3, 1e-3, order=0)
+        self.assertGreater(len(lines), 100)
+
+    def test_step(self):
+        t = np.arange(4000)
+        v = np.where(t % 1000 < 500, 9., -9.)
+        lines = fit(t, v, 1e-3)
+        self.assertEqual(len(lines), 15)
+        segment = Segment()
+        for line in lines:
+            segment.bias(duration=line["duration"],
+                         **line["channel_data"][0]["bias"])
+        out = output(lines)
+        np.testing.assert_allclose(out, v[:-1], atol=1e-3)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            fit([0, 2, 1], [0, 0, 0], 1e-3)
+        with self.assertRaises(ValueError):
+            fit([0, 1], [0, 11], 1e-3)
@@ -0,0 +1,62 @@
+import time
+import unittest
+
+from ..host.group import PDQGroup, split_program
+from .test_program import MemPDQ, make_program
+
+
+class SlowPDQ(MemPDQ):
+    """PDQ stack with a slow link."""
+    def write_mem(self, mem, adr, data, board=0xf):
+        time.sleep(.02)
+        MemPDQ.write_mem(self, mem, adr, data, board)
+
+    def set_reg(self, adr, data, board):
+        self.writes.append(("reg", adr, data, board))
+
+
+class TestGroup(unittest.TestCase):
+    def setUp(self):
+        self.pdqs = [SlowPDQ(num_boards=b, cache_size=0) for b in (1, 2, 1)]
+        self.group = PDQGroup(self.pdqs)
+        self.program = make_program(num_channels=12)
+
+    def tearDown(self):
+        self.group.close()
+
+    def test_split(self):
+        programs = split_program(self.program, [3, 6, 3])
+        self.assertEqual(len(programs[1][2][5]["channel_data"]), 6)
+        self.assertEqual(programs[1][2][5]["channel_data"][0],
+                         self.program[2][5]["channel_data"][3])
+        self.assertEqual(programs[2][0][0]["duration"],
+                         self.program[0][0]["duration"])
+        self.assertEqual(len(self.program[0][0]["channel_data"]), 12)
+
+    def test_program(self):
+        self.group.program(self.program)
+        for pdq, program in zip(self.pdqs, split_program(
+                self.program, [3, 6, 3])):
+            ref = MemPDQ(num_boards=pdq.num_boards, cache_size=0)
+            ref.program(program)
+            self.assertEqual(pdq.mems, ref.mems)
+        # the links are used concurrently
+        self.assertLess(self.group.wall_time,
+                        .8*sum(self.group.upload_times))
+
+    def test_fanout(self):
+        self.group.set_frame(3)
+        self.group.set_config(enable=1)
+        for pdq in self.pdqs:
+            self.assertEqual(pdq.writes, [("reg", 2, 3, 0xf),
+                                          ("reg", 0, 0xe4, 0xf)])
+        self.assertLess(self.group.skew, .1)
+
+    def test_error(self):
+        def write_mem(mem, adr, data, board=0xf):
+            raise IOError
+        self.pdqs[1].write_mem = write_mem
+        with self.assertRaises(IOError):
+            self.group.program(self.program)
+        # the other stacks complete
+        self.assertEqual(len(self.pdqs[2].mems), 3)
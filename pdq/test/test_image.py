@@ -0,0 +1,99 @@
+import base64
+import io
+import os
+import tempfile
+import unittest
+
+from ..host.cli import main
+from ..host.image import PDQImage, ImageError
+from ..host.usb import PDQ
+from .test_program import MemPDQ, make_program
+
+
+class TestImage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, "test.pdqimg")
+        self.program = make_program()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        dev = MemPDQ(num_boards=2)
+        dev.save_image(self.filename, self.program)
+        self.assertEqual(dev.mems, {})
+        with PDQImage.open(self.filename) as img:
+            self.assertEqual(img.geometry(), dict(
+                num_boards=2, num_dacs=3, num_frames=32))
+            self.assertEqual(img.mem_sizes, dev._mem_sizes[3])
+            self.assertEqual([c for c, data in img.images], list(range(6)))
+            table = img.table(0)
+            self.assertEqual(len(table), 32)
+            self.assertEqual(table[0], 32)
+        new = MemPDQ(num_boards=2)
+        new.load_image(self.filename)
+        ref = MemPDQ(num_boards=2)
+        ref.program(self.program)
+        self.assertEqual(new.mems, ref.mems)
+
+    def test_checksum(self):
+        MemPDQ().save_image(self.filename, self.program)
+        dev = PDQ(dev=io.BytesIO())
+        checksum = dev.load_image(self.filename)
+        self.assertEqual(dev.checksum, checksum)
+        ref = PDQ(dev=io.BytesIO())
+        ref.program(self.program)
+        self.assertEqual(dev.dev.getvalue(), ref.dev.getvalue())
+
+    def test_differential(self):
+        dev = MemPDQ()
+        dev.program(self.program)
+        dev.save_image(self.filename)
+        written = dev.bytes_written
+        dev.load_image(self.filename)
+        self.assertEqual(dev.bytes_written, written)
+        dev.load_image(self.filename, force_full=True)
+        self.assertGreater(dev.bytes_written, written)
+
+    def test_mismatch(self):
+        MemPDQ().save_image(self.filename, self.program)
+        with self.assertRaises(ImageError):
+            MemPDQ(num_boards=2).load_image(self.filename)
+        with self.assertRaises(ImageError):
+            MemPDQ(num_frames=8).load_image(self.filename)
+
+    def test_corrupt(self):
+        MemPDQ().save_image(self.filename, self.program)
+        with open(self.filename, "r+b") as f:
+            f.seek(-3, 2)
+            c = f.read(1)
+            f.seek(-3, 2)
+            f.write(bytes([c[0] ^ 1]))
+        with self.assertRaises(ImageError):
+            PDQImage.open(self.filename)
+        with open(self.filename, "wb") as f:
+            f.write(b"PDQ")
+        with self.assertRaises(ImageError):
+            PDQImage.open(self.filename)
+
+    def test_cli(self):
+        MemPDQ(num_boards=1).save_image(self.filename, self.program)
+        dump = os.path.join(self.dir.name, "dump.bin")
+        main(args=["-u", dump, "-f", "2", "load", self.filename])
+        with open(dump, "rb") as f:
+            data = f.read()
+        ref = PDQ(dev=io.BytesIO(), num_boards=1)
+        ref.program(self.program)
+        self.assertIn(ref.dev.getvalue(), data)
+
+    def test_program_image(self):
+        dev = MemPDQ(num_boards=1)
+        data = dev.encode_image(self.program)
+        self.assertEqual(dev.mems, {})
+        ref = MemPDQ(num_boards=1)
+        ref.program(self.program)
+        for payload in data, base64.b64encode(data).decode():
+            new = MemPDQ(num_boards=1)
+            new.program_image(payload)
+            self.assertEqual(new.mems, ref.mems)
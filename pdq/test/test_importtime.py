@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import pdq
+
+
+def import_times(*args):
+    """Run the CLI with ``-X importtime``.
+
+    Returns:
+        dict: Cumulative import time in seconds of each top level module.
+    """
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(pdq.__file__)))
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "pdq.host.cli"] +
+        list(args), cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative, name = line[12:].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        if not name.startswith("  "):  # one space after the separator
+            times[name.strip()] = int(cumulative)*1e-6
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    # generous budgets in seconds, the actual times are much smaller
+    help_budget = .15
+    upload_budget = .6
+    heavy = "scipy", "serial", "artiq"
+
+    def check(self, budget, *args):
+        times = min((import_times(*args) for i in range(2)),
+                    key=lambda t: sum(t.values()))
+        for name in times:
+            self.assertNotIn(name.split(".")[0], self.heavy)
+        self.assertLess(sum(times.values()), budget, times)
+        return times
+
+    def test_help(self):
+        times = self.check(self.help_budget, "--help")
+        self.assertNotIn("numpy", times)
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.check(self.upload_budget, "-u", os.path.join(d, "dump.bin"),
+                       "-o", "0")
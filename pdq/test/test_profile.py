@@ -0,0 +1,59 @@
+import io
+import unittest
+
+from ..host.profile import Profile, span
+from ..host.usb import PDQ
+from .test_program import MemPDQ, make_program
+
+
+class TestProfile(unittest.TestCase):
+    def test_span(self):
+        p = Profile()
+        for i in range(3):
+            with p.span("a"):
+                pass
+        p.count("b", 5)
+        p.count("b")
+        self.assertEqual(p.calls["a"], 3)
+        self.assertGreaterEqual(p.times["a"], 0)
+        self.assertEqual(p.counts["b"], 6)
+        self.assertIn("a", p.report())
+        p.reset()
+        self.assertEqual(p.times, {})
+
+    def test_disabled(self):
+        with span(None, "a"):
+            pass
+
+    def test_callback(self):
+        seen = []
+        p = Profile(lambda name, t: seen.append(name))
+        with span(p, "a"):
+            with span(p, "b"):
+                pass
+        self.assertEqual(seen, ["b", "a"])
+
+    def test_program(self):
+        dev = MemPDQ(num_boards=1)
+        dev.profile = Profile()
+        program = make_program()
+        dev.program(program)
+        p = dev.profile
+        for name in "encode serialize write".split():
+            self.assertIn("program." + name, p.times)
+        self.assertEqual(p.calls["program.write"], dev.num_channels)
+        self.assertEqual(p.counts["program.lines"], 4*20)
+        self.assertEqual(p.counts["program.bytes"],
+                         sum(len(m) for m in dev.mems.values()))
+
+    def test_usb(self):
+        dev = PDQ(dev=io.BytesIO(), num_boards=1)
+        dev.profile = Profile()
+        dev.program(make_program())
+        p = dev.profile
+        for name in "crc escape device".split():
+            self.assertIn("write." + name, p.times)
+        self.assertEqual(p.counts["write.device_bytes"],
+                         len(dev.dev.getvalue()))
+        self.assertLessEqual(p.times["write.device"],
+                             p.times["program.write"])
@@ -0,0 +1,245 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from ..host.protocol import PDQBase, ChannelMemoryError, diff_ranges
+
+
+class MemPDQ(PDQBase):
+    """PDQ stack that records memory writes."""
+    def __init__(self, **kwargs):
+        PDQBase.__init__(self, **kwargs)
+        self.mems = {}
+        self.writes = []
+
+    def write_mem(self, mem, adr, data, board=0xf):
+        self.writes.append((board, mem, adr, len(data)))
+        m = self.mems.setdefault((board, mem), bytearray())
+        if len(m) < adr + len(data):
+            m.extend(bytes(adr + len(data) - len(m)))
+        m[adr:adr + len(data)] = data
+
+
+def make_program(num_frames=4, num_lines=20, num_channels=3, offset=0.):
+    return [
+        [
+            {
+                "duration": 10 + j,
+                "channel_data": [
+                    {"bias": {"amplitude": [offset + .1*i + .01*k, 1e-3*j]}}
+                    for k in range(num_channels)
+                ],
+            }
+            for j in range(num_lines)
+        ]
+        for i in range(num_frames)
+    ]
+
+
+class TestDiff(unittest.TestCase):
+    def test_ranges(self):
+        old = bytes(40)
+        new = bytearray(old)
+        new[4] = 1
+        new[8] = 1
+        new[30] = 1
+        self.assertEqual(diff_ranges(old, new), [(4, 6), (8, 10), (30, 32)])
+        self.assertEqual(diff_ranges(old, new, 2), [(4, 10), (30, 32)])
+        self.assertEqual(diff_ranges(old, new + b"\0\0", 2),
+                         [(4, 10), (30, 32), (40, 42)])
+        self.assertEqual(diff_ranges(old, old), [])
+
+
+class TestShadow(unittest.TestCase):
+    def setUp(self):
+        self.dev = MemPDQ(num_boards=1)
+
+    def check_mems(self):
+        for i, channel in enumerate(self.dev.channels):
+            board, mem = divmod(i, self.dev.num_dacs)
+            data = channel.serialize()
+            self.assertEqual(self.dev.mems[board, mem][:len(data)], data)
+
+    def test_incremental(self):
+        program = make_program()
+        self.dev.program(program)
+        self.assertEqual(len(self.dev.writes), 3)
+        self.assertEqual(self.dev.bytes_skipped, 0)
+        total = self.dev.bytes_written
+        program[2][5]["channel_data"][1]["bias"]["amplitude"][0] += .5
+        del self.dev.writes[:]
+        self.dev.program(program)
+        # table, two frames, five lines, line header
+        adr = 2*32 + 2*204 + 5*10 + 4
+        self.assertEqual(self.dev.writes, [(0, 1, adr, 2)])
+        self.assertEqual(self.dev.bytes_written, total + 2)
+        self.assertEqual(self.dev.bytes_skipped, total - 2)
+        self.check_mems()
+
+    def test_force_full(self):
+        program = make_program()
+        self.dev.program(program)
+        total = self.dev.bytes_written
+        self.dev.program(program, force_full=True)
+        self.assertEqual(self.dev.bytes_written, 2*total)
+        self.dev.program(make_program(num_frames=5, offset=.3))
+        self.check_mems()
+
+    def test_failed_write(self):
+        self.dev.program(make_program())
+        write_mem = self.dev.write_mem
+
+        def fail(mem, adr, data, board=0xf):
+            write_mem(mem, adr, data[:len(data)//2], board)
+            raise IOError("write failed")
+        self.dev.write_mem = fail
+        program = make_program(offset=.3)
+        with self.assertRaises(IOError):
+            self.dev.program(program)
+        self.dev.write_mem = write_mem
+        del self.dev.writes[:]
+        self.dev.program(program)
+        self.assertIn((0, 0, 0, len(self.dev.channels[0].serialize())),
+                      self.dev.writes)
+        self.check_mems()
+
+
+class TestFrame(unittest.TestCase):
+    def setUp(self):
+        self.dev = MemPDQ(num_boards=1)
+        self.dev.program(make_program())
+
+    def frame_data(self, channel, frame):
+        board, mem = divmod(channel, self.dev.num_dacs)
+        m = self.dev.mems[board, mem]
+        adr = 2*(m[2*frame] | m[2*frame + 1] << 8)
+        segment = self.dev.channels[channel].segments[frame]
+        self.assertEqual(adr, 2*segment.addr)
+        return m[adr:adr + len(segment.data)], segment.data
+
+    def test_same_size(self):
+        addr = self.dev.channels[0].segments[1].addr
+        frame = make_program(offset=.5)[1]
+        del self.dev.writes[:]
+        self.dev.program_frame(1, frame)
+        self.assertEqual(self.dev.channels[0].segments[1].addr, addr)
+        # only constant coefficients change, table entries unchanged
+        self.assertEqual(len(self.dev.writes), 3*20)
+        for i in range(3):
+            a, b = self.frame_data(i, 1)
+            self.assertEqual(a, b)
+
+    def test_larger(self):
+        end = self.dev.channels[0].serialize()
+        frame = make_program(num_lines=30, offset=.5)[2]
+        self.dev.program_frame(2, frame, channels=[0])
+        self.assertEqual(2*self.dev.channels[0].segments[2].addr, len(end))
+        a, b = self.frame_data(0, 2)
+        self.assertEqual(a, b)
+        for i in 0, 1, 3:
+            a, b = self.frame_data(0, i)
+            self.assertEqual(a, b)
+
+    def test_append(self):
+        self.dev.program_frame(4, make_program()[0])
+        a, b = self.frame_data(2, 4)
+        self.assertEqual(a, b)
+        with self.assertRaises(ValueError):
+            self.dev.program_frame(6, make_program()[0])
+
+    def small_dev(self):
+        dev = self.dev = MemPDQ(num_boards=1)
+        for channel in dev.channels:
+            channel.max_data = 32 + 4*204//2 + 100
+        dev.program(make_program())
+        dev.program_frame(2, make_program(num_lines=5)[2])
+        return dev
+
+    def test_compact(self):
+        dev = self.small_dev()
+        frame = make_program(num_lines=30)[0]
+        with self.assertRaises(ChannelMemoryError):
+            dev.program_frame(0, frame)
+        dev.compact()
+        dev.program_frame(0, frame)
+        for i in range(3):
+            self.assertEqual(dev.channels[i].free_bytes(),
+                             2*(75 + 100 + 102 - 152))
+            for j in range(4):
+                a, b = self.frame_data(i, j)
+                self.assertEqual(a, b)
+
+    def test_compact_order(self):
+        dev = self.small_dev()
+        dev.program_frame(0, make_program(num_lines=5)[0])
+        del dev.writes[:]
+        dev.compact([0])
+        segments = dev.channels[0].segments
+        # each moved segment is followed by its table entry
+        self.assertEqual(dev.writes, [
+            (0, 0, 2*segments[1].addr, 204), (0, 0, 2*1, 2),
+            (0, 0, 2*segments[2].addr, 54), (0, 0, 2*2, 2),
+            (0, 0, 2*segments[3].addr, 204), (0, 0, 2*3, 2)])
+        for j in range(4):
+            a, b = self.frame_data(0, j)
+            self.assertEqual(a, b)
+
+    def test_atomic(self):
+        dev = self.small_dev()
+        dev.compact([0, 1])
+        addrs = [[s.addr for s in ch.segments] for ch in dev.channels]
+        free = [ch.free_bytes() for ch in dev.channels]
+        del dev.writes[:]
+        with self.assertRaises(ChannelMemoryError):
+            dev.program_frame(0, make_program(num_lines=30)[0])
+        self.assertEqual(dev.writes, [])
+        self.assertEqual(
+            [[s.addr for s in ch.segments] for ch in dev.channels], addrs)
+        self.assertEqual([ch.free_bytes() for ch in dev.channels], free)
+        dev.compact([2])
+        dev.program_frame(0, make_program(num_lines=30)[0])
+        for i in range(3):
+            for j in range(4):
+                a, b = self.frame_data(i, j)
+                self.assertEqual(a, b)
+
+
+class TestMemory(unittest.TestCase):
+    def test_size(self):
+        for num_dacs in 1, 2, 3:
+            dev = MemPDQ(num_boards=1, num_dacs=num_dacs)
+            self.assertEqual(
+                [channel.max_data for channel in dev.channels],
+                [m << 10 for m in PDQBase._mem_sizes[num_dacs]])
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.program = make_program(num_frames=6, num_channels=9)
+        self.program[1][3]["channel_data"][4]["silence"] = True
+        self.ref = MemPDQ(cache_size=0)
+        self.ref.program(self.program)
+
+    def test_threads(self):
+        for cache_size in 0, 1 << 20:
+            p = MemPDQ(cache_size=cache_size)
+            with ThreadPoolExecutor(3) as executor:
+                p.program(self.program, executor=executor)
+                self.assertEqual(p.mems, self.ref.mems)
+                p.program(self.program, executor=executor)
+            self.assertEqual(p.mems, self.ref.mems)
+
+    def test_processes(self):
+        p = MemPDQ()
+        p.program(self.program, workers=2)
+        self.assertEqual(p.mems, self.ref.mems)
+        self.assertEqual(p.frame_cache.misses, 6)
+
+    def test_channels(self):
+        p = MemPDQ()
+        program = make_program(num_channels=2)
+        with ThreadPoolExecutor(2) as executor:
+            p.program(program, [7, 1], executor=executor)
+        ref = MemPDQ()
+        ref.program(program, [7, 1])
+        self.assertEqual(p.mems, ref.mems)
+        self.assertEqual(sorted(p.mems), [(0, 1), (2, 1)])
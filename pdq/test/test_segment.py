@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+
+from ..host.protocol import Segment
+
+
+class TestMany(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+        self.n = 20
+
+    def coefficients(self, m, scale=(1., 1e-2, 1e-5, 1e-8)):
+        return self.rs.uniform(-1, 1, (self.n, m))*scale[:m]
+
+    def durations(self):
+        return self.rs.randint(1, Segment.max_time, self.n)
+
+    def test_bias(self):
+        for m in range(5):
+            amplitude = self.coefficients(m)
+            duration = self.durations()
+            trigger = self.rs.rand(self.n) > .5
+            ref = Segment()
+            for a, d, t in zip(amplitude, duration, trigger):
+                ref.bias(list(a), duration=int(d), trigger=bool(t), shift=3)
+            seg = Segment()
+            seg.bias_many(duration, amplitude, trigger=trigger, shift=3)
+            self.assertEqual(seg.data, ref.data)
+
+    def test_dds(self):
+        for m, k in (0, 0), (2, 0), (4, 0), (4, 1), (4, 3):
+            amplitude = self.coefficients(m)
+            phase = self.coefficients(k, (.4, 1e-2, 1e-5))
+            duration = self.durations()
+            ref = Segment()
+            for a, p, d in zip(amplitude, phase, duration):
+                ref.dds(list(a), list(p), duration=int(d), clear=True)
+            seg = Segment()
+            seg.dds_many(duration, amplitude, phase, clear=True)
+            self.assertEqual(seg.data, ref.data)
+
+    def test_overflow(self):
+        with self.assertRaises(ValueError):
+            Segment().bias_many([1], [[11.]])
+        with self.assertRaises(ValueError):
+            Segment().bias_many([1 << 16], [[1.]])
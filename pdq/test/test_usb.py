@@ -0,0 +1,254 @@
+import asyncio
+from concurrent.futures import CancelledError
+import threading
+import unittest
+import io
+
+from ..host.protocol import crc8
+from ..host.usb import PDQ
+from .test_program import MemPDQ, make_program
+
+
+class MemUSB(MemPDQ, PDQ):
+    pass
+
+
+class TestWrite(unittest.TestCase):
+    def setUp(self):
+        self.dev = PDQ(dev=io.BytesIO())
+
+    def test_escape(self):
+        self.dev.write(b"\x01\xa5", bytearray(b"\xa5\x02"))
+        self.assertEqual(self.dev.dev.getvalue(),
+                         b"\xa5\x02\x01\xa5\xa5\xa5\xa5\x02\xa5\x03")
+        self.assertEqual(self.dev.checksum, crc8(b"\x01\xa5\xa5\x02"))
+
+    def test_write_mem(self):
+        self.dev.write_mem(1, 0x1234, b"\x05\x06", board=2)
+        self.assertEqual(self.dev.dev.getvalue(),
+                         b"\xa5\x02\x95\x34\x12\x05\x06\xa5\x03")
+
+
+class SlowDev:
+    """Device that accepts only some of the data at a time."""
+    def __init__(self, max_write, stall=True):
+        self.max_write = max_write
+        self.stall = stall
+        self.data = bytearray()
+        self.writes = []
+        self.flushes = 0
+        self.full = False
+
+    def write(self, data):
+        if self.full:
+            return 0
+        self.full = self.stall
+        n = min(len(data), self.max_write)
+        self.data += data[:n]
+        self.writes.append(len(data))
+        return n
+
+    def flush(self):
+        self.flushes += 1
+        self.full = False
+
+    def close(self):
+        pass
+
+
+class TestChunked(unittest.TestCase):
+    def test_chunks(self):
+        data = bytes(range(256))*40 + b"\xa5"*300
+        ref = PDQ(dev=io.BytesIO())
+        ref.write(b"\x01", data)
+        for chunk_size in 1, 7, 256, 1 << 16:
+            dev = PDQ(dev=SlowDev(1000), chunk_size=chunk_size)
+            dev.write(b"\x01", memoryview(data))
+            self.assertEqual(dev.dev.data, ref.dev.getvalue())
+            self.assertEqual(dev.checksum, ref.checksum)
+            self.assertLessEqual(max(dev.dev.writes), max(2*chunk_size, 4))
+            self.assertGreater(dev.dev.flushes, 0)
+
+    def test_coalesce(self):
+        dev = PDQ(dev=SlowDev(1 << 20))
+        dev.set_frame(3)
+        self.assertEqual(dev.dev.writes, [6])
+        dev.write_mem(0, 0, bytes(1 << 17))
+        self.assertEqual(dev.dev.writes[1:], [5, 1 << 16, 1 << 16, 2])
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dev = PDQ(dev=SlowDev(1 << 20, stall=False), chunk_size=64)
+        self.ref = PDQ(dev=io.BytesIO())
+
+    def commands(self, dev):
+        dev.set_crc(0)
+        dev.set_frame(3)
+        dev.write_mem(1, 0x10, b"\xa5\x01", board=2)
+        dev.set_config(enable=1)
+
+    def test_batch(self):
+        self.commands(self.ref)
+        with self.dev.batch():
+            self.commands(self.dev)
+            self.assertEqual(self.dev.dev.writes, [])
+        self.assertEqual(self.dev.dev.data, self.ref.dev.getvalue())
+        self.assertEqual(self.dev.checksum, self.ref.checksum)
+        self.assertEqual(self.dev.device_writes, 1)
+        self.assertEqual(self.dev.writes_saved, 3)
+
+    def test_nested(self):
+        with self.dev.batch():
+            self.dev.set_frame(1)
+            with self.dev.batch():
+                self.dev.set_frame(2)
+            self.assertEqual(self.dev.device_writes, 0)
+            self.dev.flush()
+            self.assertEqual(self.dev.device_writes, 1)
+            self.dev.set_frame(3)
+        self.assertEqual(self.dev.device_writes, 2)
+        self.assertEqual(self.dev.writes_saved, 1)
+        self.dev.set_frame(4)
+        self.assertEqual(self.dev.device_writes, 3)
+
+    def test_large(self):
+        for dev in self.ref, self.dev:
+            with dev.batch():
+                dev.set_frame(1)
+                dev.write_mem(0, 0, bytes(range(256)))
+                dev.set_frame(2)
+        self.assertEqual(self.dev.dev.data, self.ref.dev.getvalue())
+        self.assertEqual(self.dev.dev.writes, [11, 64, 64, 65, 64, 8])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with self.dev.batch():
+                self.dev.set_frame(1)
+                raise ValueError
+        self.assertEqual(self.dev.device_writes, 1)
+        self.dev.set_frame(2)
+        self.assertEqual(self.dev.device_writes, 2)
+
+
+class GatedDev(SlowDev):
+    """Device that blocks writes until opened."""
+    def __init__(self):
+        SlowDev.__init__(self, 1 << 30, stall=False)
+        self.gate = threading.Event()
+
+    def write(self, data):
+        self.gate.wait()
+        return SlowDev.write(self, data)
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.programs = [make_program(offset=i) for i in range(3)]
+        self.ref = PDQ(dev=io.BytesIO())
+        for program in self.programs:
+            self.ref.program(program)
+            self.ref.set_frame(1)
+
+    def test_submit(self):
+        dev = PDQ(dev=GatedDev(), max_pending=8)
+        futures = []
+        for program in self.programs:
+            futures.append(dev.submit(dev.program, program))
+            futures.append(dev.submit(dev.set_frame, 1))
+        # the writer is blocked on the first transaction
+        self.assertFalse(any(f.done() for f in futures))
+        self.assertFalse(any(f.running() for f in futures[1:]))
+        dev.dev.gate.set()
+        dev.drain()
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertEqual(dev.dev.data, self.ref.dev.getvalue())
+        self.assertEqual(dev.checksum, self.ref.checksum)
+        dev.close()
+
+    def test_program_async(self):
+        dev = PDQ(dev=SlowDev(1 << 30, stall=False))
+
+        async def run():
+            for program in self.programs:
+                await dev.program_async(program)
+                dev.set_frame(1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(dev.dev.data, self.ref.dev.getvalue())
+        dev.close()
+
+    def test_cancel(self):
+        dev = PDQ(dev=GatedDev())
+        first = dev.submit(dev.program, self.programs[0])
+        # wait for the writer to block on the first transaction
+        while dev._pending.qsize():
+            threading.Event().wait(1e-3)
+        second = dev.submit(dev.program, self.programs[1])
+        frame = dev.submit(dev.set_frame, 1)
+        third = dev.submit(dev.program, self.programs[2])
+        self.assertTrue(second.cancel())
+        dev.dev.gate.set()
+        dev.drain()
+        self.assertIsNone(first.result())
+        self.assertIsNone(frame.result())
+        with self.assertRaises(CancelledError):
+            second.result()
+        # was encoded against the shadow of the second program
+        self.assertTrue(third.cancelled())
+        # complete rewrite
+        written = dev.bytes_written
+        dev.program(self.programs[2])
+        ref = MemPDQ()
+        ref.program(self.programs[2])
+        self.assertEqual(dev.bytes_written - written, ref.bytes_written)
+        dev.close()
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.program = make_program(num_frames=8, num_channels=9)
+        self.program[5] = self.program[2]
+        self.ref = MemPDQ(cache_size=0)
+        self.ref.program(self.program)
+
+    def test_identical(self):
+        p = MemUSB()
+        p.program_stream(iter(self.program))
+        self.assertEqual(p.mems, self.ref.mems)
+        self.assertEqual(
+            [s.addr for s in p.channels[4].segments],
+            [s.addr for s in self.ref.channels[4].segments])
+        # table is written last
+        self.assertEqual(p.writes[-1][:3], (2, 2, 0))
+
+    def test_bounded(self):
+        p = MemUSB()
+        produced = []
+        written = []
+
+        def frames():
+            for frame in make_program(num_frames=8):
+                produced.append(frame)
+                yield frame
+
+        def write_mem(mem, adr, data, board=0xf):
+            written.append(len(produced))
+            MemPDQ.write_mem(p, mem, adr, data, board)
+
+        p.write_mem = write_mem
+        p.program_stream(frames(), channels=[0], queue_size=1)
+        self.assertEqual(len(written), 10)
+        for i, n in enumerate(written[1:-1]):
+            self.assertLessEqual(n, i + 4)
+
+    def test_error(self):
+        p = MemUSB()
+        program = make_program(num_frames=40)
+        with self.assertRaises(ValueError):
+            p.program_stream(program)
+        self.assertEqual(p.mems[0, 0][:64], bytes(64))